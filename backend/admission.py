@@ -0,0 +1,243 @@
+"""Admission control: per-route-class concurrency limits and per-client rate limits.
+
+Without it every request is accepted, and under a spike they all queue inside
+the server until each one is past its deadline, cheap reads included.
+`AdmissionMiddleware` sorts API requests into classes (`route_class`) and
+gives each class its own `ConcurrencyLimiter`. A limiter runs at most `limit`
+requests at once and queues at most `max_queue` more, each for at most
+`queue_timeout` seconds. Past either bound the request gets a 503 with
+`Retry-After` straight away, so a burst of logins (bcrypt) or analytics
+scans can only saturate their own class.
+
+Before that, `TokenBuckets` gives every client (as named by the controller's
+`client_key`: the user id from the bearer token, else the client address if
+anonymous limiting is on) `rate` requests per second with bursts of up to
+`burst`; over that it answers 429 with `Retry-After`. Requests without a key
+are not rate limited.
+
+Both are per worker process and use the event loop only. Operational routes
+(outside /api), CORS preflights and the long-lived event stream are never
+limited.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+from starlette.responses import Response
+
+import metrics
+from serialization import JSON_MEDIA_TYPE, dumps
+
+# Held open for the life of a client; a slot would never come back
+UNLIMITED_PATHS = frozenset({"/api/tasks/events"})
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """The admission class of a request, or None if it isn't limited."""
+    if not path.startswith("/api/") or method == "OPTIONS" or path in UNLIMITED_PATHS:
+        return None
+    if path.startswith("/api/auth/") and method == "POST":
+        return "auth"
+    if path.startswith("/api/analytics/"):
+        return "analytics"
+    return "reads" if method in ("GET", "HEAD") else "writes"
+
+
+class Shed(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    """At most `limit` holders; FIFO waiters beyond that, bounded in number and time."""
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued_total = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+
+    async def acquire(self) -> None:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed_queue_full += 1
+            raise Shed("queue_full")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        started = loop.time()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self.shed_timeout += 1
+            raise Shed("queue_timeout")
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot we may have been handed
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            waited = loop.time() - started
+            self.queue_seconds_total += waited
+            self.queue_seconds_max = max(self.queue_seconds_max, waited)
+            metrics.ADMISSION_QUEUE_SECONDS.labels(self.name).observe(waited)
+        self.admitted += 1
+
+    def release(self) -> None:
+        # Hand the slot straight to the oldest live waiter, so newcomers
+        # can't overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "queue_seconds_total": round(self.queue_seconds_total, 3),
+            "queue_seconds_max": round(self.queue_seconds_max, 3),
+        }
+
+
+class TokenBuckets:
+    """One token bucket per client key, least recently seen evicted first
+    (an evicted client just starts again with a full bucket)."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, key: Hashable) -> float:
+        """Spend a token: 0 if there was one, else the seconds until there is."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+            self.allowed += 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limiters: Dict[str, ConcurrencyLimiter],
+        buckets: Optional[TokenBuckets],
+        client_key: Callable[[dict], Optional[Hashable]],
+        retry_after: int = 1,
+    ):
+        self.limiters = limiters
+        self.buckets = buckets
+        self.client_key = client_key
+        self.retry_after = retry_after
+
+    def stats(self) -> dict:
+        return {
+            **{name: limiter.stats() for name, limiter in self.limiters.items()},
+            "rate_limit": self.buckets.stats() if self.buckets is not None else {},
+        }
+
+
+def _rejection(status_code: int, detail: str, retry_after: int) -> Response:
+    return Response(
+        content=dumps({"detail": detail}),
+        status_code=status_code,
+        media_type=JSON_MEDIA_TYPE,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying an `AdmissionController`; the slot is
+    held until the response (streamed ones included) has been sent."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = route_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        buckets = self.controller.buckets
+        key = self.controller.client_key(scope) if buckets is not None else None
+        if key is not None:
+            wait = buckets.take(key)
+            if wait:
+                metrics.ADMISSION_SHED.labels(name, "rate_limited").inc()
+                response = _rejection(429, "Too many requests, please slow down", math.ceil(wait))
+                await response(scope, receive, send)
+                return
+
+        limiter = self.controller.limiters.get(name)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Shed as exc:
+            metrics.ADMISSION_SHED.labels(name, exc.reason).inc()
+            response = _rejection(503, "Server busy, please retry", self.controller.retry_after)
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -0,0 +1,164 @@
+"""Server-side aggregation pipelines for the analytics routes."""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+
+def summary_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Totals plus per-category and per-priority breakdowns in one pass.
+
+    Only `category`, `priority` and `status` are projected, so with the
+    `(user_id, category, priority, status, ...)` index the scan is covered and
+    never touches the task documents themselves.
+    """
+    counts = {"total": {"$sum": 1}, "completed": {"$sum": "$completed"}}
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "category": 1,
+            "priority": 1,
+            "completed": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]},
+        }},
+        {"$facet": {
+            "totals": [{"$group": {"_id": None, **counts}}],
+            "by_category": [{"$group": {"_id": "$category", **counts}}, {"$sort": {"_id": 1}}],
+            "by_priority": [{"$group": {"_id": "$priority", **counts}}, {"$sort": {"_id": 1}}],
+        }},
+    ]
+
+
+def _breakdown(groups: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    return {g["_id"]: {"total": g["total"], "completed": g["completed"]} for g in groups}
+
+
+def summary_from_facets(facets: Dict[str, Any]) -> Dict[str, Any]:
+    totals = facets["totals"][0] if facets["totals"] else {"total": 0, "completed": 0}
+    return {
+        "total": totals["total"],
+        "completed": totals["completed"],
+        "by_category": _breakdown(facets["by_category"]),
+        "by_priority": _breakdown(facets["by_priority"]),
+    }
+
+
+def merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Add up `summary_from_facets` results (one per collection)."""
+    merged = {"total": 0, "completed": 0, "by_category": {}, "by_priority": {}}
+    for summary in summaries:
+        merged["total"] += summary["total"]
+        merged["completed"] += summary["completed"]
+        for breakdown in ("by_category", "by_priority"):
+            for key, counts in summary[breakdown].items():
+                bucket = merged[breakdown].setdefault(key, {"total": 0, "completed": 0})
+                bucket["total"] += counts["total"]
+                bucket["completed"] += counts["completed"]
+    return merged
+
+
+def summary_response(total: int, completed: int, by_category: Dict, by_priority: Dict) -> Dict[str, Any]:
+    completion_rate = (completed / total * 100) if total > 0 else 0
+    return {
+        "total_tasks": total,
+        "completed_tasks": completed,
+        "pending_tasks": total - completed,
+        "completion_rate": round(completion_rate, 1),
+        "by_category": by_category,
+        "by_priority": by_priority,
+    }
+
+
+def calendar_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Tasks and completed tasks per UTC day of `due_date`, in day order.
+
+    Only `due_date` and `status` are read, so with the
+    `(user_id, status, due_date, id)` index the scan is covered.
+    """
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$due_date"}},
+            "completed": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]},
+        }},
+        {"$group": {"_id": "$day", "total": {"$sum": 1}, "completed": {"$sum": "$completed"}}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def merge_calendar_days(day_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Add up `calendar_pipeline` results (one per collection) day by day."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for days in day_lists:
+        for d in days:
+            day = merged.setdefault(d["_id"], {"_id": d["_id"], "total": 0, "completed": 0})
+            day["total"] += d["total"]
+            day["completed"] += d["completed"]
+    return [merged[label] for label in sorted(merged)]
+
+
+def calendar_response(days: List[Dict[str, Any]], start: datetime, end: datetime) -> Dict[str, Any]:
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "days": [
+            {
+                "date": day["_id"],
+                "total": day["total"],
+                "completed": day["completed"],
+                "pending": day["total"] - day["completed"],
+            }
+            for day in days
+        ],
+    }
+
+
+# Bucket label formats; "week" matches the historical Python strftime("%Y-W%U")
+TREND_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%U", "month": "%Y-%m"}
+
+
+def trends_window_start(now: datetime, weeks: int, granularity: str) -> datetime:
+    """Start of the first whole bucket inside the last `weeks` weeks."""
+    midnight = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return midnight - timedelta(days=weeks * 7 - 1)
+    if granularity == "week":
+        # %U weeks start on Sunday
+        this_week = midnight - timedelta(days=(midnight.weekday() + 1) % 7)
+        return this_week - timedelta(weeks=weeks - 1)
+    return (midnight - timedelta(weeks=weeks)).replace(day=1)
+
+
+def trends_pipeline(user_id: str, start: datetime, granularity: str) -> List[Dict[str, Any]]:
+    """Created/completed counts per bucket, reading only tasks inside the window.
+
+    The `created_at` range is served by the `(user_id, created_at, id)` index.
+    """
+    return [
+        {"$match": {"user_id": user_id, "created_at": {"$gte": start}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": TREND_FORMATS[granularity], "date": "$created_at"}},
+            "created": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def merge_trend_buckets(bucket_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Add up `trends_pipeline` results (one per collection) label by label."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for buckets in bucket_lists:
+        for b in buckets:
+            bucket = merged.setdefault(b["_id"], {"_id": b["_id"], "created": 0, "completed": 0})
+            bucket["created"] += b["created"]
+            bucket["completed"] += b["completed"]
+    return [merged[label] for label in sorted(merged)]
+
+
+def trends_response(buckets: List[Dict[str, Any]], granularity: str) -> Dict[str, Any]:
+    return {
+        "trends": [
+            {granularity: b["_id"], "created": b["created"], "completed": b["completed"]}
+            for b in buckets
+        ]
+    }
@@ -0,0 +1,79 @@
+"""Short-lived per-user cache and single-flight for analytics reads.
+
+A user's entry holds their `task_stats` document (which is the summary, and
+whose `change_version` drives the ETags) plus any trends computed from the
+same state. Concurrent requests for the same user share one stats read and
+one computation per result; later requests within the TTL reuse them.
+
+Task writes in this process call `invalidate`, which drops the entry and
+makes sure a read already in flight can't put pre-write data back. Writes
+served by other workers become visible when the entry expires, so the TTL
+is kept to a few seconds.
+"""
+import itertools
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from caching import SingleFlight, TTLCache
+
+
+class AnalyticsEntry:
+    def __init__(self, generation: int, stats: Dict[str, Any]):
+        self.generation = generation
+        self.stats = stats
+        self.results: Dict[Hashable, Any] = {}
+
+    @property
+    def change_version(self) -> int:
+        return self.stats.get("change_version", 0)
+
+
+class AnalyticsCache:
+    def __init__(self, max_entries: int, ttl: float, load_stats: Callable[[str], Awaitable[Dict[str, Any]]]):
+        self._entries = TTLCache(max_entries, ttl)
+        self._flights = SingleFlight()
+        self._load_stats = load_stats
+        # user id -> marker of the stats read whose result may still be cached
+        self._loads: Dict[str, object] = {}
+        self._generations = itertools.count(1)
+        self.result_hits = 0
+        self.result_misses = 0
+
+    async def entry(self, user_id: str) -> AnalyticsEntry:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = await self._flights.run(("stats", user_id), lambda: self._load(user_id))
+        return entry
+
+    async def _load(self, user_id: str) -> AnalyticsEntry:
+        marker = self._loads[user_id] = object()
+        try:
+            entry = AnalyticsEntry(next(self._generations), await self._load_stats(user_id))
+            # Only cache if no write invalidated the user while we were reading
+            if self._loads.get(user_id) is marker:
+                self._entries.set(user_id, entry)
+            return entry
+        finally:
+            if self._loads.get(user_id) is marker:
+                del self._loads[user_id]
+
+    async def result(self, entry: AnalyticsEntry, user_id: str, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        """A value derived from `entry`'s state, computed once per entry."""
+        if key in entry.results:
+            self.result_hits += 1
+            return entry.results[key]
+        self.result_misses += 1
+        value = await self._flights.run((user_id, entry.generation, key), compute)
+        entry.results[key] = value
+        return value
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.invalidate(user_id)
+        self._flights.forget(("stats", user_id))
+        self._loads.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._entries.stats(),
+            "results": {"hits": self.result_hits, "misses": self.result_misses},
+            "single_flight": self._flights.stats(),
+        }
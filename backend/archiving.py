@@ -0,0 +1,78 @@
+"""Hot/cold tiering: moves old completed tasks out of the working set.
+
+Completed tasks whose last update is older than `max_age` are moved from
+`tasks` to `tasks_archive` by `TaskArchiver.run`, a background job started
+with the app. It works in batches of `batch_size` with a pause between them
+and sleeps `interval` seconds once nothing is left to move, so it trickles
+through a backlog without competing with request handling for the database.
+
+Archived tasks drop out of `get_tasks` (and its indexes) unless the caller
+passes `include_archived`, and out of delta sync. Editing one moves it back
+to the working set first (`Storage.restore_tasks`); deletes and exports
+reach both tiers. They still count towards analytics: the counters are never
+decremented for them, and trends and counter rebuilds read both tiers.
+Moving tasks either way bumps the user's `change_version`, so cached
+listings revalidate.
+"""
+import asyncio
+import logging
+import sqlite3
+from datetime import timedelta
+from typing import Optional
+
+from pymongo.errors import PyMongoError
+
+from dates import utc_now
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class TaskArchiver:
+    def __init__(self, max_age: timedelta, batch_size: int, pause: float, interval: float):
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.archived = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_run_seconds: Optional[float] = None
+
+    async def archive_once(self, storage: Storage) -> int:
+        """Move everything currently due, batch by batch; returns the count."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        moved = 0
+        while True:
+            per_user = await storage.archive_tasks(utc_now() - self.max_age, self.batch_size)
+            count = sum(per_user.values())
+            if count:
+                self.batches += 1
+                self.archived += count
+                moved += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        self.last_run_seconds = loop.time() - started
+        if moved:
+            logger.info("Archived %d completed task(s) in %.1fs", moved, self.last_run_seconds)
+        return moved
+
+    async def run(self, storage: Storage) -> None:
+        while True:
+            try:
+                await self.archive_once(storage)
+            except (PyMongoError, sqlite3.Error) as exc:
+                self.failures += 1
+                logger.warning("Archiving completed tasks failed, retrying in %.0fs: %s", self.interval, exc)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "max_age_days": self.max_age.total_seconds() / 86400,
+            "archived": self.archived,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_run_seconds": self.last_run_seconds,
+        }
@@ -0,0 +1,97 @@
+"""Micro-batching of single-document inserts.
+
+Under many concurrent `POST /api/tasks` calls, each `insert_one` is its own
+round trip. `InsertCoalescer` sends an insert straight away when no batch is
+being written; while one is, later inserts gather for up to `max_delay`
+seconds (or until `max_batch` are waiting) and go out together in one
+unordered batch insert (`Storage.insert_tasks`). Every caller still awaits its own document's
+outcome: the call returns once the batch holding it is acknowledged, or
+raises the write error for that document alone, so a response is never sent
+before its write is durable. At low load it behaves like `insert_one`.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+
+
+class InsertCoalescer:
+    def __init__(
+        self, insert_many: Callable[[List[dict]], Awaitable[Dict[int, Exception]]], max_batch: int, max_delay: float
+    ):
+        self._insert_many = insert_many
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.inserted = 0
+        self.failed = 0
+        self.largest_batch = 0
+
+    async def insert(self, document: dict) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future))
+        if not self._writes or len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        write = asyncio.create_task(self._write(batch))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        started = time.perf_counter()
+        try:
+            # Per-document failures come back by position
+            errors = await self._insert_many([document for document, _ in batch])
+        except Exception as exc:
+            errors = {index: exc for index in range(len(batch))}
+
+        metrics.INSERT_BATCH_SIZE.observe(len(batch))
+        metrics.INSERT_BATCH_SECONDS.observe(time.perf_counter() - started)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.failed += len(errors)
+        self.inserted += len(batch) - len(errors)
+        # No longer in flight: an insert made by a caller woken below goes
+        # straight out instead of waiting `max_delay` behind a finished write
+        self._writes.discard(asyncio.current_task())
+        for index, (_, future) in enumerate(batch):
+            # The caller may have gone away (client disconnect)
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+        # Whatever gathered while this batch was in flight goes next
+        if self._pending:
+            self._flush()
+
+    async def drain(self) -> None:
+        """Write anything still waiting and wait for in-flight batches."""
+        self._flush()
+        while self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,90 @@
+"""CPU cost of serializing GET /api/tasks responses: the Pydantic
+response_model path versus the orjson fast path.
+
+    python benchmarks/bench_serialization.py [--sizes 1000 10000] [--repeat 20]
+
+Both paths are timed from "documents fetched from Mongo" to "response body
+bytes", using FastAPI's own `serialize_response` for the Pydantic path. Prints
+one JSON object per size with per-request CPU milliseconds.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from serialization import json_response, trusted_tasks  # noqa: E402
+from server import Task, TaskPage  # noqa: E402
+
+
+def make_documents(count: int):
+    user_id = str(uuid.uuid4())
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "title": f"Task number {i}",
+            "description": "Pick up groceries and drop off the dry cleaning on the way back",
+            "due_date": start + timedelta(days=i % 90),
+            "priority": ("Low", "Medium", "High")[i % 3],
+            "category": ("Work", "Personal", "Health", "Study")[i % 4],
+            "status": "completed" if i % 3 == 0 else "pending",
+            "created_at": start + timedelta(minutes=i),
+            "updated_at": start + timedelta(minutes=i, seconds=30),
+            "version": 1,
+        }
+        for i in range(count)
+    ]
+
+
+async def pydantic_body(documents, field) -> bytes:
+    # What the route did before: build models, then FastAPI validates and
+    # serializes them again for response_model and json.dumps the result
+    page = TaskPage(tasks=[Task(**doc) for doc in documents], next_cursor=None)
+    content = await serialize_response(field=field, response_content=page, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def fast_body(documents) -> bytes:
+    return json_response({"tasks": trusted_tasks(documents), "next_cursor": None}).body
+
+
+async def cpu_ms(fn, repeat: int) -> float:
+    await fn()  # warm up
+    start = time.process_time()
+    for _ in range(repeat):
+        await fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+async def main(sizes, repeat):
+    field = create_response_field(name="response", type_=TaskPage)
+    for size in sizes:
+        documents = make_documents(size)
+        assert json.loads(await pydantic_body(documents, field)) == json.loads(await fast_body(documents))
+        before = await cpu_ms(lambda: pydantic_body(documents, field), repeat)
+        after = await cpu_ms(lambda: fast_body(documents), repeat)
+        print(json.dumps({
+            "tasks": size,
+            "pydantic_cpu_ms": round(before, 2),
+            "fast_cpu_ms": round(after, 2),
+            "speedup": round(before / after, 1) if after else None,
+        }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark task list serialization paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
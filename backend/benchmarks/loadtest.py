@@ -0,0 +1,321 @@
+"""Local load test for the API.
+
+Starts `server.py` under uvicorn in a subprocess, seeds it with users and
+tasks through the API, then drives it with concurrent async clients running
+a weighted mix of realistic operations. Prints (or writes) a JSON report with
+per-endpoint p50/p95/p99 latency, throughput and error counts, optionally
+compared against a stored baseline report.
+
+    python benchmarks/loadtest.py --users 20 --tasks-per-user 500 \\
+        --concurrency 32 --duration 30 --output after.json --baseline before.json
+
+By default the server runs against an in-process MongoDB stand-in
+(mongomock-motor), which isolates API/serialization cost from the database.
+Pass --mongo-url to run against a real local mongod instead; a throwaway
+database is created and dropped afterwards. Pass --storage sqlite to run on
+the embedded SQLite backend, in a throwaway database file; comparing its
+report with a --mongo-url one (via --baseline) shows the latency difference
+between the backends.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+DEFAULT_MIX = {
+    "list": 30,
+    "filter": 15,
+    "search": 10,
+    "update": 15,
+    "create": 10,
+    "summary": 10,
+    "trends": 5,
+    "login": 5,
+}
+
+CATEGORIES = ("Work", "Personal", "Health", "Study")
+PRIORITIES = ("Low", "Medium", "High")
+WORDS = ("report", "groceries", "gym", "review", "invoice", "meeting", "exam", "doctor")
+PASSWORD = "LoadTest123!"
+
+
+def serve(port: int, stand_in: bool) -> None:
+    """Subprocess entry point: run the app, optionally on the Mongo stand-in."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import uvicorn
+
+    import server
+
+    if stand_in:
+        from mongomock_motor import AsyncMongoMockClient
+
+        server.create_mongo_client = lambda **options: AsyncMongoMockClient(tz_aware=True)
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port: int, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, BCRYPT_ROUNDS=str(args.bcrypt_rounds), STORAGE_BACKEND=args.storage)
+    # A few seeded users drive all the load, far past any per-client rate;
+    # admission limits stay on unless overridden in the environment
+    env.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    command = [sys.executable, __file__, "serve", "--port", str(port)]
+    if args.storage == "sqlite":
+        env.update(SQLITE_PATH=os.path.join(data_dir, "loadtest.db"))
+    elif args.mongo_url:
+        env.update(MONGO_URL=args.mongo_url, DB_NAME=args.db_name)
+    else:
+        command.append("--stand-in")
+    # Keep the server's output off stdout so the report can be piped
+    return subprocess.Popen(command, env=env, cwd=BACKEND_DIR, stdout=sys.stderr)
+
+
+async def wait_until_up(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not come up in time")
+
+
+def random_task():
+    words = random.sample(WORDS, 2)
+    return {
+        "title": f"{words[0].title()} {words[1]}",
+        "description": f"Remember the {words[1]} before the {random.choice(WORDS)}",
+        "due_date": f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+        "priority": random.choice(PRIORITIES),
+        "category": random.choice(CATEGORIES),
+        "status": random.choice(("pending", "completed")),
+    }
+
+
+async def seed_user(client: httpx.AsyncClient, index: int, tasks: int, run_id: str) -> dict:
+    email = f"load-{run_id}-{index}@example.com"
+    response = await client.post("/api/auth/register", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    user = {"email": email, "token": response.json()["access_token"], "task_ids": []}
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    for start in range(0, tasks, 1000):
+        batch = [random_task() for _ in range(min(1000, tasks - start))]
+        response = await client.post("/api/tasks/bulk", json={"tasks": batch}, headers=headers)
+        response.raise_for_status()
+        user["task_ids"] += [item["id"] for item in response.json()["results"] if item["id"]]
+    return user
+
+
+async def run_operation(client: httpx.AsyncClient, name: str, user: dict) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    if name == "login":
+        return await client.post("/api/auth/login", json={"email": user["email"], "password": PASSWORD})
+    if name == "list":
+        return await client.get("/api/tasks", params={"limit": 100}, headers=headers)
+    if name == "filter":
+        params = {"status": "pending", "category": random.choice(CATEGORIES), "limit": 100}
+        return await client.get("/api/tasks", params=params, headers=headers)
+    if name == "search":
+        return await client.get("/api/tasks", params={"search": random.choice(WORDS)}, headers=headers)
+    if name == "create":
+        response = await client.post("/api/tasks", json=random_task(), headers=headers)
+        if response.status_code == 200:
+            user["task_ids"].append(response.json()["id"])
+        return response
+    if name == "update":
+        task_id = random.choice(user["task_ids"])
+        status = random.choice(("pending", "completed"))
+        return await client.put(f"/api/tasks/{task_id}", json={"status": status}, headers=headers)
+    if name == "summary":
+        return await client.get("/api/analytics/summary", headers=headers)
+    if name == "trends":
+        return await client.get("/api/analytics/trends", headers=headers)
+    raise ValueError(f"unknown operation {name}")
+
+
+async def drive(client, users, mix, concurrency: int, duration: float):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await run_operation(client, name, random.choice(users))
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append((time.perf_counter() - started) * 1000)
+            if failed:
+                errors[name] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.monotonic() - started
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(0, min(len(sorted_values), math.ceil(fraction * len(sorted_values))) - 1)
+    return sorted_values[rank]
+
+
+def summarize(samples, error_count: int, elapsed: float) -> dict:
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": error_count,
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(percentile(samples, 0.50), 2),
+        "p95_ms": round(percentile(samples, 0.95), 2),
+        "p99_ms": round(percentile(samples, 0.99), 2),
+        "max_ms": round(samples[-1], 2) if samples else 0,
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Relative change per endpoint (negative latency / positive rps is better)."""
+    def change(new, old):
+        return round((new - old) / old * 100, 1) if old else None
+
+    comparison = {}
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous:
+            comparison[name] = {
+                "p50_change_pct": change(current["p50_ms"], previous["p50_ms"]),
+                "p95_change_pct": change(current["p95_ms"], previous["p95_ms"]),
+                "p99_change_pct": change(current["p99_ms"], previous["p99_ms"]),
+                "rps_change_pct": change(current["rps"], previous["rps"]),
+            }
+    return comparison
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+async def run(args) -> dict:
+    port = free_port()
+    data_dir = tempfile.mkdtemp(prefix="loadtest-")
+    process = start_server(args, port, data_dir)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            await wait_until_up(client, process)
+            run_id = uuid.uuid4().hex[:8]
+            seed_started = time.monotonic()
+            users = await asyncio.gather(*(
+                seed_user(client, index, args.tasks_per_user, run_id) for index in range(args.users)
+            ))
+            seed_seconds = time.monotonic() - seed_started
+            latencies, errors, elapsed = await drive(client, users, args.mix, args.concurrency, args.duration)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(data_dir, ignore_errors=True)
+        if args.storage == "mongo" and args.mongo_url:
+            from pymongo import MongoClient
+            MongoClient(args.mongo_url).drop_database(args.db_name)
+
+    all_samples = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "config": {
+            "users": args.users,
+            "tasks_per_user": args.tasks_per_user,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": args.mix,
+            "database": database_label(args),
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "total": summarize(all_samples, sum(errors.values()), elapsed),
+        "endpoints": {name: summarize(latencies[name], errors[name], elapsed) for name in sorted(latencies)},
+    }
+
+
+def database_label(args) -> str:
+    if args.storage == "sqlite":
+        return "sqlite"
+    return "mongodb" if args.mongo_url else "mongomock"
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        parser = argparse.ArgumentParser()
+        parser.add_argument("command")
+        parser.add_argument("--port", type=int, required=True)
+        parser.add_argument("--stand-in", action="store_true")
+        serve_args = parser.parse_args()
+        serve(serve_args.port, serve_args.stand_in)
+        return
+
+    parser = argparse.ArgumentParser(description="Load test the task API locally")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--tasks-per-user", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of measured load")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weights, e.g. list=50,search=20,update=30")
+    parser.add_argument("--mongo-url", help="run against this MongoDB instead of the in-process stand-in")
+    parser.add_argument("--storage", choices=("mongo", "sqlite"), default="mongo",
+                        help="storage backend of the server under test")
+    parser.add_argument("--db-name", default=f"tasktracker_loadtest_{os.getpid()}")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="bcrypt cost for the server under test (production default is 12)")
+    parser.add_argument("--output", type=Path, help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", type=Path, help="earlier report to compare against")
+    parser.add_argument("--seed", type=int, help="random seed for a repeatable operation sequence")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    report = asyncio.run(run(args))
+    if args.baseline:
+        report["comparison"] = compare(report, json.loads(args.baseline.read_text()))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
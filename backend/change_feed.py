@@ -0,0 +1,235 @@
+"""Per-user task change feed, pushed to clients over Server-Sent Events.
+
+`ChangeBroker` keeps a channel per user with a ring buffer of the most recent
+events. Each event is rendered to its SSE frame once when it is published;
+every connection of that user then reads the same frame from the buffer,
+and a single wake-up per publish releases all of them. That makes fan-out
+to many tabs or devices of one user cost one serialization, not one per
+connection. Reconnecting clients send `Last-Event-ID` and get the buffered
+events after it; if it has already left the buffer (or was never seen by
+this process) they get a `reset` event and should refetch.
+
+Events reach the broker from one of two sources:
+
+* `memory` (default): the API's own write paths call `publish`. Only
+  connections served by the same worker process see a write, so this suits
+  a single worker.
+* `changestream`: `follow_change_stream` tails a MongoDB change stream on
+  `tasks` (replica set required) and every worker publishes every change.
+  Event ids are the stream's resume tokens, identical on every worker, so a
+  client can resume on any of them. Deletes are routed to their user via the
+  pre-image, which needs `changeStreamPreAndPostImages` on the collections
+  (MongoDB 6.0+); `enable_pre_images` turns it on. Deletes from
+  `tasks_archive` are followed too, and a delete whose task still exists in
+  either tier was a move between them (archiving or restoring), not sent.
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+CREATED, UPDATED, DELETED = "created", "updated", "deleted"
+
+TASK_TIERS = ("tasks", "tasks_archive")
+
+OPERATION_EVENTS = {"insert": CREATED, "update": UPDATED, "replace": UPDATED, "delete": DELETED}
+
+
+class _Channel:
+    """One user's recent events and the connections waiting on them."""
+
+    def __init__(self, buffer_size: int):
+        # (sequence number, event id, rendered SSE frame)
+        self.events: Deque[Tuple[int, str, bytes]] = deque(maxlen=buffer_size)
+        self.sequence = 0
+        self.subscribers = 0
+        self.wakeup = asyncio.Event()
+
+    def append(self, event_id: str, frame: bytes) -> None:
+        self.sequence += 1
+        self.events.append((self.sequence, event_id, frame))
+        # Wake every waiting connection at once; later waiters get a fresh event
+        self.wakeup.set()
+        self.wakeup = asyncio.Event()
+
+    def position_after(self, event_id: str) -> Optional[int]:
+        """Sequence number of a buffered event, or None if it isn't buffered."""
+        for sequence, buffered_id, _ in self.events:
+            if buffered_id == event_id:
+                return sequence
+        return None
+
+    def reset_frame(self) -> bytes:
+        """Tells the client to refetch; carries the newest buffered id (or an
+        empty one) so its next reconnect resumes from here."""
+        return render_frame(self.events[-1][1] if self.events else "", "reset", {"type": "reset"})
+
+    def frames_after(self, position: int) -> Optional[List[bytes]]:
+        """Frames newer than `position`; None if some were already evicted."""
+        if not self.events or position >= self.sequence:
+            return []
+        if position < self.events[0][0] - 1:
+            return None
+        return [frame for sequence, _, frame in self.events if sequence > position]
+
+
+def render_frame(event_id: str, event_type: str, data: Any) -> bytes:
+    return b"id: " + event_id.encode() + b"\nevent: " + event_type.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class ChangeBroker:
+    def __init__(self, buffer_size: int, max_channels: int, heartbeat_seconds: float, max_stream_seconds: float):
+        self.buffer_size = buffer_size
+        self.max_channels = max_channels
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_stream_seconds = max_stream_seconds
+        self._channels: "OrderedDict[str, _Channel]" = OrderedDict()
+        # Memory-source ids are only meaningful to this process
+        self._instance = uuid.uuid4().hex[:8]
+        self._last_id = 0
+        self.published = 0
+        self.resets = 0
+        self.undeliverable = 0
+
+    def _channel(self, user_id: str) -> _Channel:
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(self.buffer_size)
+            self._evict_idle()
+        self._channels.move_to_end(user_id)
+        return channel
+
+    def _evict_idle(self) -> None:
+        # Least recently used first; channels with live connections are kept
+        for user_id in list(self._channels):
+            if len(self._channels) <= self.max_channels:
+                return
+            if self._channels[user_id].subscribers == 0:
+                del self._channels[user_id]
+
+    def publish(self, user_id: str, event_type: str, task: Dict[str, Any], event_id: Optional[str] = None) -> None:
+        channel = self._channel(user_id)
+        if event_id is None:
+            self._last_id += 1
+            event_id = f"{self._instance}-{self._last_id}"
+        channel.append(event_id, render_frame(event_id, event_type, {"type": event_type, "task": task}))
+        self.published += 1
+
+    def publish_many(self, user_id: str, event_type: str, tasks: Iterable[Dict[str, Any]]) -> None:
+        for task in tasks:
+            self.publish(user_id, event_type, task)
+
+    async def stream(self, user_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """SSE body for one connection; ends after `max_stream_seconds` so
+        clients reconnect (resuming from their last id) and workers can
+        restart without waiting on idle streams."""
+        channel = self._channel(user_id)
+        channel.subscribers += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_stream_seconds
+        try:
+            yield b"retry: 3000\n\n"
+            position = channel.sequence
+            if last_event_id:
+                resumed = channel.position_after(last_event_id)
+                if resumed is None:
+                    self.resets += 1
+                    yield channel.reset_frame()
+                else:
+                    position = resumed
+
+            while loop.time() < deadline:
+                wakeup = channel.wakeup
+                frames = channel.frames_after(position)
+                if frames is None:
+                    # Fell further behind than the buffer holds
+                    self.resets += 1
+                    position = channel.sequence
+                    yield channel.reset_frame()
+                    continue
+                if frames:
+                    position = channel.sequence
+                    yield b"".join(frames)
+                    continue
+                timeout = min(self.heartbeat_seconds, deadline - loop.time())
+                try:
+                    await asyncio.wait_for(wakeup.wait(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    # Comment line: keeps proxies from timing the stream out
+                    yield b": ping\n\n"
+        finally:
+            channel.subscribers -= 1
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "subscribers": sum(channel.subscribers for channel in self._channels.values()),
+            "published": self.published,
+            "resets": self.resets,
+            "undeliverable": self.undeliverable,
+        }
+
+
+async def enable_pre_images(db) -> None:
+    for collection in TASK_TIERS:
+        try:
+            await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as exc:
+            logger.warning(
+                "Could not enable change stream pre-images on %s; deletes won't be pushed: %s", collection, exc
+            )
+
+
+async def follow_change_stream(db, broker: ChangeBroker, public_fields: Iterable[str], retry_seconds: float = 1.0):
+    """Publish every change to `tasks` (and deletes from `tasks_archive`) to
+    the broker, resuming after errors."""
+    fields = tuple(public_fields)
+    pipeline = [{"$match": {"$or": [
+        {"ns.coll": "tasks", "operationType": {"$in": list(OPERATION_EVENTS)}},
+        {"ns.coll": "tasks_archive", "operationType": "delete"},
+    ]}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(
+                pipeline,
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token,
+            ) as changes:
+                async for change in changes:
+                    resume_token = change["_id"]
+                    await _publish_change(db, broker, change, fields)
+        except PyMongoError as exc:
+            logger.warning("Task change stream interrupted, resuming in %.0fs: %s", retry_seconds, exc)
+            await asyncio.sleep(retry_seconds)
+
+
+async def _publish_change(db, broker: ChangeBroker, change: Dict[str, Any], fields: Tuple[str, ...]) -> None:
+    event_type = OPERATION_EVENTS[change["operationType"]]
+    if event_type == DELETED:
+        document = change.get("fullDocumentBeforeChange")
+    else:
+        # None when the task was deleted before the lookup; its delete follows
+        document = change.get("fullDocument")
+    if not document or "user_id" not in document:
+        broker.undeliverable += 1
+        return
+    if event_type == DELETED:
+        task_id = document.get("id")
+        # Moving between tiers copies the task before deleting the original
+        for collection in TASK_TIERS:
+            if await db[collection].find_one({"id": task_id}, {"_id": 1}):
+                return
+        task = {"id": task_id}
+    else:
+        task = {field: document[field] for field in fields if field in document}
+        task.setdefault("version", 0)
+    broker.publish(document["user_id"], event_type, task, event_id=change["_id"]["_data"])
@@ -0,0 +1,32 @@
+"""Timestamp helpers: tasks store `created_at`, `updated_at` and `due_date` as
+BSON dates (timezone-aware UTC datetimes on the Python side)."""
+from datetime import datetime, timezone
+from typing import Any
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 date or datetime string into an aware UTC datetime.
+
+    Naive values (including plain `YYYY-MM-DD` dates) are taken to be UTC.
+    Raises ValueError for anything else.
+    """
+    parsed = datetime.fromisoformat(value.strip())
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def isoformat(value: Any) -> Any:
+    """Render datetimes the way the API always has; pass legacy strings through."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_millis(value: datetime) -> datetime:
+    """Truncate to milliseconds, the precision BSON dates keep, so values
+    echoed back from a write (or a cursor) match what a later read returns."""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def utc_now() -> datetime:
+    """Current UTC time, truncated like `to_millis`."""
+    return to_millis(datetime.now(timezone.utc))
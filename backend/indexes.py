@@ -0,0 +1,207 @@
+"""Index bootstrap for the users and tasks collections.
+
+`ensure_indexes` is safe to call on every startup: `create_indexes` is a
+no-op for indexes that already exist with the same spec, and a failure on one
+index (duplicate keys blocking a unique index, option conflicts with a
+hand-made index) is logged instead of aborting boot.
+"""
+import logging
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from pagination import SORT_KEYS
+from sorting import TASK_SORTS
+
+logger = logging.getLogger(__name__)
+
+TASK_FILTER_FIELDS = ("category", "priority", "status")
+
+# How long deleted task ids are kept for delta sync; clients that last synced
+# longer ago than this have to resync in full
+TOMBSTONE_TTL_SECONDS = 30 * 24 * 3600
+
+
+def filter_combinations() -> List[Tuple[str, ...]]:
+    """Every subset of the optional `get_tasks` filters, smallest first."""
+    return [
+        fields
+        for size in range(len(TASK_FILTER_FIELDS) + 1)
+        for fields in combinations(TASK_FILTER_FIELDS, size)
+    ]
+
+
+def _task_list_index(fields: Tuple[str, ...]) -> IndexModel:
+    keys = [("user_id", ASCENDING)] + [(f, ASCENDING) for f in fields]
+    keys += [("created_at", ASCENDING), ("id", ASCENDING)]
+    return IndexModel(keys, name="_".join(("user",) + fields + ("created",)))
+
+
+# Listings sorted other than by created_at use an index on the sort keys,
+# with or without a leading status (the one filter the UI combines with every
+# sort); other filters are checked on the index walk, which beats a sort
+SORT_INDEX_PREFIXES: Tuple[Tuple[str, ...], ...] = ((), ("status",))
+_SORT_KEY_NAMES = {
+    "created_at": "created", "due_date": "due", "updated_at": "updated", "priority_rank": "priority_rank",
+}
+
+
+def sort_index_name(sort_keys: Tuple[str, ...], prefix: Tuple[str, ...] = ()) -> str:
+    return "_".join(("user",) + prefix + (_SORT_KEY_NAMES[sort_keys[0]],))
+
+
+def _task_sort_indexes(prefixes: Tuple[Tuple[str, ...], ...]) -> List[IndexModel]:
+    return [
+        IndexModel(
+            [(field, ASCENDING) for field in ("user_id",) + prefix + keys],
+            name=sort_index_name(keys, prefix),
+        )
+        for keys in TASK_SORTS.values() if keys != SORT_KEYS
+        for prefix in prefixes
+    ]
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "tasks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # One index per filter combination `get_tasks` can produce, each
+        # ending in (created_at, id) so results come back in index order.
+        *[_task_list_index(fields) for fields in filter_combinations()],
+        # Prefix search: equality on one word prefix, newest matches first
+        IndexModel(
+            [("user_id", ASCENDING), ("search_terms", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="user_search_created",
+        ),
+        # Sorted listings. These also serve delta sync (user_updated: from a
+        # (updated_at, id) position) and the overdue/upcoming lists and
+        # calendar counts (user_status_due: a due_date range per status).
+        # Each is the only index for some shape in QUERY_SHAPES, and no
+        # index's keys are a prefix of another's (both checked in tests).
+        *_task_sort_indexes(SORT_INDEX_PREFIXES),
+        # Archiver: completed tasks last updated before the cutoff
+        IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)], name="status_updated"),
+    ],
+    # Cold tier: only read by include_archived listings, so it carries just the
+    # unfiltered listing, sort and search indexes; filters are applied to the scan
+    "tasks_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created"),
+        *_task_sort_indexes(((),)),
+        IndexModel(
+            [("user_id", ASCENDING), ("search_terms", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="user_search_created",
+        ),
+    ],
+    "task_tombstones": [
+        IndexModel([("user_id", ASCENDING), ("deleted_at", ASCENDING), ("id", ASCENDING)], name="user_deleted"),
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_ttl", expireAfterSeconds=TOMBSTONE_TTL_SECONDS),
+    ],
+    "task_stats": [
+        IndexModel([("user_id", ASCENDING)], name="user_unique", unique=True),
+    ],
+}
+
+
+@dataclass(frozen=True)
+class QueryShape:
+    """A filter/sort shape issued by a route, used for the coverage report."""
+    name: str
+    collection: str
+    equality: Tuple[str, ...]
+    sort: Tuple[str, ...] = ()
+    unindexable: Tuple[str, ...] = ()
+
+
+def _task_list_shapes() -> List[QueryShape]:
+    shapes = []
+    for fields in filter_combinations():
+        label = ",".join(fields) or "unfiltered"
+        shapes.append(QueryShape(f"get_tasks[{label}]", "tasks", ("user_id",) + fields, sort=("created_at", "id")))
+    shapes.append(QueryShape("get_tasks[search]", "tasks", ("user_id", "search_terms"), sort=("created_at", "id")))
+    for field, keys in TASK_SORTS.items():
+        if keys == SORT_KEYS:
+            continue
+        shapes.append(QueryShape(f"get_tasks[sort={field}]", "tasks", ("user_id",), sort=keys))
+        shapes.append(QueryShape(f"get_tasks[status,sort={field}]", "tasks", ("user_id", "status"), sort=keys))
+        shapes.append(QueryShape(f"get_tasks[archived,sort={field}]", "tasks_archive", ("user_id",), sort=keys))
+    return shapes
+
+
+QUERY_SHAPES: List[QueryShape] = [
+    QueryShape("register/login", "users", ("email",)),
+    QueryShape("get_current_user", "users", ("id",)),
+    QueryShape("get_task/update_task/delete_task", "tasks", ("id", "user_id")),
+    QueryShape("analytics summary", "task_stats", ("user_id",)),
+    QueryShape("analytics trends", "tasks", ("user_id",), sort=("created_at",)),
+    QueryShape("task_stats rebuild", "tasks", ("user_id",)),
+    QueryShape("get_task_changes", "tasks", ("user_id",), sort=("updated_at", "id")),
+    QueryShape("get_task_changes[deleted]", "task_tombstones", ("user_id",), sort=("deleted_at", "id")),
+    QueryShape("archiver", "tasks", ("status",), sort=("updated_at",)),
+    QueryShape("archiver copy/restore/delete[archived]", "tasks_archive", ("id",)),
+    QueryShape("overdue/upcoming", "tasks", ("user_id", "status"), sort=("due_date", "id")),
+    # Every status: the scan steps through the few status values in the index
+    QueryShape("calendar", "tasks", ("user_id", "status"), sort=("due_date",)),
+    QueryShape("calendar[archived]", "tasks_archive", ("user_id",), sort=("due_date",)),
+    QueryShape("get_tasks[archived]", "tasks_archive", ("user_id",), sort=("created_at", "id")),
+    QueryShape("get_tasks[archived,search]", "tasks_archive", ("user_id", "search_terms"), sort=("created_at", "id")),
+    *_task_list_shapes(),
+]
+
+
+def _is_covered(shape: QueryShape, indexes: List[Tuple[Tuple[str, ...], bool]]) -> bool:
+    """True if a unique index pins the shape to one document, or some index
+    has the equality fields as its prefix followed by the sort fields."""
+    if shape.unindexable:
+        return False
+    width = len(shape.equality)
+    for keys, unique in indexes:
+        if unique and set(keys) <= set(shape.equality):
+            return True
+        if len(keys) < width + len(shape.sort):
+            continue
+        if set(keys[:width]) != set(shape.equality):
+            continue
+        if tuple(keys[width:width + len(shape.sort)]) == shape.sort:
+            return True
+    return False
+
+
+async def report_uncovered_queries(db, shapes: List[QueryShape] = QUERY_SHAPES) -> List[QueryShape]:
+    """Log every query shape that no existing index fully serves."""
+    indexes_by_collection = {}
+    for collection in {shape.collection for shape in shapes}:
+        info = await db[collection].index_information()
+        indexes_by_collection[collection] = [
+            (tuple(field for field, _ in spec["key"]), bool(spec.get("unique")))
+            for spec in info.values()
+        ]
+
+    uncovered = [s for s in shapes if not _is_covered(s, indexes_by_collection[s.collection])]
+    for shape in uncovered:
+        detail = f" (unindexable predicate on {', '.join(shape.unindexable)})" if shape.unindexable else ""
+        logger.warning(
+            "Query %s on %s filtering %s is not covered by an index%s",
+            shape.name, shape.collection, ", ".join(shape.equality), detail,
+        )
+    return uncovered
+
+
+async def ensure_indexes(db) -> None:
+    # One index per call so a failure (e.g. duplicate emails blocking the
+    # unique index) doesn't prevent the remaining indexes from being built.
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as exc:
+                logger.error("Could not create index %s on %s: %s", name, collection, exc)
+        logger.info("Indexes ensured on %s", collection)
+    await report_uncovered_queries(db)
@@ -0,0 +1,356 @@
+"""Prometheus metrics, MongoDB command timing and the slow-request log.
+
+`MetricsMiddleware` times every HTTP request by route template and collects
+the MongoDB commands the request issued. `MongoCommandMetrics` is a PyMongo
+`CommandListener` registered on the Motor client: Motor runs each command on
+its executor with a copy of the caller's context, so the listener can attach
+the command to the request that issued it through a context variable. A
+request slower than the threshold is logged with the shape (field names and
+operators, values redacted) of each query it ran.
+
+Metrics live in the default registry of each worker process; with several
+workers, Prometheus scrapes and aggregates them per process.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DOCUMENT_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000, 5000)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route"]
+)
+REQUESTS = Counter("http_requests_total", "HTTP responses by route template and status", ["method", "route", "status"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ["method"])
+MONGO_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ["command", "collection"], buckets=MONGO_BUCKETS
+)
+MONGO_DOCUMENTS = Histogram(
+    "mongodb_command_documents_returned", "Documents returned per MongoDB command batch",
+    ["command", "collection"], buckets=DOCUMENT_BUCKETS,
+)
+MONGO_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands", ["command", "collection"])
+POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0),
+)
+INSERT_BATCH_SIZE = Histogram(
+    "task_insert_batch_size", "Tasks written per coalesced insert_many",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+INSERT_BATCH_SECONDS = Histogram(
+    "task_insert_batch_duration_seconds", "Duration of coalesced insert_many calls", buckets=MONGO_BUCKETS
+)
+SQLITE_LATENCY = Histogram(
+    "sqlite_operation_duration_seconds", "SQLite storage call latency, including thread-pool queueing",
+    ["operation"], buckets=MONGO_BUCKETS,
+)
+SQLITE_FAILURES = Counter("sqlite_operation_failures_total", "Failed SQLite storage calls", ["operation"])
+ADMISSION_SHED = Counter(
+    "admission_shed_total", "Requests turned away by admission control", ["route_class", "reason"]
+)
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "admission_queue_wait_seconds", "Time requests waited for an admission slot", ["route_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay of event loop timer callbacks past their due time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+# Commands the current request has issued: (command, collection, shape, seconds)
+_request_commands: contextvars.ContextVar[Optional[List[tuple]]] = contextvars.ContextVar(
+    "request_commands", default=None
+)
+
+
+def _redact(value: Any) -> Any:
+    """Keep field names and operators, replace values with a placeholder."""
+    if isinstance(value, dict):
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(value[0])] if value and isinstance(value[0], (dict, list)) else "?"
+    return "?"
+
+
+def query_shape(command_name: str, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The parts of a command that decide which index it can use."""
+    if command_name == "find":
+        shape = {"filter": _redact(command.get("filter", {}))}
+        if command.get("sort"):
+            shape["sort"] = dict(command["sort"])
+        return shape
+    if command_name == "aggregate":
+        return {"pipeline": [
+            {stage: _redact(body)} if stage == "$match" else stage
+            for step in command.get("pipeline", []) for stage, body in step.items()
+        ]}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        return {"filter": _redact(statements[0].get("q", {})), "statements": len(statements)}
+    if command_name == "findAndModify":
+        return {"filter": _redact(command.get("query", {}))}
+    if command_name in ("count", "distinct"):
+        return {"filter": _redact(command.get("query", {}))}
+    return None
+
+
+def _documents_returned(command_name: str, reply: Dict[str, Any]) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") is not None else 0
+    return None
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records latency and result size of every command sent to MongoDB.
+
+    Callbacks run on Motor's executor threads; prometheus_client metrics are
+    thread-safe and the pending map is guarded by a lock.
+    """
+
+    def __init__(self):
+        self._pending: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        command = event.command
+        name = event.command_name
+        collection = command.get("collection") if name == "getMore" else command.get(name)
+        collection = collection if isinstance(collection, str) else ""
+        # Shapes are only worth computing when a request is there to log them
+        shape = query_shape(name, command) if _request_commands.get() is not None else None
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, shape)
+
+    def _finish(self, event) -> tuple:
+        with self._lock:
+            collection, shape = self._pending.pop((event.connection_id, event.request_id), ("", None))
+        seconds = event.duration_micros / 1e6
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.append((event.command_name, collection, shape, seconds))
+        return collection, seconds
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        collection, seconds = self._finish(event)
+        MONGO_LATENCY.labels(event.command_name, collection).observe(seconds)
+        documents = _documents_returned(event.command_name, event.reply)
+        if documents is not None:
+            MONGO_DOCUMENTS.labels(event.command_name, collection).observe(documents)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        collection, seconds = self._finish(event)
+        MONGO_LATENCY.labels(event.command_name, collection).observe(seconds)
+        MONGO_FAILURES.labels(event.command_name, collection).inc()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool usage, for sizing `maxPoolSize`.
+
+    PyMongo checks a connection out on the thread that runs the operation, so
+    the wait is measured between the start and end events on that thread.
+    Counters are summed over the pools of every server the client talks to.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.pool_clears = 0
+
+    def connection_check_out_started(self, event) -> None:
+        self._local.started = time.perf_counter()
+
+    def _waited(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_checked_out(self, event) -> None:
+        waited = self._waited()
+        POOL_CHECKOUT_WAIT.observe(waited)
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.wait_seconds_total += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def connection_check_out_failed(self, event) -> None:
+        POOL_CHECKOUT_WAIT.observe(self._waited())
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open -= 1
+
+    def pool_cleared(self, event) -> None:
+        with self._lock:
+            self.pool_clears += 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "pool_clears": self.pool_clears,
+            }
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Route template (`/api/tasks/{task_id}`), never the raw path, so label
+    cardinality stays bounded."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: request latency, status counts, in-flight gauge
+    and the slow-request log."""
+
+    def __init__(self, app, slow_request_seconds: float):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status_code, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                streaming = (b"content-type", b"text/event-stream") in [
+                    (name.lower(), value.split(b";")[0]) for name, value in message.get("headers", ())
+                ]
+            await send(message)
+
+        commands: List[tuple] = []
+        token = _request_commands.set(commands)
+        in_flight = IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            _request_commands.reset(token)
+            route = route_label(scope)
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            # Event streams are long-lived by design
+            if elapsed >= self.slow_request_seconds and not streaming:
+                log_slow_request(method, route, status_code, elapsed, commands)
+
+
+def log_slow_request(method: str, route: str, status_code: int, elapsed: float, commands: List[tuple]) -> None:
+    mongo_seconds = sum(command[3] for command in commands)
+    details = [
+        {
+            "command": name,
+            "collection": collection,
+            "ms": round(seconds * 1000, 1),
+            **({"shape": shape} if shape is not None else {}),
+        }
+        for name, collection, shape, seconds in sorted(commands, key=lambda command: -command[3])
+    ]
+    logger.warning(
+        "Slow request %s %s -> %d in %.0f ms (%.0f ms in %d MongoDB commands): %s",
+        method, route, status_code, elapsed * 1000, mongo_seconds * 1000, len(commands),
+        json.dumps(details, default=str),
+    )
+
+
+async def monitor_event_loop(interval: float) -> None:
+    """Sample how late a timer fires; anything beyond a few milliseconds means
+    something is blocking the loop (CPU-bound work, sync I/O)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+class ComponentStatsCollector:
+    """Exports the numeric values of a `/stats`-style nested dict as gauges,
+    labelled with the dotted component path and the stat name."""
+
+    def __init__(self, read_stats: Callable[[], Dict[str, Any]]):
+        self.read_stats = read_stats
+
+    def collect(self):
+        family = GaugeMetricFamily("app_component_stat", "Internal component counters", labels=["component", "stat"])
+        for component, stat, value in _flatten(self.read_stats()):
+            family.add_metric([component, stat], value)
+        yield family
+
+
+def _flatten(stats: Dict[str, Any], prefix: str = ""):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix.rstrip("."), key, float(value)
+
+
+def register_component_stats(read_stats: Callable[[], Dict[str, Any]]) -> None:
+    REGISTRY.register(ComponentStatsCollector(read_stats))
+
+
+def render() -> tuple:
+    """Body and content type for a scrape of the default registry."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,162 @@
+"""Online data migrations for the tasks collection.
+
+`migrate_task_dates` converts `created_at`, `updated_at` and `due_date` from
+the ISO strings older versions wrote into BSON dates. `migrate_search_terms`
+backfills the `search_terms` prefix array, and its per-field `title_terms` and
+`description_terms`, on tasks written before search was indexed (or before
+the terms were kept per field), and `migrate_priority_ranks` the
+`priority_rank` sort key on tasks written before server-side sorting; both
+cover both tiers. All walk the collection in `_id` order in small batches
+with a pause between them, and each update is conditional on the fields
+still holding what was read, so they are safe to run while the API is
+serving traffic (they are started in the background at startup) and safe to
+re-run.
+Date values that can't be parsed are left untouched and logged.
+
+    python migrations.py [--batch-size N]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+from dates import parse_timestamp
+from search import indexed_text
+from sorting import priority_rank
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = ("created_at", "updated_at", "due_date")
+
+
+def _converted_fields(task: dict) -> dict:
+    converted = {}
+    for field in DATE_FIELDS:
+        value = task.get(field)
+        if not isinstance(value, str):
+            continue
+        try:
+            converted[field] = parse_timestamp(value)
+        except ValueError:
+            logger.warning("Task %s has unparseable %s %r; leaving it as a string", task.get("id"), field, value)
+    return converted
+
+
+async def migrate_task_dates(db, batch_size: int = 500, pause: float = 0.05) -> int:
+    """Convert string timestamps to dates; returns the number of tasks updated."""
+    string_typed = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    projection = {"id": 1, **{field: 1 for field in DATE_FIELDS}}
+    last_id = None
+    migrated = 0
+
+    while True:
+        query = string_typed if last_id is None else {"$and": [string_typed, {"_id": {"$gt": last_id}}]}
+        batch = await db.tasks.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        operations = []
+        for task in batch:
+            converted = _converted_fields(task)
+            if converted:
+                # Only overwrite values nobody has changed since we read them
+                expected = {"_id": task["_id"], **{field: task[field] for field in converted}}
+                operations.append(UpdateOne(expected, {"$set": converted}))
+        if operations:
+            result = await db.tasks.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+        await asyncio.sleep(pause)
+
+    if migrated:
+        logger.info("Converted timestamps to BSON dates on %d task(s)", migrated)
+    return migrated
+
+
+async def migrate_search_terms(db, batch_size: int = 500, pause: float = 0.05) -> int:
+    """Add the term fields where missing; returns the number of tasks updated."""
+    # Every writer sets all three, so a task missing the last one needs them all
+    missing = {"description_terms": {"$exists": False}}
+    migrated = 0
+
+    for collection in (db.tasks, db.tasks_archive):
+        last_id = None
+        while True:
+            query = missing if last_id is None else {**missing, "_id": {"$gt": last_id}}
+            batch = await collection.find(query, {"title": 1, "description": 1}).sort("_id", 1).limit(
+                batch_size
+            ).to_list(batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            operations = [
+                UpdateOne(
+                    {**missing, "_id": task["_id"], "title": task.get("title"), "description": task.get("description")},
+                    {"$set": indexed_text(task.get("title"), task.get("description"))},
+                )
+                for task in batch
+            ]
+            result = await collection.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+            await asyncio.sleep(pause)
+
+    if migrated:
+        logger.info("Backfilled search terms on %d task(s)", migrated)
+    return migrated
+
+
+async def migrate_priority_ranks(db, batch_size: int = 500, pause: float = 0.05) -> int:
+    """Add `priority_rank` where missing; returns the number of tasks updated."""
+    missing = {"priority_rank": {"$exists": False}}
+    migrated = 0
+
+    for collection in (db.tasks, db.tasks_archive):
+        last_id = None
+        while True:
+            query = missing if last_id is None else {**missing, "_id": {"$gt": last_id}}
+            batch = await collection.find(query, {"priority": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            operations = [
+                UpdateOne(
+                    {**missing, "_id": task["_id"], "priority": task.get("priority")},
+                    {"$set": {"priority_rank": priority_rank(task.get("priority"))}},
+                )
+                for task in batch
+            ]
+            result = await collection.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+            await asyncio.sleep(pause)
+
+    if migrated:
+        logger.info("Backfilled priority ranks on %d task(s)", migrated)
+    return migrated
+
+
+async def _main(args) -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"))
+    db = client[os.environ.get("DB_NAME", "TaskTrackerNewlyCreated")]
+    try:
+        dates = await migrate_task_dates(db, batch_size=args.batch_size, pause=0)
+        terms = await migrate_search_terms(db, batch_size=args.batch_size, pause=0)
+        ranks = await migrate_priority_ranks(db, batch_size=args.batch_size, pause=0)
+    finally:
+        client.close()
+    print(f"{dates} task(s) given BSON dates, {terms} task(s) given search terms, {ranks} task(s) given priority ranks")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run the online task migrations to completion")
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(_main(parser.parse_args()))
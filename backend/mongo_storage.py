@@ -0,0 +1,414 @@
+"""MongoDB storage backend (Motor); see storage.py for the interface."""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+import task_stats
+from analytics import calendar_pipeline, merge_calendar_days, merge_trend_buckets, trends_pipeline
+from indexes import ensure_indexes, sort_index_name
+from migrations import migrate_priority_ranks, migrate_search_terms, migrate_task_dates
+from pagination import SORT_KEYS, keyset_filter
+from search import TEXT_FIELDS, search_filter, text_terms
+from sorting import TaskSort
+from storage import DueRange, Storage, Task, TaskUpdate, merge_streams
+
+logger = logging.getLogger(__name__)
+
+SYNC_KEYS = ("updated_at", "id")
+TOMBSTONE_KEYS = ("deleted_at", "id")
+DUE_KEYS = ("due_date", "id")
+
+
+def version_filter(versions: List[int]) -> dict:
+    # Tasks written before versioning have no field and count as version 0
+    accepted = list(versions) + ([None] if 0 in versions else [])
+    return {"version": {"$in": accepted}}
+
+
+def task_update(changes: Dict[str, Any]):
+    """The update for `update_task(s)`: set `changes` and bump `version`.
+
+    Editing the title or description also rebuilds `search_terms`, as the
+    union of the per-field terms, in the same write; that takes a pipeline
+    update, since it reads the stored terms of the field left unedited.
+    """
+    edited = [field for field in TEXT_FIELDS if field in changes]
+    if not edited:
+        return {"$set": changes, "$inc": {"version": 1}}
+    values = {**changes, **{f"{field}_terms": text_terms(changes[field]) for field in edited}}
+    # Tasks the backfill hasn't split yet keep their combined terms for the other field
+    stored_terms = [
+        {"$ifNull": [f"${field}_terms", {"$ifNull": ["$search_terms", []]}]} for field in TEXT_FIELDS
+    ]
+    return [
+        # $literal, as pipeline strings starting with "$" are field paths
+        {"$set": {
+            **{field: {"$literal": value} for field, value in values.items()},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        }},
+        {"$set": {"search_terms": {"$setUnion": stored_terms}}},
+    ]
+
+
+def due_filter(due: Optional[DueRange]) -> dict:
+    # Only BSON dates fall inside a date range; legacy strings never match
+    due_after, due_before = due or (None, None)
+    bounds = {}
+    if due_after is not None:
+        bounds["$gte"] = due_after
+    if due_before is not None:
+        bounds["$lt"] = due_before
+    return {"due_date": bounds} if bounds else {}
+
+
+def insert_errors(exc: BulkWriteError) -> Dict[int, Exception]:
+    errors = {}
+    for error in exc.details.get("writeErrors", []):
+        error_class = DuplicateKeyError if error.get("code") == 11000 else WriteError
+        errors[error["index"]] = error_class(error.get("errmsg"), error.get("code"), error)
+    return errors
+
+
+class MongoStorage(Storage):
+    def __init__(
+        self,
+        client,
+        health_client,
+        db_name: str,
+        public_fields: Iterable[str],
+        warm_connections: int = 1,
+        pool_stats=None,
+    ):
+        super().__init__(public_fields)
+        self.client = client
+        self.db = client[db_name]
+        # Separate single-connection client for readiness probes, so they
+        # neither wait behind nor take connections from request handling
+        self.health_client = health_client
+        self.warm_connections = warm_connections
+        self.pool_stats = pool_stats
+        self.projection = {"_id": 0, **{field: 1 for field in self.public_fields}}
+        # What an update's caller needs of the pre-image; leaves out the term arrays
+        self.update_projection = {**self.projection, **{field: 1 for field in task_stats.COUNTED_FIELDS}}
+
+    async def open(self) -> None:
+        await self.warm_connection_pool()
+        await ensure_indexes(self.db)
+
+    async def warm_connection_pool(self) -> None:
+        """Open `warm_connections` pooled connections before serving traffic.
+
+        Concurrent pings each need their own connection; the pool opens them
+        at most maxConnecting at a time.
+        """
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(max(self.warm_connections, 1))))
+        logger.info(
+            "MongoDB pool warmed with %d connections in %.0f ms",
+            self.pool_stats.open if self.pool_stats else 0, (asyncio.get_running_loop().time() - started) * 1000,
+        )
+
+    def background_jobs(self):
+        # Convert legacy documents in small batches alongside request handling
+        return [migrate_task_dates(self.db), migrate_search_terms(self.db), migrate_priority_ranks(self.db)]
+
+    async def ping(self) -> None:
+        await self.health_client.admin.command("ping")
+
+    async def close(self) -> None:
+        self.client.close()
+        self.health_client.close()
+
+    def stats(self) -> dict:
+        # Pool counters are reported separately, as "mongo_pool"
+        return {"backend": "mongo"}
+
+    # Users
+
+    async def find_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.users.find_one({"id": user_id}, {"_id": 0})
+
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self.db.users.find_one({"email": email}, {"_id": 0})
+
+    async def insert_user(self, user: Dict[str, Any]) -> None:
+        await self.db.users.insert_one(dict(user))
+        await task_stats.init_user_stats(self.db, user["id"])
+
+    async def replace_password_hash(self, user_id: str, old_hash: str, new_hash: str) -> None:
+        await self.db.users.update_one(
+            {"id": user_id, "password_hash": old_hash},
+            {"$set": {"password_hash": new_hash}}
+        )
+
+    # Task writes
+
+    async def insert_tasks(self, tasks: List[Task]) -> Dict[int, Exception]:
+        # insert_many adds `_id` to the documents it is given; callers keep theirs clean
+        try:
+            await self.db.tasks.insert_many([dict(task) for task in tasks], ordered=False)
+        except BulkWriteError as exc:
+            return insert_errors(exc)
+        return {}
+
+    async def update_task(
+        self,
+        user_id: str,
+        task_id: str,
+        changes: Dict[str, Any],
+        expected: Dict[str, Any],
+        versions: Optional[List[int]] = None,
+    ) -> Optional[Task]:
+        query = {"id": task_id, "user_id": user_id, **expected}
+        if versions is not None:
+            query.update(version_filter(versions))
+        # One atomic round trip. The pre-image is returned so the counter delta
+        # can be computed; the post-image is exactly the pre-image plus our $set.
+        return await self.db.tasks.find_one_and_update(
+            query,
+            task_update(changes),
+            projection=self.update_projection,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def update_tasks(self, user_id: str, updates: List[TaskUpdate], now: datetime) -> Set[str]:
+        operations = []
+        for task_id, changes, expected, versions in updates:
+            query = {"id": task_id, "user_id": user_id, **expected}
+            if versions is not None:
+                query.update(version_filter(versions))
+            operations.append(UpdateOne(query, task_update(changes)))
+        if not operations:
+            return set()
+
+        ids = [task_id for task_id, *_ in updates]
+        result = await self.db.tasks.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            return set(ids)
+        # Something changed under us; our updated_at marks the writes that landed
+        landed = await self.db.tasks.find(
+            {"id": {"$in": ids}, "user_id": user_id, "updated_at": now}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        return {task["id"] for task in landed}
+
+    async def delete_task(self, user_id: str, task_id: str) -> Optional[Task]:
+        # Both tiers: a task caught mid-move is in both, and either copy
+        # left behind would bring it back
+        query = {"id": task_id, "user_id": user_id}
+        projection = {"_id": 0, **{field: 1 for field in task_stats.COUNTED_FIELDS}}
+        hot = await self.db.tasks.find_one_and_delete(query, projection=projection)
+        cold = await self.db.tasks_archive.find_one_and_delete(query, projection=projection)
+        return hot if hot is not None else cold
+
+    async def delete_tasks(self, user_id: str, task_ids: List[str]) -> int:
+        query = {"id": {"$in": task_ids}, "user_id": user_id}
+        deleted = (await self.db.tasks.delete_many(query)).deleted_count
+        return deleted + (await self.db.tasks_archive.delete_many(query)).deleted_count
+
+    async def archive_tasks(self, completed_before: datetime, limit: int) -> Dict[str, int]:
+        # Copy, then delete the originals only if still unchanged since the
+        # read. Copies are upserts, so a batch interrupted between the two
+        # steps is simply redone by the next run.
+        batch = await self.db.tasks.find(
+            {"status": "completed", "updated_at": {"$lt": completed_before}}, {"_id": 0}
+        ).limit(limit).to_list(limit)
+        if not batch:
+            return {}
+        await self.db.tasks_archive.bulk_write(
+            [ReplaceOne({"id": task["id"]}, task, upsert=True) for task in batch], ordered=False
+        )
+        # One delete per task, so it is known which originals this run
+        # removed itself: a task edited since the read is still there, and
+        # one its owner deleted is gone, but neither was moved
+        results = await asyncio.gather(*(
+            self.db.tasks.delete_one({"id": task["id"], "status": "completed", "updated_at": task["updated_at"]})
+            for task in batch
+        ))
+        moved = [task for task, result in zip(batch, results) if result.deleted_count]
+        if len(moved) < len(batch):
+            stale = [task["id"] for task, result in zip(batch, results) if not result.deleted_count]
+            await self.db.tasks_archive.delete_many({"id": {"$in": stale}})
+
+        per_user: Dict[str, int] = {}
+        for task in moved:
+            per_user[task["user_id"]] = per_user.get(task["user_id"], 0) + 1
+        for user_id in per_user:
+            # Counters are unchanged (archived tasks still count), but listings aren't
+            await task_stats.apply_delta(self.db, user_id, {})
+        return per_user
+
+    async def restore_tasks(self, user_id: str, task_ids: List[str]) -> List[str]:
+        batch = await self.db.tasks_archive.find(
+            {"id": {"$in": task_ids}, "user_id": user_id}, {"_id": 0}
+        ).to_list(None)
+        if not batch:
+            return []
+        # Copy back, then drop the archived copies. A copy never replaces a
+        # working-set task, so a restore interrupted halfway is just redone.
+        await self.db.tasks.bulk_write([
+            UpdateOne(
+                {"id": task["id"]},
+                {"$setOnInsert": {field: value for field, value in task.items() if field != "id"}},
+                upsert=True,
+            )
+            for task in batch
+        ], ordered=False)
+        ids = [task["id"] for task in batch]
+        await self.db.tasks_archive.delete_many({"id": {"$in": ids}, "user_id": user_id})
+        await task_stats.apply_delta(self.db, user_id, {})
+        return ids
+
+    async def record_tombstones(self, user_id: str, task_ids: List[str], now: datetime) -> None:
+        # Expired by the TTL index on deleted_at
+        tombstones = [{"id": task_id, "user_id": user_id, "deleted_at": now} for task_id in task_ids]
+        await self.db.task_tombstones.insert_many(tombstones, ordered=False)
+
+    # Task reads
+
+    def _tier(self, archived: bool):
+        return self.db.tasks_archive if archived else self.db.tasks
+
+    async def find_task(
+        self, user_id: str, task_id: str, versions: Optional[List[int]] = None, archived: bool = False
+    ) -> Optional[Task]:
+        query = {"id": task_id, "user_id": user_id}
+        if versions is not None:
+            query.update(version_filter(versions))
+        return await self._tier(archived).find_one(query, self.projection)
+
+    async def find_owned_tasks(self, user_id: str, task_ids: List[str], archived: bool = False) -> List[Task]:
+        return await self._tier(archived).find({"id": {"$in": task_ids}, "user_id": user_id}, {"_id": 0}).to_list(None)
+
+    def _task_query(
+        self, user_id: str, filters: Dict[str, str], text: Optional[str] = None, due: Optional[DueRange] = None
+    ) -> dict:
+        query = {"user_id": user_id, **filters, **due_filter(due)}
+        if text:
+            query.update(search_filter(text))
+        return query
+
+    async def find_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        after: Optional[List[Any]],
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        sort: Optional[TaskSort] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> List[Task]:
+        sort = sort or TaskSort()
+        query = self._task_query(user_id, filters, due=due)
+        if after:
+            query = {"$and": [query, keyset_filter(after, sort.keys, sort.descending)]}
+        projection = self.projection
+        if fields is not None:
+            projection = {"_id": 0, **{field: 1 for field in fields if field in self.public_fields}}
+        direction = -1 if sort.descending else 1
+        cursor = self._tier(archived).find(query, projection).sort([(key, direction) for key in sort.keys])
+        if sort.keys != SORT_KEYS:
+            # A filter-combination index with a blocking sort can win the plan
+            # race on small results; pin the index that returns them in order
+            prefix = ("status",) if "status" in filters and not archived else ()
+            cursor = cursor.hint(sort_index_name(sort.keys, prefix))
+        return await cursor.limit(limit).to_list(limit)
+
+    async def search_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: str,
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        before: Optional[List[Any]] = None,
+    ) -> List[Task]:
+        newest_first = [(key, -1) for key in SORT_KEYS]
+        query = self._task_query(user_id, filters, text, due)
+        if before:
+            query = {"$and": [query, keyset_filter(before, SORT_KEYS, descending=True)]}
+        return await self._tier(archived).find(query, self.projection).sort(
+            newest_first
+        ).limit(limit).to_list(limit)
+
+    async def find_due_tasks(
+        self, user_id: str, status: str, due: DueRange, after: Optional[List[Any]], limit: int
+    ) -> List[Task]:
+        query = self._task_query(user_id, {"status": status}, due=due)
+        if after:
+            query = {"$and": [query, keyset_filter(after, DUE_KEYS)]}
+        return await self.db.tasks.find(query, self.projection).sort(
+            [(key, 1) for key in DUE_KEYS]
+        ).limit(limit).to_list(limit)
+
+    async def due_date_counts(self, user_id: str, due: DueRange) -> List[Dict[str, Any]]:
+        pipeline = calendar_pipeline({"user_id": user_id, **due_filter(due)})
+        # Without a status the planner may not pick the due-date indexes
+        # (their second field on tasks); the hint keeps the scans covered
+        due_keys = DUE_KEYS[:1]
+        return merge_calendar_days([
+            await self.db.tasks.aggregate(pipeline, hint=sort_index_name(due_keys, ("status",))).to_list(None),
+            await self.db.tasks_archive.aggregate(pipeline, hint=sort_index_name(due_keys)).to_list(None),
+        ])
+
+    def iter_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: Optional[str],
+        batch_size: int,
+    ) -> AsyncIterator[Task]:
+        query = self._task_query(user_id, filters, text)
+        return merge_streams(
+            self._iter_tier(query, batch_size, archived=False),
+            self._iter_tier(query, batch_size, archived=True),
+        )
+
+    async def _iter_tier(self, query: dict, batch_size: int, archived: bool) -> AsyncIterator[Task]:
+        sort = [(key, 1) for key in SORT_KEYS]
+        cursor = self._tier(archived).find(query, self.projection).sort(sort).batch_size(batch_size)
+        try:
+            async for task in cursor:
+                yield task
+        finally:
+            await cursor.close()
+
+    async def changed_tasks(self, user_id: str, after: Optional[List[Any]], limit: int) -> List[Task]:
+        query = {"user_id": user_id}
+        if after:
+            query = {"$and": [query, keyset_filter(after, SYNC_KEYS)]}
+        return await self.db.tasks.find(query, self.projection).sort(
+            [(key, 1) for key in SYNC_KEYS]
+        ).limit(limit).to_list(limit)
+
+    async def tombstones(self, user_id: str, after: List[Any], limit: int) -> List[Dict[str, Any]]:
+        query = {"$and": [{"user_id": user_id}, keyset_filter(after, TOMBSTONE_KEYS)]}
+        return await self.db.task_tombstones.find(query, {"_id": 0, "id": 1, "deleted_at": 1}).sort(
+            [(key, 1) for key in TOMBSTONE_KEYS]
+        ).limit(limit).to_list(limit)
+
+    # Counters and analytics
+
+    async def apply_stats_delta(self, user_id: str, delta: Dict[str, int]) -> None:
+        await task_stats.apply_delta(self.db, user_id, delta)
+
+    async def rebuild_user_stats(self, user_id: str) -> Dict[str, Any]:
+        return await task_stats.rebuild_user_stats(self.db, user_id)
+
+    async def read_user_stats(self, user_id: str) -> Dict[str, Any]:
+        return await task_stats.read_user_stats(self.db, user_id)
+
+    async def read_change_version(self, user_id: str) -> int:
+        return await task_stats.read_change_version(self.db, user_id)
+
+    async def trend_buckets(self, user_id: str, start: datetime, granularity: str) -> List[Dict[str, Any]]:
+        pipeline = trends_pipeline(user_id, start, granularity)
+        return merge_trend_buckets([
+            await self.db.tasks.aggregate(pipeline).to_list(None),
+            await self.db.tasks_archive.aggregate(pipeline).to_list(None),
+        ])
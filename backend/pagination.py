@@ -0,0 +1,109 @@
+"""Opaque keyset cursors for paginated task listings.
+
+A cursor is the sort key of the last document on the previous page,
+serialized with `bson.json_util` (so datetimes and other BSON types survive
+the round trip) and base64url-encoded. Resuming from a cursor is an index
+seek on `(user_id, ..., created_at, id)`, so page N costs the same as page 1.
+"""
+import base64
+import binascii
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+
+SORT_KEYS: Tuple[str, ...] = ("created_at", "id")
+
+# Keys holding dates; a task an old version wrote can still hold a string
+# here that the date migration couldn't parse
+DATE_KEYS = frozenset({"created_at", "updated_at", "due_date", "deleted_at"})
+
+# MongoDB orders values of different types by type first, and a comparison
+# only matches values of its own type; these are the types tasks store
+_TYPE_RANKS = ((type(None), 0), ((int, float), 1), (str, 2), (datetime, 3))
+
+# Decode dates as aware UTC datetimes, like the tz_aware client returns them
+_JSON_OPTIONS = json_util.DEFAULT_JSON_OPTIONS.with_options(tz_aware=True, tzinfo=timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(document: Dict[str, Any], keys: Tuple[str, ...] = SORT_KEYS) -> str:
+    payload = json_util.dumps([document[key] for key in keys])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Tuple[str, ...] = SORT_KEYS) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode(), json_options=_JSON_OPTIONS)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor("Malformed cursor") from exc
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor("Malformed cursor")
+    return values
+
+
+def encode_offset_cursor(offset: int, window: Optional[List[Any]] = None) -> str:
+    """Cursor for listings that can't resume by key (relevance-ranked search):
+    an offset into a ranked window of matches, which starts strictly after
+    the `window` position in descending `SORT_KEYS` order (None: the newest)."""
+    if window is None:
+        return encode_cursor({"offset": offset}, ("offset",))
+    return encode_cursor({"offset": offset, **dict(zip(SORT_KEYS, window))}, ("offset",) + SORT_KEYS)
+
+
+def decode_offset_cursor(cursor: str) -> Tuple[int, Optional[List[Any]]]:
+    try:
+        offset, *window = decode_cursor(cursor, ("offset",) + SORT_KEYS)
+    except InvalidCursor:
+        (offset,), window = decode_cursor(cursor, ("offset",)), None
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise InvalidCursor("Malformed cursor")
+    return offset, window
+
+
+def sort_order(value: Any) -> Tuple[int, Any]:
+    """Python sort key putting values of mixed types in MongoDB's order."""
+    for types, rank in _TYPE_RANKS:
+        if isinstance(value, types):
+            return rank, value
+    return len(_TYPE_RANKS), value
+
+
+def keyset_filter(values: List[Any], keys: Tuple[str, ...] = SORT_KEYS, descending: bool = False) -> Dict[str, Any]:
+    """Match documents strictly after `values` in ascending (or, with
+    `descending`, descending) `keys` order.
+
+    For keys (a, b) this expands to `a > va OR (a == va AND b > vb)`. On a
+    date key, the legacy strings (which sort before every date) are
+    matched past a date position going down, and every date past a string
+    position going up.
+    """
+    operator = "$lt" if descending else "$gt"
+    branches = []
+    for position, key in enumerate(keys):
+        value = values[position]
+        branch = {prior: values[i] for i, prior in enumerate(keys[:position])}
+        beyond = None
+        if key in DATE_KEYS:
+            if descending and isinstance(value, datetime):
+                beyond = "string"
+            elif not descending and isinstance(value, str):
+                beyond = "date"
+        if beyond is None:
+            branch[key] = {operator: value}
+        else:
+            branch["$or"] = [{key: {operator: value}}, {key: {"$type": beyond}}]
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def split_page(documents: List[Dict[str, Any]], limit: int, keys: Tuple[str, ...] = SORT_KEYS):
+    """Trim a `limit + 1` fetch to one page and derive the next cursor."""
+    if len(documents) <= limit:
+        return documents, None
+    page = documents[:limit]
+    return page, encode_cursor(page[-1], keys)
@@ -0,0 +1,60 @@
+"""Password hashing off the event loop.
+
+bcrypt is deliberately slow (tens to hundreds of milliseconds per call), so
+running it inline in an async handler stalls every other request on the
+worker. `PasswordHasher` runs it on a dedicated thread pool (bcrypt releases
+the GIL while hashing) and bounds the number of calls that may be running or
+waiting; past that it raises `HasherSaturated` so callers can shed load with
+a 503 instead of queueing without limit.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+class HasherSaturated(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int, workers: int, max_queue: int):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HasherSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also returns a fresh hash if the stored one was
+        made with different settings (e.g. an older bcrypt cost)."""
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,111 @@
+"""Prefix search over task titles and descriptions.
+
+Every task stores `search_terms`: each prefix (up to `MAX_PREFIX_LENGTH`
+characters) of each word in its title and description, case-folded and with
+accents stripped. The same prefixes are also kept per field, in `title_terms`
+and `description_terms`, so an edit to one field can rebuild `search_terms`
+in the same write, without reading the other field first. A search is then
+an equality match of every query word against that array, served by the
+multikey index (user_id, search_terms, created_at, id), so it costs the same
+however many tasks the user has and never interprets user input as a
+pattern. Matches are ranked in process: whole-word hits beat prefix hits,
+and title hits beat description hits.
+
+Only the first `MAX_INDEXED_WORDS` distinct words of each field are indexed,
+which bounds a task at 2 * 200 * 20 = 8000 terms however long its text; a
+word first appearing after that can't be found. Queries keep at most as many
+words.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+MAX_PREFIX_LENGTH = 20
+MAX_INDEXED_WORDS = 200
+WORD = re.compile(r"\w+")
+
+TITLE_WORD, TITLE_PREFIX = 4.0, 2.0
+DESCRIPTION_WORD, DESCRIPTION_PREFIX = 1.5, 1.0
+
+
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def words(text: Optional[str]) -> List[str]:
+    return WORD.findall(_normalize(text)) if text else []
+
+
+TEXT_FIELDS = ("title", "description")
+
+
+def text_terms(text: Optional[str]) -> List[str]:
+    """The indexed prefixes of one field, deduplicated and sorted."""
+    terms = set()
+    for word in list(dict.fromkeys(words(text)))[:MAX_INDEXED_WORDS]:
+        for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            terms.add(word[:length])
+    return sorted(terms)
+
+
+def search_terms(title: Optional[str], description: Optional[str]) -> List[str]:
+    """The indexed prefixes for a task, deduplicated and sorted."""
+    return sorted(set(text_terms(title)) | set(text_terms(description)))
+
+
+def indexed_text(title: Optional[str], description: Optional[str]) -> Dict[str, List[str]]:
+    """The term fields of a new task document."""
+    return {
+        "search_terms": search_terms(title, description),
+        "title_terms": text_terms(title),
+        "description_terms": text_terms(description),
+    }
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct query words, cut to the longest prefix that is indexed."""
+    return list(dict.fromkeys(word[:MAX_PREFIX_LENGTH] for word in words(query)))[:MAX_INDEXED_WORDS]
+
+
+def search_filter(query: str) -> Dict[str, Any]:
+    """Tasks containing a word starting with every query word.
+
+    Tasks the backfill hasn't reached yet have no `search_terms`; those fall
+    back to an escaped substring match, which the index narrows to just the
+    un-migrated documents. A query with no words matches nothing.
+    """
+    terms = query_terms(query)
+    pattern = re.escape(query.strip())
+    return {"$or": [
+        {"search_terms": {"$all": terms} if terms else {"$in": []}},
+        {"search_terms": {"$exists": False}, "$or": [
+            {"title": {"$regex": pattern, "$options": "i"}},
+            {"description": {"$regex": pattern, "$options": "i"}},
+        ]},
+    ]}
+
+
+def _score_field(terms: List[str], field_words: Iterable[str], word_weight: float, prefix_weight: float) -> float:
+    field_words = set(field_words)
+    score = 0.0
+    for term in terms:
+        if term in field_words:
+            score += word_weight
+        elif any(word.startswith(term) for word in field_words):
+            score += prefix_weight
+    return score
+
+
+def relevance(task: Dict[str, Any], terms: List[str]) -> float:
+    return (
+        _score_field(terms, words(task.get("title")), TITLE_WORD, TITLE_PREFIX)
+        + _score_field(terms, words(task.get("description")), DESCRIPTION_WORD, DESCRIPTION_PREFIX)
+    )
+
+
+def rank_by_relevance(tasks: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
+    """Most relevant first; `tasks` should arrive newest first, which breaks
+    ties (the sort is stable)."""
+    terms = query_terms(query)
+    return sorted(tasks, key=lambda task: -relevance(task, terms))
@@ -0,0 +1,51 @@
+"""Fast JSON responses for documents read from our own collections.
+
+The default FastAPI path builds a Pydantic model per task, validates it again
+against `response_model`, converts it back to primitives and finally runs
+`json.dumps`. Task documents we read back from `tasks` were validated when they
+were written, so for those the API can project exactly the public fields and
+hand the raw documents straight to orjson. orjson renders datetimes exactly
+like `datetime.isoformat()`, so the output is byte-for-byte what the Pydantic
+path produces.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from fastapi import Response
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def trusted_tasks(documents: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tasks read with the public-field projection, ready for orjson.
+
+    Only fills defaults for fields older documents may lack.
+    """
+    tasks = []
+    for document in documents:
+        document.setdefault("version", 0)
+        tasks.append(document)
+    return tasks
+
+
+def projected_tasks(documents: Iterable[Dict[str, Any]], fields: Iterable[str]) -> List[Dict[str, Any]]:
+    """Like `trusted_tasks`, keeping only `fields` (for `fields=` listings)."""
+    fields = tuple(fields)
+    return [
+        {field: document[field] for field in fields if field in document}
+        for document in trusted_tasks(documents)
+    ]
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content)
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """Encode `content` with orjson, keeping headers already set on the
+    injected `response` (ETag, Cache-Control), which FastAPI would otherwise
+    drop when a handler returns its own Response."""
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return Response(content=dumps(content), status_code=status_code, media_type=JSON_MEDIA_TYPE, headers=headers)
@@ -1,18 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from pymongo.errors import PyMongoError, WaitQueueTimeoutError
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import csv
+import hashlib
+import heapq
+import io
 import logging
+import sqlite3
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, PlainSerializer, ValidationError
+from typing import Annotated, Any, Dict, List, Optional, Tuple, Union
+import asyncio
 import uuid
 from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi.middleware.cors import CORSMiddleware
+from admission import AdmissionController, AdmissionMiddleware, ConcurrencyLimiter, TokenBuckets
+from batching import InsertCoalescer
+from caching import TTLCache
+from change_feed import CREATED, DELETED, UPDATED, ChangeBroker, enable_pre_images, follow_change_stream
+from analytics_cache import AnalyticsCache
+from archiving import TaskArchiver
+from analytics import calendar_response, summary_response, trends_response, trends_window_start
+from dates import isoformat, parse_timestamp, to_millis, utc_now
+from indexes import TOMBSTONE_TTL_SECONDS
+import metrics
+from mongo_storage import MongoStorage
+from passwords import HasherSaturated, PasswordHasher
+from serialization import dumps, json_response, projected_tasks, trusted_tasks
+from pagination import (
+    InvalidCursor, decode_cursor, decode_offset_cursor, encode_cursor, encode_offset_cursor, split_page,
+)
+from search import indexed_text, rank_by_relevance
+from sorting import TASK_SORTS, TaskSort, priority_rank
+from sqlite_storage import SQLiteStorage
+from storage import DueRange, Storage
+import task_stats
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -22,21 +51,255 @@ load_dotenv(ROOT_DIR / '.env')
 #client = AsyncIOMotorClient(mongo_url)
 #db = client[os.environ['DB_NAME']]
 
+# Storage backend (see storage.py): "mongo", or "sqlite" for a single node
+# without a database server
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", str(ROOT_DIR / "tasktracker.db"))
+SQLITE_WORKERS = int(os.environ.get("SQLITE_WORKERS", "4"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017/")
 DB_NAME = os.environ.get("DB_NAME", "TaskTrackerNewlyCreated")
 
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+# Connection pool, per worker process. minPoolSize connections are opened at
+# startup; maxConnecting caps how many are being established at once, so a
+# fleet of workers booting together doesn't storm the server.
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_CONNECTING = int(os.environ.get("MONGO_MAX_CONNECTING", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# Fail fast with a 503 rather than queue indefinitely when the pool is exhausted
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+READINESS_TIMEOUT_SECONDS = float(os.environ.get("READINESS_TIMEOUT_SECONDS", "2"))
+
+mongo_pool_metrics = metrics.MongoPoolMetrics()
+
+def create_mongo_client(**options) -> AsyncIOMotorClient:
+    settings = dict(
+        tz_aware=True,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxConnecting=MONGO_MAX_CONNECTING,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    )
+    settings.update(options)
+    return AsyncIOMotorClient(MONGO_URL, **settings)
+
+def create_storage() -> Storage:
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(
+            SQLITE_PATH, Task.model_fields, workers=SQLITE_WORKERS, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS
+        )
+    if STORAGE_BACKEND != "mongo":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected mongo or sqlite)")
+    return MongoStorage(
+        # Every command is timed by the metrics listeners (see metrics.py)
+        create_mongo_client(event_listeners=[metrics.MongoCommandMetrics(), mongo_pool_metrics]),
+        create_mongo_client(
+            maxPoolSize=1, minPoolSize=0, waitQueueTimeoutMS=None,
+            serverSelectionTimeoutMS=int(READINESS_TIMEOUT_SECONDS * 1000),
+        ),
+        DB_NAME,
+        Task.model_fields,
+        warm_connections=MONGO_MIN_POOL_SIZE,
+        pool_stats=mongo_pool_metrics,
+    )
+
+# Opened and closed by the app lifespan
+storage: Optional[Storage] = None
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs on its own thread pool; raising BCRYPT_ROUNDS upgrades existing
+# hashes transparently the next time each user logs in
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# EventSource can't send an Authorization header, so event streams take a
+# ticket in the query string instead: a token that only opens streams,
+# expires quickly and opens just one, so copies in access and proxy logs are
+# worthless. Redeemed tickets are remembered per worker process.
+STREAM_TICKET_SCOPE = "task_events"
+STREAM_TICKET_TTL_SECONDS = int(os.environ.get("STREAM_TICKET_TTL_SECONDS", "60"))
+STREAM_TICKET_MAX_REDEEMED = int(os.environ.get("STREAM_TICKET_MAX_REDEEMED", "100000"))
+
+# Authenticated-user caches: decoded token -> user id, and user id -> User
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "60"))
+token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+user_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+# Ticket id -> True, until the ticket would have expired anyway
+redeemed_stream_tickets = TTLCache(STREAM_TICKET_MAX_REDEEMED, STREAM_TICKET_TTL_SECONDS)
+
+# Analytics reads shared by concurrent identical requests and reused briefly;
+# a user's task writes in this process invalidate them (see analytics_cache.py)
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYTICS_CACHE_MAX_ENTRIES", "10000"))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.environ.get("ANALYTICS_CACHE_TTL_SECONDS", "5"))
+analytics_cache = AnalyticsCache(
+    ANALYTICS_CACHE_MAX_ENTRIES,
+    ANALYTICS_CACHE_TTL_SECONDS,
+    lambda user_id: storage.read_user_stats(user_id),
+)
+
+# Pagination
+DEFAULT_PAGE_SIZE = int(os.environ.get("TASKS_DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("TASKS_MAX_PAGE_SIZE", "500"))
+EXPORT_BATCH_SIZE = int(os.environ.get("TASKS_EXPORT_BATCH_SIZE", "500"))
+BULK_MAX_OPERATIONS = int(os.environ.get("TASKS_BULK_MAX_OPERATIONS", "5000"))
+# Concurrent single-task creates are written together with one insert_many
+# (see batching.py); set to 0 for one insert_one per request
+TASK_INSERT_BATCHING = os.environ.get("TASK_INSERT_BATCHING", "1") == "1"
+TASK_INSERT_BATCH_MAX = int(os.environ.get("TASK_INSERT_BATCH_MAX", "200"))
+TASK_INSERT_BATCH_WINDOW_MS = float(os.environ.get("TASK_INSERT_BATCH_WINDOW_MS", "2"))
+task_inserts = InsertCoalescer(
+    lambda documents: storage.insert_tasks(documents),
+    max_batch=TASK_INSERT_BATCH_MAX,
+    max_delay=TASK_INSERT_BATCH_WINDOW_MS / 1000,
+) if TASK_INSERT_BATCHING else None
+
+# Delta sync tokens stop this far short of "now", so a write stamped just
+# before a sync but committed just after it is picked up by the next one
+SYNC_SETTLE_SECONDS = float(os.environ.get("TASKS_SYNC_SETTLE_SECONDS", "5"))
+# Searches rank matching tasks this many at a time, newest first
+SEARCH_MAX_CANDIDATES = int(os.environ.get("TASKS_SEARCH_MAX_CANDIDATES", "1000"))
+# Widest from/to window /api/tasks/calendar will count
+CALENDAR_MAX_DAYS = int(os.environ.get("TASKS_CALENDAR_MAX_DAYS", "366"))
+
+# Completed tasks untouched for this long move to tasks_archive (see
+# archiving.py); 0 turns the archiver off
+ARCHIVE_AFTER_DAYS = float(os.environ.get("TASKS_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("TASKS_ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_PAUSE_MS = float(os.environ.get("TASKS_ARCHIVE_BATCH_PAUSE_MS", "200"))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("TASKS_ARCHIVE_INTERVAL_SECONDS", "3600"))
+task_archiver = TaskArchiver(
+    max_age=timedelta(days=ARCHIVE_AFTER_DAYS),
+    batch_size=ARCHIVE_BATCH_SIZE,
+    pause=ARCHIVE_BATCH_PAUSE_MS / 1000,
+    interval=ARCHIVE_INTERVAL_SECONDS,
+) if ARCHIVE_AFTER_DAYS > 0 else None
+
+# Encode task/analytics responses straight from trusted documents with orjson
+# instead of re-validating them through response_model
+FAST_SERIALIZATION = os.environ.get("FAST_SERIALIZATION", "1") == "1"
+
+# Change feed (see change_feed.py): "memory" publishes from this process's
+# write paths; "changestream" tails MongoDB and needs a replica set (and the
+# mongo storage backend)
+CHANGE_FEED_SOURCE = os.environ.get("CHANGE_FEED_SOURCE", "memory")
+change_broker = ChangeBroker(
+    buffer_size=int(os.environ.get("CHANGE_FEED_BUFFER_SIZE", "256")),
+    max_channels=int(os.environ.get("CHANGE_FEED_MAX_CHANNELS", "10000")),
+    heartbeat_seconds=float(os.environ.get("CHANGE_FEED_HEARTBEAT_SECONDS", "15")),
+    max_stream_seconds=float(os.environ.get("CHANGE_FEED_MAX_STREAM_SECONDS", "300")),
+)
+
+# Admission control (see admission.py): concurrent requests and queued
+# requests per route class; a concurrency of 0 leaves the class unlimited
+ADMISSION_LIMITS = {
+    route_class: (
+        int(os.environ.get(f"ADMISSION_{route_class.upper()}_CONCURRENCY", concurrency)),
+        int(os.environ.get(f"ADMISSION_{route_class.upper()}_QUEUE", queue)),
+    )
+    for route_class, concurrency, queue in (
+        ("auth", "16", "64"), ("reads", "64", "256"), ("writes", "32", "128"), ("analytics", "8", "32"),
+    )
+}
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+# Per-client token bucket (user, or address when unauthenticated); 0 turns it off
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+# Behind a proxy every anonymous request comes from the proxy's address, so
+# limiting them by address is opt-in. With N trusted proxies in front (each
+# appending to X-Forwarded-For), the client is the Nth address from the end.
+RATE_LIMIT_ANONYMOUS = os.environ.get("RATE_LIMIT_ANONYMOUS", "0") == "1"
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+def client_address(scope) -> str:
+    """The peer address, or the one the trusted proxies forwarded."""
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded = [
+            address.strip()
+            for name, value in scope["headers"] if name == b"x-forwarded-for"
+            for address in value.decode("latin-1").split(",")
+        ]
+        # Anything left of the trusted hops was written by the client itself
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES and forwarded[-RATE_LIMIT_TRUSTED_PROXIES]:
+            return forwarded[-RATE_LIMIT_TRUSTED_PROXIES]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def rate_limit_key(scope) -> Optional[str]:
+    """The bearer token's user, else the client address (None: not limited)."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                try:
+                    return f"user:{decode_token_subject(token.strip())}"
+                except HTTPException:
+                    pass
+            break
+    if not RATE_LIMIT_ANONYMOUS:
+        return None
+    return f"address:{client_address(scope)}"
+
+admission = AdmissionController(
+    {
+        route_class: ConcurrencyLimiter(route_class, concurrency, queue, ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+        for route_class, (concurrency, queue) in ADMISSION_LIMITS.items()
+        if concurrency > 0
+    },
+    TokenBuckets(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST) if RATE_LIMIT_PER_SECOND > 0 else None,
+    rate_limit_key,
+    retry_after=ADMISSION_RETRY_AFTER_SECONDS,
+)
+
+# Observability: requests slower than this are logged with their query shapes
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global storage
+    if CHANGE_FEED_SOURCE == "changestream" and STORAGE_BACKEND != "mongo":
+        raise RuntimeError("CHANGE_FEED_SOURCE=changestream needs STORAGE_BACKEND=mongo")
+    storage = create_storage()
+    await storage.open()
+    for job in storage.background_jobs():
+        start_background_task(job)
+    start_background_task(metrics.monitor_event_loop(EVENT_LOOP_LAG_INTERVAL_SECONDS))
+    if task_archiver is not None:
+        start_background_task(task_archiver.run(storage))
+    if CHANGE_FEED_SOURCE == "changestream":
+        await enable_pre_images(storage.db)
+        start_background_task(follow_change_stream(storage.db, change_broker, Task.model_fields))
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Fail readiness first so load balancers stop routing here
+        app.state.ready = False
+        for task in list(background_tasks):
+            task.cancel()
+        if task_inserts is not None:
+            await task_inserts.drain()
+        await storage.close()
+        password_hasher.shutdown()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -76,6 +339,16 @@ class TaskUpdate(BaseModel):
     priority: Optional[str] = None
     category: Optional[str] = None
     status: Optional[str] = None
+    # Optimistic concurrency: only apply if the task is still at this version
+    version: Optional[int] = None
+
+# Stored as BSON dates; strings only appear on documents the date migration
+# hasn't reached yet. Serialized as ISO 8601 either way.
+Timestamp = Annotated[Union[datetime, str], PlainSerializer(isoformat, return_type=str)]
+
+class StreamTicket(BaseModel):
+    ticket: str
+    expires_in: int
 
 class Task(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -83,19 +356,188 @@ class Task(BaseModel):
     user_id: str
     title: str
     description: str
-    due_date: str
+    due_date: Timestamp
     priority: str
     category: str
     status: str
-    created_at: str
-    updated_at: str
+    created_at: Timestamp
+    updated_at: Timestamp
+    version: int = 0  # bumped on every update; 0 for tasks written before versioning
+
+class TaskPage(BaseModel):
+    tasks: List[Task]
+    next_cursor: Optional[str] = None
+
+class TaskTombstone(BaseModel):
+    id: str
+    deleted_at: Timestamp
+
+class TaskChanges(BaseModel):
+    tasks: List[Task]
+    deleted: List[TaskTombstone]
+    # Pass back as `since` on the next call
+    next_since: str
+    has_more: bool
+
+# Bulk items are validated one by one so a bad item fails alone instead of
+# rejecting the whole request
+class BulkCreateRequest(BaseModel):
+    tasks: List[Dict[str, Any]] = Field(..., max_length=BULK_MAX_OPERATIONS)
+
+class BulkTaskUpdate(TaskUpdate):
+    id: str
+
+class BulkUpdateRequest(BaseModel):
+    updates: List[Dict[str, Any]] = Field(..., max_length=BULK_MAX_OPERATIONS)
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=BULK_MAX_OPERATIONS)
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: int
+    error: Optional[str] = None
+    task: Optional[Task] = None
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def auth_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Authentication service is busy, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HasherSaturated:
+        raise auth_busy()
+
+async def verify_password(plain_password: str, hashed_password: str):
+    """Returns (matches, replacement_hash_or_None)."""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HasherSaturated:
+        raise auth_busy()
+
+def parse_due_date(value: str) -> datetime:
+    try:
+        return to_millis(parse_timestamp(value))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="due_date must be an ISO 8601 date or datetime")
+
+def parse_due_bound(name: str, value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name} must be an ISO 8601 date or datetime")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def due_range(due_after: Optional[str], due_before: Optional[str]) -> Optional[DueRange]:
+    """`due_after` is inclusive and `due_before` exclusive, so consecutive
+    windows never overlap; plain dates mean midnight UTC."""
+    if due_after is None and due_before is None:
+        return None
+    return parse_due_bound("due_after", due_after), parse_due_bound("due_before", due_before)
+
+def validation_message(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+def new_task_document(task_data: TaskCreate, user_id: str, now: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "title": task_data.title,
+        "description": task_data.description,
+        "due_date": parse_due_date(task_data.due_date),
+        "priority": task_data.priority,
+        "category": task_data.category,
+        "status": task_data.status,
+        "created_at": now,
+        "updated_at": now,
+        "version": 1,
+        "priority_rank": priority_rank(task_data.priority),
+        **indexed_text(task_data.title, task_data.description)
+    }
+
+def task_changes(task_data: TaskUpdate, now: datetime) -> dict:
+    update_data = {k: v for k, v in task_data.model_dump(exclude={"id", "version"}).items() if v is not None}
+    if "due_date" in update_data:
+        update_data["due_date"] = parse_due_date(update_data["due_date"])
+    if "priority" in update_data:
+        update_data["priority_rank"] = priority_rank(update_data["priority"])
+    update_data["updated_at"] = now
+    return update_data
+
+def parse_if_match(value: str) -> Optional[List[int]]:
+    """Versions listed in an If-Match header; None for `*` (any version).
+
+    If-Match compares strongly, so weak tags, and tags that aren't ours,
+    match no version (a 412), while a malformed header is a 400.
+    """
+    if value.strip() == "*":
+        return None
+    versions = []
+    for tag in value.split(","):
+        tag = tag.strip()
+        opaque = tag.removeprefix("W/")
+        if len(opaque) < 2 or not (opaque.startswith('"') and opaque.endswith('"')) or '"' in opaque[1:-1]:
+            raise HTTPException(status_code=400, detail="If-Match must list entity tags")
+        if tag == opaque and opaque[1] == "v" and opaque[2:-1].isdigit():
+            versions.append(int(opaque[2:-1]))
+    return versions
+
+def tasks_changed(user_id: str, event_type: str, tasks: List[dict]):
+    """Called after every task write: drops the user's cached analytics and
+    pushes the tasks to their change feed (memory source only; a change
+    stream sees the writes itself)."""
+    analytics_cache.invalidate(user_id)
+    if CHANGE_FEED_SOURCE != "memory":
+        return
+    if event_type == DELETED:
+        payloads = [{"id": task["id"]} for task in tasks]
+    else:
+        payloads = [{field: task[field] for field in Task.model_fields if field in task} for task in tasks]
+    change_broker.publish_many(user_id, event_type, payloads)
+
+def task_etag(task: dict) -> str:
+    return f'"v{task.get("version", 0)}"'
+
+def collection_etag(request: Request, user_id: str, change_version: int, extra: str = "") -> str:
+    """Strong ETag for a per-user read: changes whenever any of the user's
+    tasks change (change_version) and differs per route and query string."""
+    scope = f"{user_id}|{request.url.path}|{sorted(request.query_params.multi_items())}|{extra}"
+    digest = hashlib.sha1(scope.encode()).hexdigest()[:16]
+    return f'"{change_version}-{digest}"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 if If-None-Match already names `etag`, else None."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return None
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+def set_collection_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # Let browsers keep the body but revalidate every time
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def bulk_response(results: List[BulkItemResult]) -> BulkResponse:
+    results.sort(key=lambda r: r.index)
+    succeeded = sum(1 for r in results if r.status < 400)
+    return BulkResponse(succeeded=succeeded, failed=len(results) - succeeded, results=results)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -104,26 +546,78 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def create_stream_ticket(user_id: str) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(seconds=STREAM_TICKET_TTL_SECONDS)
+    claims = {"sub": user_id, "scope": STREAM_TICKET_SCOPE, "jti": uuid.uuid4().hex, "exp": expire}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_stream_ticket(ticket: str) -> str:
+    """The ticket's user id; redeems the ticket, so a second use is a 401."""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    ticket_id = payload.get("jti")
+    if payload.get("scope") != STREAM_TICKET_SCOPE or payload.get("sub") is None or ticket_id is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    if redeemed_stream_tickets.get(ticket_id):
+        raise HTTPException(status_code=401, detail="Stream ticket already used")
+    redeemed_stream_tickets.set(ticket_id, True, ttl=payload["exp"] - datetime.now(timezone.utc).timestamp())
+    return payload["sub"]
+
+def invalidate_user(user_id: str):
+    """Drop a cached user record; call whenever a user document changes."""
+    user_cache.invalidate(user_id)
+
+def decode_token_subject(token: str) -> str:
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+        user_id = payload.get("sub")
+        # Scoped tokens (stream tickets) are only good for their one purpose
+        if user_id is None or payload.get("scope") is not None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if user is None:
+    # Never cache a token past its own expiry
+    expires_in = payload.get("exp", 0) - datetime.now(timezone.utc).timestamp()
+    token_cache.set(token, user_id, ttl=expires_in)
+    return user_id
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await load_user(decode_token_subject(credentials.credentials))
+
+async def get_stream_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    ticket: Optional[str] = None
+):
+    if credentials:
+        return await load_user(decode_token_subject(credentials.credentials))
+    if ticket:
+        return await load_user(decode_stream_ticket(ticket))
+    raise HTTPException(status_code=401, detail="Not authenticated")
+
+async def load_user(user_id: str) -> User:
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    user_doc = await storage.find_user(user_id)
+    if user_doc is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    user = User(**user_doc)
+    user_cache.set(user_id, user)
+    return user
 
 # Auth Routes
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await storage.find_user_by_email(user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -132,28 +626,37 @@ async def register(user_data: UserCreate):
     user_dict = {
         "id": user_id,
         "email": user_data.email,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await hash_password(user_data.password),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(user_dict)
+    await storage.insert_user(user_dict)
     
     # Create token
     access_token = create_access_token(data={"sub": user_id})
     
     user_response = User(id=user_id, email=user_data.email, created_at=user_dict["created_at"])
+    user_cache.set(user_id, user_response)
     
     return TokenResponse(access_token=access_token, token_type="bearer", user=user_response)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(user_data: UserLogin):
-    user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    user = await storage.find_user_by_email(user_data.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    matches, new_hash = await verify_password(user_data.password, user["password_hash"])
+    if not matches:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if new_hash:
+        # Stored hash used an older bcrypt cost; upgrade it now that we know the password
+        await storage.replace_password_hash(user["id"], user["password_hash"], new_hash)
+        invalidate_user(user["id"])
     
     access_token = create_access_token(data={"sub": user["id"]})
     
     user_response = User(id=user["id"], email=user["email"], created_at=user["created_at"])
+    user_cache.set(user["id"], user_response)
     
     return TokenResponse(access_token=access_token, token_type="bearer", user=user_response)
 
@@ -164,155 +667,677 @@ async def get_me(current_user: User = Depends(get_current_user)):
 # Task Routes
 @api_router.post("/tasks", response_model=Task)
 async def create_task(task_data: TaskCreate, current_user: User = Depends(get_current_user)):
-    task_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    
-    task_dict = {
-        "id": task_id,
-        "user_id": current_user.id,
-        "title": task_data.title,
-        "description": task_data.description,
-        "due_date": task_data.due_date,
-        "priority": task_data.priority,
-        "category": task_data.category,
-        "status": task_data.status,
-        "created_at": now,
-        "updated_at": now
-    }
+    task_dict = new_task_document(task_data, current_user.id, utc_now())
     
-    await db.tasks.insert_one(task_dict)
+    if task_inserts is not None:
+        await task_inserts.insert(task_dict)
+    else:
+        await storage.insert_task(task_dict)
+    await storage.apply_stats_delta(current_user.id, task_stats.task_delta(task_dict))
+    tasks_changed(current_user.id, CREATED, [task_dict])
     
     return Task(**task_dict)
 
-@api_router.get("/tasks", response_model=List[Task])
+def task_filters(
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    status: Optional[str] = None
+) -> Dict[str, str]:
+    filters = {}
+    
+    if category:
+        filters["category"] = category
+    if priority:
+        filters["priority"] = priority
+    if status:
+        filters["status"] = status
+    
+    return filters
+
+@api_router.get("/tasks", response_model=TaskPage)
 async def get_tasks(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     priority: Optional[str] = None,
     status: Optional[str] = None,
     search: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_archived: bool = False,
+    due_after: Optional[str] = None,
+    due_before: Optional[str] = None,
+    sort: Optional[str] = Query(None, pattern=f"^({'|'.join(TASK_SORTS)})$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    query = {"user_id": current_user.id}
+    # Unchanged polls are answered from the change version alone
+    change_version = await storage.read_change_version(current_user.id)
+    etag = collection_etag(request, current_user.id, change_version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_collection_etag(response, etag)
+    
+    filters = task_filters(category, priority, status)
+    due = due_range(due_after, due_before)
+    task_sort = TaskSort(sort or "created_at", order == "desc")
+    projection = parse_fields(fields)
     
-    if category:
-        query["category"] = category
-    if priority:
-        query["priority"] = priority
-    if status:
-        query["status"] = status
     if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+        return await search_tasks(
+            current_user.id, filters, search, limit, cursor, response, include_archived, due,
+            task_sort if sort else None, projection
+        )
+    
+    position = None
+    if cursor:
+        try:
+            position = task_sort.decode_cursor(cursor)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # The sort keys are read even when not asked for, to build the cursor
+    read_fields = None if projection is None else set(projection) | set(task_sort.document_fields)
+    if include_archived:
+        # Both tiers come back in sort order, so a page is the merge of a
+        # page from each
+        tiers = await asyncio.gather(*(
+            storage.find_tasks(
+                current_user.id, filters, position, limit + 1,
+                archived=archived, due=due, sort=task_sort, fields=read_fields
+            )
+            for archived in (False, True)
+        ))
+        tasks = merge_tiers(*tiers, key=task_sort.sort_key, reverse=task_sort.descending)[:limit + 1]
+    else:
+        tasks = await storage.find_tasks(
+            current_user.id, filters, position, limit + 1, due=due, sort=task_sort, fields=read_fields
+        )
+    page = tasks[:limit]
+    next_cursor = task_sort.encode_cursor(page[-1]) if len(tasks) > limit else None
+    return task_page(page, next_cursor, response, projection)
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """The public task fields a `fields=` listing returns; `id` always is."""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in Task.model_fields]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown task field(s): {', '.join(unknown)}")
+    return tuple(dict.fromkeys(["id", *requested]))
+
+def task_page(
+    page: List[dict], next_cursor: Optional[str], response: Response, fields: Optional[Tuple[str, ...]] = None
+):
+    if fields is not None:
+        # Partial tasks don't fit the Task model, so this always takes the orjson path
+        return json_response({"tasks": projected_tasks(page, fields), "next_cursor": next_cursor}, response)
+    if FAST_SERIALIZATION:
+        return json_response({"tasks": trusted_tasks(page), "next_cursor": next_cursor}, response)
+    return TaskPage(tasks=[Task(**task) for task in page], next_cursor=next_cursor)
+
+def merge_tiers(hot: List[dict], cold: List[dict], key, reverse: bool = False) -> List[dict]:
+    """Merge a working-set and an archive listing sorted by `key`. A task
+    caught mid-move by the archiver can be in both; it is returned once."""
+    merged = []
+    seen = set()
+    for task in heapq.merge(hot, cold, key=key, reverse=reverse):
+        if task["id"] not in seen:
+            seen.add(task["id"])
+            merged.append(task)
+    return merged
+
+async def search_tasks(
+    user_id: str,
+    filters: Dict[str, str],
+    text: str,
+    limit: int,
+    cursor: Optional[str],
+    response: Response,
+    include_archived: bool = False,
+    due: Optional[DueRange] = None,
+    task_sort: Optional[TaskSort] = None,
+    fields: Optional[Tuple[str, ...]] = None
+):
+    """Relevance-ranked matches, or with `task_sort` matches in that order.
+
+    Matches are ranked SEARCH_MAX_CANDIDATES at a time, newest first. A
+    window is ranked afresh on every request and the cursor is an offset
+    into its ranking; past the end of a full window the cursor moves on to
+    the next-newest matches, so no match is left out.
+    """
+    offset, window = 0, None
+    if cursor:
+        try:
+            offset, window = decode_offset_cursor(cursor)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if include_archived:
+        tiers = await asyncio.gather(*(
+            storage.search_tasks(
+                user_id, filters, text, SEARCH_MAX_CANDIDATES, archived=archived, due=due, before=window
+            )
+            for archived in (False, True)
+        ))
+        newest_first = merge_tiers(*tiers, key=TaskSort().sort_key, reverse=True)
+        candidates = newest_first[:SEARCH_MAX_CANDIDATES]
+    else:
+        candidates = await storage.search_tasks(user_id, filters, text, SEARCH_MAX_CANDIDATES, due=due, before=window)
+    if task_sort is not None:
+        ranked = sorted(candidates, key=task_sort.sort_key, reverse=task_sort.descending)
+    else:
+        ranked = rank_by_relevance(candidates, text)
+    page = ranked[offset:offset + limit]
+    next_cursor = None
+    if offset + limit < len(ranked):
+        next_cursor = encode_offset_cursor(offset + limit, window)
+    elif len(candidates) == SEARCH_MAX_CANDIDATES:
+        # There may be older matches; they start the next window
+        oldest = candidates[-1]
+        next_cursor = encode_offset_cursor(0, [oldest["created_at"], oldest["id"]])
+    return task_page(page, next_cursor, response, fields)
+
+async def _export_rows(tasks, export_format: str):
+    # Rows are buffered per cursor batch so each chunk written to the client
+    # holds one batch, and at most one batch is in memory at a time
+    buffer = io.StringIO()
+    writer = None
+    if export_format == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=list(Task.model_fields), extrasaction="ignore")
+        writer.writeheader()
+    
+    rows = 0
+    try:
+        async for task in tasks:
+            if writer:
+                writer.writerow(Task(**task).model_dump())
+            elif FAST_SERIALIZATION:
+                buffer.write(dumps(trusted_tasks([task])[0]).decode())
+                buffer.write("\n")
+            else:
+                buffer.write(Task(**task).model_dump_json())
+                buffer.write("\n")
+            rows += 1
+            if rows % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        await tasks.aclose()
+
+@api_router.get("/tasks/export")
+async def export_tasks(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    filters = task_filters(category, priority, status)
+    tasks = storage.iter_tasks(current_user.id, filters, search, EXPORT_BATCH_SIZE)
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(tasks, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{format}"'}
+    )
+
+@api_router.post("/tasks/events/ticket", response_model=StreamTicket)
+async def create_task_events_ticket(current_user: User = Depends(get_current_user)):
+    """A ticket for one `GET /api/tasks/events?ticket=`, valid for
+    STREAM_TICKET_TTL_SECONDS; fetch a new one for every (re)connect."""
+    return StreamTicket(ticket=create_stream_ticket(current_user.id), expires_in=STREAM_TICKET_TTL_SECONDS)
+
+@api_router.get("/tasks/events")
+async def task_events(
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """Server-Sent Events feed of the user's task creates, updates and
+    deletes; reconnects resume after Last-Event-ID. Authenticates with the
+    bearer token or, for EventSource, `?ticket=` (see above)."""
+    return StreamingResponse(
+        change_broker.stream(current_user.id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+SYNC_KEYS = ("updated_at", "id")
+
+@api_router.get("/tasks/changes", response_model=TaskChanges)
+async def get_task_changes(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """Tasks changed and ids deleted after `since`, oldest first.
+
+    Without `since` this pages through every task (the initial sync). Tokens
+    are (updated_at, id) positions; the same task may be returned again by a
+    later call, never skipped.
+    """
+    now = utc_now()
+    position = None
+    if since:
+        try:
+            position = decode_cursor(since, SYNC_KEYS)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        if not isinstance(position[0], datetime):
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        if position[0] < now - timedelta(seconds=TOMBSTONE_TTL_SECONDS):
+            # Deletions that old have been forgotten
+            raise HTTPException(status_code=410, detail="Sync token expired, resync in full")
+    
+    tasks = await storage.changed_tasks(current_user.id, position, limit + 1)
+    
+    # A client starting from scratch has nothing to delete
+    tombstones = []
+    if position:
+        tombstones = await storage.tombstones(current_user.id, position, limit + 1)
     
-    tasks = await db.tasks.find(query, {"_id": 0}).to_list(1000)
-    return [Task(**task) for task in tasks]
+    # Both lists are in (timestamp, id) order; merge them into one page
+    merged = list(heapq.merge(
+        ((task["updated_at"], task["id"], 0, task) for task in tasks),
+        ((tombstone["deleted_at"], tombstone["id"], 1, tombstone) for tombstone in tombstones),
+        key=lambda entry: entry[:3],
+    ))
+    has_more = len(merged) > limit
+    page = merged[:limit]
+    
+    next_position = list(page[-1][:2]) if page else position
+    settled = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    if not has_more and (next_position is None or not isinstance(next_position[0], datetime) or next_position[0] > settled):
+        next_position = [settled, ""]
+    
+    page_tasks = [entry[3] for entry in page if entry[2] == 0]
+    deleted = [entry[3] for entry in page if entry[2] == 1]
+    next_since = encode_cursor(dict(zip(SYNC_KEYS, next_position)), SYNC_KEYS)
+    if FAST_SERIALIZATION:
+        return json_response({
+            "tasks": trusted_tasks(page_tasks), "deleted": deleted, "next_since": next_since, "has_more": has_more
+        })
+    return TaskChanges(
+        tasks=[Task(**task) for task in page_tasks],
+        deleted=[TaskTombstone(**tombstone) for tombstone in deleted],
+        next_since=next_since,
+        has_more=has_more
+    )
+
+DUE_KEYS = ("due_date", "id")
+
+async def due_task_page(
+    user_id: str, due: DueRange, limit: int, cursor: Optional[str], response: Response
+):
+    """Pending tasks due in `due`, soonest first, paged by (due_date, id)."""
+    position = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor, DUE_KEYS)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if not isinstance(position[0], datetime):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    tasks = await storage.find_due_tasks(user_id, "pending", due, position, limit + 1)
+    page, next_cursor = split_page(tasks, limit, DUE_KEYS)
+    return task_page(page, next_cursor, response)
+
+@api_router.get("/tasks/overdue", response_model=TaskPage)
+async def get_overdue_tasks(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Pending tasks whose due date has passed, longest overdue first."""
+    return await due_task_page(current_user.id, (None, utc_now()), limit, cursor, response)
+
+@api_router.get("/tasks/upcoming", response_model=TaskPage)
+async def get_upcoming_tasks(
+    response: Response,
+    days: int = Query(7, ge=1, le=366),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Pending tasks due within the next `days` days, soonest first."""
+    now = utc_now()
+    return await due_task_page(current_user.id, (now, now + timedelta(days=days)), limit, cursor, response)
+
+@api_router.get("/tasks/calendar")
+async def get_task_calendar(
+    request: Request,
+    response: Response,
+    start: str = Query(..., alias="from"),
+    end: str = Query(..., alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """Task counts per UTC day of due date, for days in [from, to).
+
+    Days without tasks are left out. Counts come from the due-date index
+    alone; no task documents are read.
+    """
+    due_after, due_before = parse_due_bound("from", start), parse_due_bound("to", end)
+    if due_before <= due_after:
+        raise HTTPException(status_code=400, detail="to must be after from")
+    if due_before - due_after > timedelta(days=CALENDAR_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Calendar range is limited to {CALENDAR_MAX_DAYS} days")
+    
+    change_version = await storage.read_change_version(current_user.id)
+    etag = collection_etag(request, current_user.id, change_version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_collection_etag(response, etag)
+    
+    days = await storage.due_date_counts(current_user.id, (due_after, due_before))
+    content = calendar_response(days, due_after, due_before)
+    return json_response(content, response) if FAST_SERIALIZATION else content
+
+@api_router.post("/tasks/bulk", response_model=BulkResponse)
+async def bulk_create_tasks(request: BulkCreateRequest, current_user: User = Depends(get_current_user)):
+    now = utc_now()
+    results = []
+    documents = []
+    positions = []
+    for index, item in enumerate(request.tasks):
+        try:
+            documents.append(new_task_document(TaskCreate.model_validate(item), current_user.id, now))
+            positions.append(index)
+        except ValidationError as exc:
+            results.append(BulkItemResult(index=index, status=422, error=validation_message(exc)))
+        except HTTPException as exc:
+            results.append(BulkItemResult(index=index, status=exc.status_code, error=exc.detail))
+    
+    failed_positions = await storage.insert_tasks(documents) if documents else {}
+    
+    inserted = []
+    for position, (index, document) in enumerate(zip(positions, documents)):
+        if position in failed_positions:
+            # The driver's message names indexes and values; keep it in the log
+            logger.warning("Bulk insert failed at index %d: %s", index, failed_positions[position])
+            results.append(BulkItemResult(index=index, status=500, error="Task could not be saved"))
+        else:
+            inserted.append(document)
+            results.append(BulkItemResult(index=index, id=document["id"], status=201, task=Task(**document)))
+    
+    if inserted:
+        delta = task_stats.combine(task_stats.task_delta(task) for task in inserted)
+        await storage.apply_stats_delta(current_user.id, delta)
+        tasks_changed(current_user.id, CREATED, inserted)
+    return bulk_response(results)
+
+@api_router.patch("/tasks/bulk", response_model=BulkResponse)
+async def bulk_update_tasks(request: BulkUpdateRequest, current_user: User = Depends(get_current_user)):
+    now = utc_now()
+    results = []
+    changes = {}
+    task_versions = {}
+    for index, item in enumerate(request.updates):
+        try:
+            task_update = BulkTaskUpdate.model_validate(item)
+            changes[index] = (task_update.id, task_changes(task_update, now))
+            task_versions[index] = task_update.version
+        except ValidationError as exc:
+            results.append(BulkItemResult(index=index, id=item.get("id"), status=422, error=validation_message(exc)))
+        except HTTPException as exc:
+            results.append(BulkItemResult(index=index, id=item.get("id"), status=exc.status_code, error=exc.detail))
+    
+    # One read for the current state of every task the caller owns in the batch
+    ids = list({task_id for task_id, _ in changes.values()})
+    owned = await storage.find_owned_tasks(current_user.id, ids)
+    current = {task["id"]: task for task in owned}
+    # Archived tasks are moved back to the working set to be edited
+    restored = await storage.restore_tasks(current_user.id, [task_id for task_id in ids if task_id not in current])
+    if restored:
+        current.update((task["id"], task) for task in await storage.find_owned_tasks(current_user.id, restored))
+    
+    updates = []
+    pending = {}
+    for index, (task_id, update_data) in changes.items():
+        if task_id not in current:
+            results.append(BulkItemResult(index=index, id=task_id, status=404, error="Task not found"))
+        elif any(other_id == task_id for other_id, _ in pending.values()):
+            results.append(BulkItemResult(index=index, id=task_id, status=422, error="Duplicate id in batch"))
+        else:
+            # Only apply if the counted fields are still what we read, so the
+            # counter deltas below stay exact
+            expected = {field: current[task_id].get(field) for field in task_stats.COUNTED_FIELDS}
+            versions = [task_versions[index]] if task_versions[index] is not None else None
+            updates.append((task_id, update_data, expected, versions))
+            pending[index] = (task_id, update_data)
+    
+    if updates:
+        landed_ids = await storage.update_tasks(current_user.id, updates, now)
+        for index, (task_id, _) in list(pending.items()):
+            if task_id not in landed_ids:
+                del pending[index]
+                results.append(BulkItemResult(
+                    index=index, id=task_id, status=409, error="Task was modified concurrently or version mismatch"
+                ))
+    
+    deltas = []
+    updated_tasks = []
+    for index, (task_id, update_data) in pending.items():
+        updated_task = {**current[task_id], **update_data, "version": current[task_id].get("version", 0) + 1}
+        deltas.append(task_stats.transition_delta(current[task_id], updated_task))
+        updated_tasks.append(updated_task)
+        results.append(BulkItemResult(index=index, id=task_id, status=200, task=Task(**updated_task)))
+    
+    if pending:
+        await storage.apply_stats_delta(current_user.id, task_stats.combine(deltas))
+        tasks_changed(current_user.id, UPDATED, updated_tasks)
+    return bulk_response(results)
+
+@api_router.delete("/tasks/bulk", response_model=BulkResponse)
+async def bulk_delete_tasks(request: BulkDeleteRequest, current_user: User = Depends(get_current_user)):
+    ids = list(set(request.ids))
+    owned = await storage.find_owned_tasks(current_user.id, ids)
+    missing = [task_id for task_id in ids if task_id not in {task["id"] for task in owned}]
+    if missing:
+        owned += await storage.find_owned_tasks(current_user.id, missing, archived=True)
+    by_id = {task["id"]: task for task in owned}
+    
+    results = []
+    seen = set()
+    for index, task_id in enumerate(request.ids):
+        if task_id in seen:
+            results.append(BulkItemResult(index=index, id=task_id, status=422, error="Duplicate id in batch"))
+            continue
+        seen.add(task_id)
+        if task_id in by_id:
+            results.append(BulkItemResult(index=index, id=task_id, status=200))
+        else:
+            results.append(BulkItemResult(index=index, id=task_id, status=404, error="Task not found"))
+    
+    if by_id:
+        deleted_count = await storage.delete_tasks(current_user.id, list(by_id))
+        await storage.record_tombstones(current_user.id, list(by_id), utc_now())
+        if deleted_count == len(by_id):
+            delta = task_stats.combine(task_stats.task_delta(task, -1) for task in owned)
+            await storage.apply_stats_delta(current_user.id, delta)
+        else:
+            # A concurrent delete got some of them first, or the archiver had
+            # one in both tiers mid-move; recount rather than guess
+            await storage.rebuild_user_stats(current_user.id)
+        tasks_changed(current_user.id, DELETED, owned)
+    
+    return bulk_response(results)
 
 @api_router.get("/tasks/{task_id}", response_model=Task)
-async def get_task(task_id: str, current_user: User = Depends(get_current_user)):
-    task = await db.tasks.find_one({"id": task_id, "user_id": current_user.id}, {"_id": 0})
+async def get_task(task_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    # Archived tasks are still readable by id
+    task = await storage.find_task(current_user.id, task_id) or await storage.find_task(
+        current_user.id, task_id, archived=True
+    )
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
+    response.headers["ETag"] = task_etag(task)
+    if FAST_SERIALIZATION:
+        return json_response(trusted_tasks([task])[0], response)
     return Task(**task)
 
 @api_router.put("/tasks/{task_id}", response_model=Task)
 async def update_task(
     task_id: str,
     task_data: TaskUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user)
 ):
-    task = await db.tasks.find_one({"id": task_id, "user_id": current_user.id})
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    update_data = task_changes(task_data, utc_now())
     
-    update_data = {k: v for k, v in task_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    # If-Match (412 on mismatch) takes precedence over a version in the body (409)
+    expected_versions = None
+    if if_match is not None:
+        expected_versions = parse_if_match(if_match)
+    elif task_data.version is not None:
+        expected_versions = [task_data.version]
     
-    await db.tasks.update_one(
-        {"id": task_id, "user_id": current_user.id},
-        {"$set": update_data}
-    )
+    # Atomic; the post-image is exactly the returned pre-image plus our changes
+    task = await storage.update_task(current_user.id, task_id, update_data, {}, expected_versions)
+    if task is None and await storage.restore_tasks(current_user.id, [task_id]):
+        # It was archived; edits apply to the working set, so move it back first
+        task = await storage.update_task(current_user.id, task_id, update_data, {}, expected_versions)
+    if task is None:
+        if expected_versions is not None:
+            # Only the failure path pays for telling "gone" from "changed"
+            exists = await storage.find_task(current_user.id, task_id)
+            if exists:
+                status_code = 412 if if_match is not None else 409
+                raise HTTPException(status_code=status_code, detail="Task has been modified by someone else")
+        raise HTTPException(status_code=404, detail="Task not found")
     
-    updated_task = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+    updated_task = {**task, **update_data, "version": task.get("version", 0) + 1}
+    await storage.apply_stats_delta(current_user.id, task_stats.transition_delta(task, updated_task))
+    tasks_changed(current_user.id, UPDATED, [updated_task])
+    response.headers["ETag"] = task_etag(updated_task)
     return Task(**updated_task)
 
 @api_router.delete("/tasks/{task_id}")
 async def delete_task(task_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.tasks.delete_one({"id": task_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    deleted = await storage.delete_task(current_user.id, task_id)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    await storage.record_tombstones(current_user.id, [task_id], utc_now())
+    await storage.apply_stats_delta(current_user.id, task_stats.task_delta(deleted, -1))
+    tasks_changed(current_user.id, DELETED, [{"id": task_id}])
     return {"message": "Task deleted successfully"}
 
 # Analytics Routes
 @api_router.get("/analytics/summary")
-async def get_analytics_summary(current_user: User = Depends(get_current_user)):
-    all_tasks = await db.tasks.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    
-    total_tasks = len(all_tasks)
-    completed_tasks = len([t for t in all_tasks if t["status"] == "completed"])
-    pending_tasks = total_tasks - completed_tasks
-    completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-    
-    by_category = {}
-    by_priority = {}
-    
-    for task in all_tasks:
-        # Category count
-        cat = task["category"]
-        if cat not in by_category:
-            by_category[cat] = {"total": 0, "completed": 0}
-        by_category[cat]["total"] += 1
-        if task["status"] == "completed":
-            by_category[cat]["completed"] += 1
-        
-        # Priority count
-        pri = task["priority"]
-        if pri not in by_priority:
-            by_priority[pri] = {"total": 0, "completed": 0}
-        by_priority[pri]["total"] += 1
-        if task["status"] == "completed":
-            by_priority[pri]["completed"] += 1
+async def get_analytics_summary(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    state = await analytics_cache.entry(current_user.id)
+    etag = collection_etag(request, current_user.id, state.change_version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_collection_etag(response, etag)
     
-    return {
-        "total_tasks": total_tasks,
-        "completed_tasks": completed_tasks,
-        "pending_tasks": pending_tasks,
-        "completion_rate": round(completion_rate, 1),
-        "by_category": by_category,
-        "by_priority": by_priority
-    }
+    summary = task_stats.normalize(state.stats)
+    content = summary_response(
+        summary["total"], summary["completed"], summary["by_category"], summary["by_priority"]
+    )
+    return json_response(content, response) if FAST_SERIALIZATION else content
 
 @api_router.get("/analytics/trends")
-async def get_analytics_trends(current_user: User = Depends(get_current_user)):
-    all_tasks = await db.tasks.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+async def get_analytics_trends(
+    request: Request,
+    response: Response,
+    weeks: int = Query(8, ge=1, le=520),
+    granularity: str = Query("week", pattern="^(day|week|month)$"),
+    current_user: User = Depends(get_current_user)
+):
+    start = trends_window_start(datetime.now(timezone.utc), weeks, granularity)
+    state = await analytics_cache.entry(current_user.id)
+    # The window slides with the calendar, so its start is part of the tag too
+    etag = collection_etag(request, current_user.id, state.change_version, extra=start.isoformat())
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_collection_etag(response, etag)
     
-    # Group by week
-    weekly_data = {}
-    for task in all_tasks:
-        try:
-            task_date = datetime.fromisoformat(task["created_at"].replace('Z', '+00:00'))
-            week_key = task_date.strftime("%Y-W%U")
-            
-            if week_key not in weekly_data:
-                weekly_data[week_key] = {"created": 0, "completed": 0}
-            
-            weekly_data[week_key]["created"] += 1
-            if task["status"] == "completed":
-                weekly_data[week_key]["completed"] += 1
-        except:
-            pass
-    
-    # Convert to sorted list
-    trends = []
-    for week, data in sorted(weekly_data.items()):
-        trends.append({
-            "week": week,
-            "created": data["created"],
-            "completed": data["completed"]
-        })
+    async def compute_trends():
+        buckets = await storage.trend_buckets(current_user.id, start, granularity)
+        return trends_response(buckets, granularity)
     
-    return {"trends": trends[-8:]}  # Last 8 weeks
+    content = await analytics_cache.result(state, current_user.id, ("trends", start, granularity), compute_trends)
+    return json_response(content, response) if FAST_SERIALIZATION else content
+
+# Operational endpoints (outside /api)
+def component_stats() -> dict:
+    return {
+        "mongo_pool": {
+            **mongo_pool_metrics.stats(),
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+        },
+        "storage": storage.stats() if storage is not None else {},
+        "change_feed": change_broker.stats(),
+        "task_inserts": task_inserts.stats() if task_inserts is not None else {},
+        "analytics_cache": analytics_cache.stats(),
+        "archiver": task_archiver.stats() if task_archiver is not None else {},
+        "admission": admission.stats(),
+        "password_hasher": password_hasher.stats(),
+        "auth_cache": {
+            "tokens": token_cache.stats(),
+            "users": user_cache.stats(),
+        }
+    }
+
+metrics.register_component_stats(component_stats)
+
+@app.get("/stats")
+async def get_stats():
+    return component_stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the worker is up and its event loop is responsive.
+
+    Deliberately independent of MongoDB; restarting workers doesn't help
+    when the database is down, that's what readiness is for.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: startup finished and the storage backend answers a ping
+    (for MongoDB, on the dedicated health connection)."""
+    if not app.state.ready:
+        return json_response({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(storage.ping(), READINESS_TIMEOUT_SECONDS)
+    except (PyMongoError, sqlite3.Error, asyncio.TimeoutError) as error:
+        return json_response({"status": "unavailable", "storage": type(error).__name__}, status_code=503)
+    return {"status": "ready", "storage": storage.stats()}
+
+@app.exception_handler(WaitQueueTimeoutError)
+async def connection_pool_exhausted(request: Request, exc: WaitQueueTimeoutError):
+    return Response(
+        content=dumps({"detail": "Database busy, please retry"}),
+        status_code=503,
+        media_type="application/json",
+        headers={"Retry-After": "1"},
+    )
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -329,13 +1354,18 @@ origins = [
     "https://tasktrackernew.netlify.app",  # your exact Netlify URL
 ]
 
+# Inside CORS, so browsers can read rejections (and their Retry-After)
+app.add_middleware(AdmissionMiddleware, controller=admission)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
+# Outermost, so the timings include CORS handling and error responses
+app.add_middleware(metrics.MetricsMiddleware, slow_request_seconds=SLOW_REQUEST_MS / 1000)
 
 
 logging.basicConfig(
@@ -344,6 +1374,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+background_tasks = set()
+
+def start_background_task(coroutine) -> None:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
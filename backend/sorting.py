@@ -0,0 +1,75 @@
+"""Server-side orderings for task listings (`GET /api/tasks?sort=&order=`).
+
+Every sort is a tuple of stored keys ending in `id`, so the order is total
+and a page can be resumed from the keys of its last task. Each has a
+compound index `(user_id, [status,] keys...)` (see indexes.py), so the
+database walks the index in order, forwards or backwards, instead of sorting.
+
+Priorities are labels whose alphabetical order (High < Low < Medium) is
+useless, so tasks also store `priority_rank`, written wherever `priority`
+is, and priority sorts use that.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from pagination import InvalidCursor, SORT_KEYS, decode_cursor, encode_cursor, sort_order
+
+PRIORITY_RANKS = {"Low": 1, "Medium": 2, "High": 3}
+
+TASK_SORTS: Dict[str, Tuple[str, ...]] = {
+    "created_at": SORT_KEYS,
+    "due_date": ("due_date", "id"),
+    "priority": ("priority_rank", "created_at", "id"),
+    "updated_at": ("updated_at", "id"),
+}
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    """Semantic order of a priority label; unknown labels sort below Low."""
+    return PRIORITY_RANKS.get(priority, 0)
+
+
+@dataclass(frozen=True)
+class TaskSort:
+    field: str = "created_at"
+    descending: bool = False
+
+    @property
+    def keys(self) -> Tuple[str, ...]:
+        return TASK_SORTS[self.field]
+
+    @property
+    def is_default(self) -> bool:
+        return self.keys == SORT_KEYS and not self.descending
+
+    @property
+    def document_fields(self) -> Tuple[str, ...]:
+        """Public task fields `sort_key` needs."""
+        return tuple("priority" if key == "priority_rank" else key for key in self.keys)
+
+    @property
+    def tag(self) -> str:
+        return f"{self.field}:{'desc' if self.descending else 'asc'}"
+
+    def key_values(self, task: Dict[str, Any]) -> Tuple[Any, ...]:
+        # The rank is derived from the label, so tasks read without it sort the same
+        return tuple(priority_rank(task.get("priority")) if key == "priority_rank" else task[key] for key in self.keys)
+
+    def sort_key(self, task: Dict[str, Any]) -> Tuple[Any, ...]:
+        """Orders tasks as the database does, legacy date strings included."""
+        return tuple(sort_order(value) for value in self.key_values(task))
+
+    def encode_cursor(self, task: Dict[str, Any]) -> str:
+        if self.is_default:
+            return encode_cursor(task)
+        # Other sorts carry their tag, so a cursor can't be replayed against a different order
+        values = dict(zip(self.keys, self.key_values(task)), sort=self.tag)
+        return encode_cursor(values, ("sort",) + self.keys)
+
+    def decode_cursor(self, cursor: str) -> List[Any]:
+        if self.is_default:
+            return decode_cursor(cursor)
+        tag, *values = decode_cursor(cursor, ("sort",) + self.keys)
+        if tag != self.tag:
+            raise InvalidCursor("Cursor belongs to a different sort order")
+        return values
@@ -0,0 +1,827 @@
+"""Embedded SQLite storage backend; see storage.py for the interface.
+
+One database file in WAL mode: readers never wait for the writer, and a
+commit is an append to the log (`synchronous=NORMAL` syncs at checkpoints,
+so a power loss can drop the last commits but never corrupts the file).
+sqlite3 calls block, so they run on a small thread pool where every thread
+keeps its own connection, and the event loop only awaits them. Writes that
+must be atomic run in one `BEGIN IMMEDIATE` transaction, which takes the
+write lock up front, so concurrent writers queue on `busy_timeout` instead
+of failing to upgrade a read lock.
+
+The schema mirrors the Mongo collections and their indexes: one task index
+per `get_tasks` filter combination ending in (created_at, id), search word
+prefixes in `task_terms` keyed by (user_id, term), archived tasks in
+`tasks_archive` (with only the (user_id, created_at, id) and sort indexes),
+one index per other sort order with and without a leading status (these
+also serve delta sync and the due-date views), task
+counters as one JSON document per user, and tombstones in (user_id, deleted_at, id) order, pruned
+after `TOMBSTONE_TTL_SECONDS` by a background job. Datetimes are stored as
+fixed-width UTC ISO 8601 strings, which sort chronologically.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+import task_stats
+from analytics import TREND_FORMATS
+from dates import utc_now
+from indexes import SORT_INDEX_PREFIXES, TASK_FILTER_FIELDS, TOMBSTONE_TTL_SECONDS, filter_combinations, sort_index_name
+from pagination import SORT_KEYS
+from search import TEXT_FIELDS, query_terms, search_terms
+from sorting import PRIORITY_RANKS, TASK_SORTS, TaskSort
+from storage import DueRange, Storage, Task, TaskUpdate, merge_streams
+
+logger = logging.getLogger(__name__)
+
+TASK_COLUMNS = (
+    "id", "user_id", "title", "description", "due_date", "priority", "category", "status",
+    "created_at", "updated_at", "version", "priority_rank",
+)
+DATE_COLUMNS = ("due_date", "created_at", "updated_at", "deleted_at")
+# Fields a caller may filter or condition an update on
+MATCH_COLUMNS = frozenset(TASK_FILTER_FIELDS) | {"updated_at"}
+
+TOMBSTONE_PRUNE_INTERVAL_SECONDS = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    due_date TEXT,
+    priority TEXT NOT NULL,
+    category TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    priority_rank INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_status_updated ON tasks (status, updated_at);
+CREATE TABLE IF NOT EXISTS tasks_archive (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    due_date TEXT,
+    priority TEXT NOT NULL,
+    category TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    priority_rank INTEGER NOT NULL DEFAULT 0,
+    -- Space-separated; the cold tier is searched by scanning one user's rows
+    search_terms TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS tasks_archive_user_created ON tasks_archive (user_id, created_at, id);
+CREATE TABLE IF NOT EXISTS task_terms (
+    user_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    task_id TEXT NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, term, task_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS task_terms_task ON task_terms (task_id);
+CREATE TABLE IF NOT EXISTS task_tombstones (
+    user_id TEXT NOT NULL,
+    deleted_at TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (user_id, deleted_at, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS task_tombstones_deleted ON task_tombstones (deleted_at);
+CREATE TABLE IF NOT EXISTS task_stats (
+    user_id TEXT PRIMARY KEY,
+    change_version INTEGER NOT NULL DEFAULT 0,
+    stats TEXT NOT NULL
+);
+"""
+
+
+def _task_list_indexes() -> str:
+    statements = []
+    for fields in filter_combinations():
+        name = "_".join(("tasks_user",) + fields + ("created",))
+        columns = ", ".join(("user_id",) + fields + ("created_at", "id"))
+        statements.append(f"CREATE INDEX IF NOT EXISTS {name} ON tasks ({columns});")
+    return "\n".join(statements)
+
+
+def _sort_index(table: str, keys: Tuple[str, ...], prefix: Tuple[str, ...] = ()) -> str:
+    return f"{table}_{sort_index_name(keys, prefix)}"
+
+
+def _task_sort_indexes() -> str:
+    statements = []
+    for keys in TASK_SORTS.values():
+        if keys == SORT_KEYS:
+            continue
+        for table, prefixes in (("tasks", SORT_INDEX_PREFIXES), ("tasks_archive", ((),))):
+            for prefix in prefixes:
+                columns = ", ".join(("user_id",) + prefix + keys)
+                name = _sort_index(table, keys, prefix)
+                statements.append(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});")
+    return "\n".join(statements)
+
+
+def encode_datetime(value: datetime) -> str:
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _encode(value: Any) -> Any:
+    return encode_datetime(value) if isinstance(value, datetime) else value
+
+
+def _decode_task(row: sqlite3.Row) -> Task:
+    task = dict(row)
+    for column in DATE_COLUMNS:
+        if task.get(column) is not None:
+            task[column] = datetime.fromisoformat(task[column])
+    return task
+
+
+def _trend_bucket(label_format: str, created_at: str) -> str:
+    return datetime.fromisoformat(created_at).strftime(label_format)
+
+
+def _increment(document: Dict[str, Any], path: str, value: int) -> None:
+    """`$inc` on a dotted path of a nested dict."""
+    *parents, leaf = path.split(".")
+    for key in parents:
+        document = document.setdefault(key, {})
+    document[leaf] = document.get(leaf, 0) + value
+
+
+@contextmanager
+def _transaction(connection: sqlite3.Connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: str, public_fields: Iterable[str], workers: int = 4, busy_timeout_ms: int = 5000):
+        super().__init__(public_fields)
+        self.path = path
+        self.workers = workers
+        self.busy_timeout_ms = busy_timeout_ms
+        self.columns = ", ".join(column for column in TASK_COLUMNS if column in self.public_fields)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.operations = 0
+        self.failures = 0
+        self.queued = 0
+
+    # Thread-pool adapter
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit; transactions are opened explicitly with _transaction
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.create_function("trend_bucket", 2, _trend_bucket, deterministic=True)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _call(self, operation: str, function: Callable, args: tuple, submitted: float):
+        with self._lock:
+            self.queued -= 1
+        try:
+            return function(self._connection(), *args)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            metrics.SQLITE_FAILURES.labels(operation).inc()
+            raise
+        finally:
+            with self._lock:
+                self.operations += 1
+            metrics.SQLITE_LATENCY.labels(operation).observe(time.perf_counter() - submitted)
+
+    async def _run(self, function: Callable, *args):
+        """Run `function(connection, *args)` on the pool."""
+        with self._lock:
+            self.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call, function.__name__.lstrip("_"), function, args, time.perf_counter()
+        )
+
+    # Lifecycle
+
+    async def open(self) -> None:
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="sqlite")
+        await self._run(self._create_schema)
+
+    def _create_schema(self, connection: sqlite3.Connection) -> None:
+        # WAL is a property of the file, so setting it once covers every connection
+        mode = connection.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode != "wal":
+            logger.warning("SQLite database %s is in %s journal mode, not WAL", self.path, mode)
+        connection.executescript(SCHEMA)
+        for table in ("tasks", "tasks_archive"):
+            columns = {row["name"] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if "priority_rank" not in columns:
+                # Files created before server-side sorting
+                ranks = " ".join(f"WHEN '{label}' THEN {rank}" for label, rank in PRIORITY_RANKS.items())
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN priority_rank INTEGER NOT NULL DEFAULT 0")
+                connection.execute(f"UPDATE {table} SET priority_rank = CASE priority {ranks} ELSE 0 END")
+        connection.executescript(_task_list_indexes() + _task_sort_indexes())
+
+    def background_jobs(self):
+        return [self.prune_tombstones()]
+
+    async def prune_tombstones(self, interval: float = TOMBSTONE_PRUNE_INTERVAL_SECONDS) -> None:
+        """The TTL index's job: forget deletions older than the sync window."""
+        while True:
+            cutoff = utc_now() - timedelta(seconds=TOMBSTONE_TTL_SECONDS)
+            try:
+                await self._run(self._delete_tombstones_before, encode_datetime(cutoff))
+            except sqlite3.Error as exc:
+                logger.warning("Pruning task tombstones failed: %s", exc)
+            await asyncio.sleep(interval)
+
+    def _delete_tombstones_before(self, connection: sqlite3.Connection, cutoff: str) -> None:
+        connection.execute("DELETE FROM task_tombstones WHERE deleted_at < ?", (cutoff,))
+
+    async def ping(self) -> None:
+        await self._run(self._ping)
+
+    def _ping(self, connection: sqlite3.Connection) -> None:
+        connection.execute("SELECT 1").fetchone()
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "workers": self.workers,
+            "connections": len(self._connections),
+            "queued": self.queued,
+            "operations": self.operations,
+            "failures": self.failures,
+        }
+
+    # Users
+
+    async def find_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._find_user, "id", user_id)
+
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._find_user, "email", email)
+
+    def _find_user(self, connection: sqlite3.Connection, column: str, value: str) -> Optional[Dict[str, Any]]:
+        row = connection.execute(f"SELECT * FROM users WHERE {column} = ?", (value,)).fetchone()
+        return dict(row) if row else None
+
+    async def insert_user(self, user: Dict[str, Any]) -> None:
+        await self._run(self._insert_user, user)
+
+    def _insert_user(self, connection: sqlite3.Connection, user: Dict[str, Any]) -> None:
+        empty = {"initialized": True, "total": 0, "completed": 0, "by_category": {}, "by_priority": {}}
+        with _transaction(connection):
+            connection.execute(
+                "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                (user["id"], user["email"], user["password_hash"], user["created_at"]),
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO task_stats (user_id, change_version, stats) VALUES (?, 0, ?)",
+                (user["id"], json.dumps(empty)),
+            )
+
+    async def replace_password_hash(self, user_id: str, old_hash: str, new_hash: str) -> None:
+        await self._run(self._replace_password_hash, user_id, old_hash, new_hash)
+
+    def _replace_password_hash(self, connection: sqlite3.Connection, user_id: str, old_hash: str, new_hash: str):
+        connection.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?", (new_hash, user_id, old_hash)
+        )
+
+    # Task writes
+
+    async def insert_tasks(self, tasks: List[Task]) -> Dict[int, Exception]:
+        return await self._run(self._insert_tasks, tasks)
+
+    def _insert_tasks(self, connection: sqlite3.Connection, tasks: List[Task]) -> Dict[int, Exception]:
+        placeholders = ", ".join("?" for _ in TASK_COLUMNS)
+        insert = f"INSERT INTO tasks ({', '.join(TASK_COLUMNS)}) VALUES ({placeholders})"
+        errors = {}
+        with _transaction(connection):
+            for index, task in enumerate(tasks):
+                # Unordered: a failed statement is rolled back on its own
+                try:
+                    connection.execute(insert, [_encode(task.get(column)) for column in TASK_COLUMNS])
+                except sqlite3.IntegrityError as exc:
+                    errors[index] = exc
+                    continue
+                self._insert_terms(connection, task["user_id"], task["id"], task.get("search_terms", []))
+        return errors
+
+    def _insert_terms(self, connection: sqlite3.Connection, user_id: str, task_id: str, terms: List[str]) -> None:
+        connection.executemany(
+            "INSERT OR IGNORE INTO task_terms (user_id, term, task_id) VALUES (?, ?, ?)",
+            [(user_id, term, task_id) for term in terms],
+        )
+
+    def _match(
+        self, user_id: str, task_id: str, expected: Dict[str, Any], versions: Optional[List[int]]
+    ) -> Tuple[str, list]:
+        clauses, params = ["id = ?", "user_id = ?"], [task_id, user_id]
+        for field, value in expected.items():
+            if field not in MATCH_COLUMNS:
+                raise ValueError(f"Can't condition on {field!r}")
+            clauses.append(f"{field} IS ?")
+            params.append(_encode(value))
+        if versions is not None:
+            clauses.append(f"version IN ({', '.join('?' for _ in versions)})")
+            params += versions
+        return " AND ".join(clauses), params
+
+    def _apply_changes(
+        self, connection: sqlite3.Connection, user_id: str, task_id: str, changes: Dict[str, Any], current: sqlite3.Row
+    ):
+        """Apply `changes` to a task whose row read in this transaction is `current`."""
+        columns = [column for column in changes if column in TASK_COLUMNS and column not in ("id", "user_id")]
+        assignments = ", ".join([f"{column} = ?" for column in columns] + ["version = version + 1"])
+        connection.execute(
+            f"UPDATE tasks SET {assignments} WHERE id = ?",
+            [_encode(changes[column]) for column in columns] + [task_id],
+        )
+        if any(field in changes for field in TEXT_FIELDS):
+            text = {field: changes.get(field, current[field]) for field in TEXT_FIELDS}
+            connection.execute("DELETE FROM task_terms WHERE task_id = ?", (task_id,))
+            self._insert_terms(connection, user_id, task_id, search_terms(text["title"], text["description"]))
+
+    async def update_task(
+        self,
+        user_id: str,
+        task_id: str,
+        changes: Dict[str, Any],
+        expected: Dict[str, Any],
+        versions: Optional[List[int]] = None,
+    ) -> Optional[Task]:
+        return await self._run(self._update_task, user_id, task_id, changes, expected, versions)
+
+    def _update_task(self, connection, user_id, task_id, changes, expected, versions) -> Optional[Task]:
+        where, params = self._match(user_id, task_id, expected, versions)
+        with _transaction(connection):
+            row = connection.execute(f"SELECT {', '.join(TASK_COLUMNS)} FROM tasks WHERE {where}", params).fetchone()
+            if row is None:
+                return None
+            self._apply_changes(connection, user_id, task_id, changes, row)
+        wanted = {*self.public_fields, *task_stats.COUNTED_FIELDS}
+        return {field: value for field, value in _decode_task(row).items() if field in wanted}
+
+    async def update_tasks(self, user_id: str, updates: List[TaskUpdate], now: datetime) -> Set[str]:
+        return await self._run(self._update_tasks, user_id, updates)
+
+    def _update_tasks(self, connection: sqlite3.Connection, user_id: str, updates: List[TaskUpdate]) -> Set[str]:
+        landed = set()
+        with _transaction(connection):
+            for task_id, changes, expected, versions in updates:
+                where, params = self._match(user_id, task_id, expected, versions)
+                row = connection.execute(f"SELECT title, description FROM tasks WHERE {where}", params).fetchone()
+                if row:
+                    self._apply_changes(connection, user_id, task_id, changes, row)
+                    landed.add(task_id)
+        return landed
+
+    async def delete_task(self, user_id: str, task_id: str) -> Optional[Task]:
+        return await self._run(self._delete_task, user_id, task_id)
+
+    def _delete_task(self, connection: sqlite3.Connection, user_id: str, task_id: str) -> Optional[Task]:
+        returning = ", ".join(task_stats.COUNTED_FIELDS)
+        with _transaction(connection):
+            rows = [
+                connection.execute(
+                    f"DELETE FROM {table} WHERE id = ? AND user_id = ? RETURNING {returning}", (task_id, user_id)
+                ).fetchone()
+                for table in ("tasks", "tasks_archive")
+            ]
+        return next((dict(row) for row in rows if row), None)
+
+    async def delete_tasks(self, user_id: str, task_ids: List[str]) -> int:
+        return await self._run(self._delete_tasks, user_id, task_ids)
+
+    def _delete_tasks(self, connection: sqlite3.Connection, user_id: str, task_ids: List[str]) -> int:
+        deleted = 0
+        with _transaction(connection):
+            for task_id in task_ids:
+                for table in ("tasks", "tasks_archive"):
+                    deleted += connection.execute(
+                        f"DELETE FROM {table} WHERE id = ? AND user_id = ?", (task_id, user_id)
+                    ).rowcount
+        return deleted
+
+    async def archive_tasks(self, completed_before: datetime, limit: int) -> Dict[str, int]:
+        return await self._run(self._archive_tasks, encode_datetime(completed_before), limit)
+
+    def _archive_tasks(self, connection: sqlite3.Connection, completed_before: str, limit: int) -> Dict[str, int]:
+        columns = ", ".join(TASK_COLUMNS)
+        # One transaction, so a task is always in exactly one tier
+        with _transaction(connection):
+            rows = connection.execute(
+                "SELECT id, user_id FROM tasks WHERE status = 'completed' AND updated_at < ? LIMIT ?",
+                (completed_before, limit),
+            ).fetchall()
+            if not rows:
+                return {}
+            ids = [row["id"] for row in rows]
+            placeholders = ", ".join("?" for _ in ids)
+            connection.execute(
+                f"INSERT OR REPLACE INTO tasks_archive ({columns}, search_terms)"
+                f" SELECT {columns}, (SELECT coalesce(group_concat(term, ' '), '') FROM task_terms"
+                f" WHERE task_id = tasks.id) FROM tasks WHERE id IN ({placeholders})",
+                ids,
+            )
+            connection.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", ids)
+
+            per_user: Dict[str, int] = {}
+            for row in rows:
+                per_user[row["user_id"]] = per_user.get(row["user_id"], 0) + 1
+            for user_id in per_user:
+                # Counters are unchanged (archived tasks still count), but listings aren't
+                self._bump_change_version(connection, user_id)
+        return per_user
+
+    async def restore_tasks(self, user_id: str, task_ids: List[str]) -> List[str]:
+        return await self._run(self._restore_tasks, user_id, task_ids)
+
+    def _restore_tasks(self, connection: sqlite3.Connection, user_id: str, task_ids: List[str]) -> List[str]:
+        columns = ", ".join(TASK_COLUMNS)
+        placeholders = ", ".join("?" for _ in task_ids)
+        with _transaction(connection):
+            rows = connection.execute(
+                f"SELECT id, search_terms FROM tasks_archive WHERE id IN ({placeholders}) AND user_id = ?",
+                [*task_ids, user_id],
+            ).fetchall()
+            if not rows:
+                return []
+            ids = [row["id"] for row in rows]
+            placeholders = ", ".join("?" for _ in ids)
+            connection.execute(
+                f"INSERT INTO tasks ({columns}) SELECT {columns} FROM tasks_archive WHERE id IN ({placeholders})", ids
+            )
+            for row in rows:
+                self._insert_terms(connection, user_id, row["id"], row["search_terms"].split())
+            connection.execute(f"DELETE FROM tasks_archive WHERE id IN ({placeholders})", ids)
+            self._bump_change_version(connection, user_id)
+        return ids
+
+    async def record_tombstones(self, user_id: str, task_ids: List[str], now: datetime) -> None:
+        await self._run(self._record_tombstones, user_id, task_ids, encode_datetime(now))
+
+    def _record_tombstones(self, connection: sqlite3.Connection, user_id: str, task_ids: List[str], now: str):
+        with _transaction(connection):
+            connection.executemany(
+                "INSERT OR IGNORE INTO task_tombstones (user_id, deleted_at, id) VALUES (?, ?, ?)",
+                [(user_id, now, task_id) for task_id in task_ids],
+            )
+
+    # Task reads
+
+    def _select(
+        self,
+        connection: sqlite3.Connection,
+        columns: str,
+        clauses: List[str],
+        params: list,
+        order: Tuple[str, ...],
+        limit: Optional[int],
+        descending: bool = False,
+        table: str = "tasks",
+    ) -> List[Task]:
+        direction = " DESC" if descending else ""
+        sql = f"SELECT {columns} FROM {table} WHERE {' AND '.join(clauses)}"
+        sql += " ORDER BY " + ", ".join(column + direction for column in order)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + [limit]
+        return [_decode_task(row) for row in connection.execute(sql, params)]
+
+    def _task_filter(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        terms: Optional[List[str]] = None,
+        after: Optional[List[Any]] = None,
+        keys: Tuple[str, ...] = ("created_at", "id"),
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        descending: bool = False,
+    ) -> Tuple[List[str], list]:
+        clauses, params = ["user_id = ?"], [user_id]
+        for field, value in filters.items():
+            if field not in MATCH_COLUMNS:
+                raise ValueError(f"Can't filter on {field!r}")
+            clauses.append(f"{field} = ?")
+            params.append(value)
+        due_after, due_before = due or (None, None)
+        if due_after is not None:
+            clauses.append("due_date >= ?")
+            params.append(encode_datetime(due_after))
+        if due_before is not None:
+            clauses.append("due_date < ?")
+            params.append(encode_datetime(due_before))
+        for term in terms or ():
+            if archived:
+                clauses.append("instr(' ' || search_terms || ' ', ?) > 0")
+                params.append(f" {term} ")
+            else:
+                clauses.append("id IN (SELECT task_id FROM task_terms WHERE user_id = ? AND term = ?)")
+                params += [user_id, term]
+        if after:
+            # Row values compare lexicographically, so this is one index seek
+            operator = "<" if descending else ">"
+            clauses.append(f"({', '.join(keys)}) {operator} ({', '.join('?' for _ in keys)})")
+            params += [_encode(value) for value in after]
+        return clauses, params
+
+    async def find_task(
+        self, user_id: str, task_id: str, versions: Optional[List[int]] = None, archived: bool = False
+    ) -> Optional[Task]:
+        return await self._run(self._find_task, user_id, task_id, versions, archived)
+
+    def _find_task(self, connection, user_id, task_id, versions, archived) -> Optional[Task]:
+        where, params = self._match(user_id, task_id, {}, versions)
+        table = "tasks_archive" if archived else "tasks"
+        row = connection.execute(f"SELECT {self.columns} FROM {table} WHERE {where}", params).fetchone()
+        return _decode_task(row) if row else None
+
+    async def find_owned_tasks(self, user_id: str, task_ids: List[str], archived: bool = False) -> List[Task]:
+        return await self._run(self._find_owned_tasks, user_id, task_ids, archived)
+
+    def _find_owned_tasks(self, connection, user_id: str, task_ids: List[str], archived: bool) -> List[Task]:
+        tasks = []
+        table = "tasks_archive" if archived else "tasks"
+        select = f"SELECT {', '.join(TASK_COLUMNS)} FROM {table} WHERE id = ? AND user_id = ?"
+        for task_id in task_ids:
+            row = connection.execute(select, (task_id, user_id)).fetchone()
+            if row:
+                tasks.append(_decode_task(row))
+        return tasks
+
+    async def find_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        after: Optional[List[Any]],
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        sort: Optional[TaskSort] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> List[Task]:
+        columns = self.columns
+        if fields is not None:
+            columns = ", ".join(column for column in TASK_COLUMNS if column in self.public_fields and column in fields)
+        return await self._run(
+            self._find_tasks, user_id, filters, None, after, limit, archived, due, sort or TaskSort(), columns
+        )
+
+    def _find_tasks(
+        self, connection, user_id, filters, terms, after, limit, archived=False, due=None, sort=TaskSort(), columns=None
+    ) -> List[Task]:
+        clauses, params = self._task_filter(
+            user_id, filters, terms, after, sort.keys, archived=archived, due=due, descending=sort.descending
+        )
+        table = "tasks_archive" if archived else "tasks"
+        source = table
+        if sort.keys != SORT_KEYS:
+            # Without statistics the planner prefers the index with the most
+            # equality columns and sorts its output; walk the sort index instead
+            prefix = ("status",) if "status" in filters and not archived else ()
+            source = f"{table} INDEXED BY {_sort_index(table, sort.keys, prefix)}"
+        return self._select(
+            connection, columns or self.columns, clauses, params, sort.keys, limit, sort.descending, table=source
+        )
+
+    async def search_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: str,
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        before: Optional[List[Any]] = None,
+    ) -> List[Task]:
+        terms = query_terms(text)
+        if not terms:
+            return []
+        return await self._run(self._search_tasks, user_id, filters, terms, limit, archived, due, before)
+
+    def _search_tasks(self, connection, user_id, filters, terms, limit, archived, due, before) -> List[Task]:
+        clauses, params = self._task_filter(
+            user_id, filters, terms, before, archived=archived, due=due, descending=True
+        )
+        table = "tasks_archive" if archived else "tasks"
+        return self._select(
+            connection, self.columns, clauses, params, ("created_at", "id"), limit, descending=True, table=table
+        )
+
+    async def find_due_tasks(
+        self, user_id: str, status: str, due: DueRange, after: Optional[List[Any]], limit: int
+    ) -> List[Task]:
+        return await self._run(self._find_due_tasks, user_id, status, due, after, limit)
+
+    def _find_due_tasks(self, connection, user_id, status, due, after, limit) -> List[Task]:
+        keys = ("due_date", "id")
+        clauses, params = self._task_filter(user_id, {"status": status}, after=after, keys=keys, due=due)
+        return self._select(connection, self.columns, clauses, params, keys, limit)
+
+    async def due_date_counts(self, user_id: str, due: DueRange) -> List[Dict[str, Any]]:
+        return await self._run(self._due_date_counts, user_id, due)
+
+    def _due_date_counts(self, connection, user_id: str, due: DueRange) -> List[Dict[str, Any]]:
+        # Stored dates are UTC ISO strings, so the first ten characters are
+        # the UTC day; each tier is a range seek on its (user_id, due_date, id)
+        # index, and the per-day counts are added up across the two
+        clauses, params = self._task_filter(user_id, {}, due=due)
+        where = " AND ".join(clauses)
+        per_tier = [
+            "SELECT substr(due_date, 1, 10) AS _id, count(*) AS total, sum(status = 'completed') AS completed"
+            f" FROM {table} WHERE {where} GROUP BY _id"
+            for table in ("tasks", "tasks_archive")
+        ]
+        rows = connection.execute(
+            f"SELECT _id, sum(total) AS total, sum(completed) AS completed FROM ({' UNION ALL '.join(per_tier)})"
+            " GROUP BY _id ORDER BY _id",
+            params + params,
+        )
+        return [dict(row) for row in rows]
+
+    def iter_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: Optional[str],
+        batch_size: int,
+    ) -> AsyncIterator[Task]:
+        terms = query_terms(text) if text else None
+        return merge_streams(
+            self._iter_tier(user_id, filters, text, terms, batch_size, archived=False),
+            self._iter_tier(user_id, filters, text, terms, batch_size, archived=True),
+        )
+
+    async def _iter_tier(self, user_id, filters, text, terms, batch_size, archived) -> AsyncIterator[Task]:
+        if text and not terms:
+            return
+        after = None
+        while True:
+            batch = await self._run(self._find_tasks, user_id, filters, terms, after, batch_size, archived)
+            for task in batch:
+                yield task
+            if len(batch) < batch_size:
+                return
+            after = [batch[-1]["created_at"], batch[-1]["id"]]
+
+    async def changed_tasks(self, user_id: str, after: Optional[List[Any]], limit: int) -> List[Task]:
+        return await self._run(self._changed_tasks, user_id, after, limit)
+
+    def _changed_tasks(self, connection, user_id: str, after: Optional[List[Any]], limit: int) -> List[Task]:
+        keys = ("updated_at", "id")
+        clauses, params = self._task_filter(user_id, {}, after=after, keys=keys)
+        return self._select(connection, self.columns, clauses, params, keys, limit)
+
+    async def tombstones(self, user_id: str, after: List[Any], limit: int) -> List[Dict[str, Any]]:
+        return await self._run(self._tombstones, user_id, after, limit)
+
+    def _tombstones(self, connection, user_id: str, after: List[Any], limit: int) -> List[Dict[str, Any]]:
+        rows = connection.execute(
+            "SELECT id, deleted_at FROM task_tombstones WHERE user_id = ? AND (deleted_at, id) > (?, ?)"
+            " ORDER BY deleted_at, id LIMIT ?",
+            (user_id, _encode(after[0]), after[1], limit),
+        )
+        return [_decode_task(row) for row in rows]
+
+    # Counters and analytics
+
+    def _load_stats(self, connection: sqlite3.Connection, user_id: str) -> Optional[Dict[str, Any]]:
+        row = connection.execute(
+            "SELECT change_version, stats FROM task_stats WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"user_id": user_id, **json.loads(row["stats"]), "change_version": row["change_version"]}
+
+    def _store_stats(self, connection: sqlite3.Connection, stats: Dict[str, Any]) -> None:
+        counters = {key: value for key, value in stats.items() if key not in ("user_id", "change_version")}
+        connection.execute(
+            "INSERT INTO task_stats (user_id, change_version, stats) VALUES (?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET change_version = excluded.change_version, stats = excluded.stats",
+            (stats["user_id"], stats.get("change_version", 0), json.dumps(counters)),
+        )
+
+    def _bump_change_version(self, connection: sqlite3.Connection, user_id: str) -> None:
+        stats = self._load_stats(connection, user_id) or {"user_id": user_id}
+        _increment(stats, "change_version", 1)
+        self._store_stats(connection, stats)
+
+    async def apply_stats_delta(self, user_id: str, delta: Dict[str, int]) -> None:
+        await self._run(self._apply_stats_delta, user_id, delta)
+
+    def _apply_stats_delta(self, connection: sqlite3.Connection, user_id: str, delta: Dict[str, int]) -> None:
+        with _transaction(connection):
+            stats = self._load_stats(connection, user_id) or {"user_id": user_id}
+            for path, value in delta.items():
+                if value:
+                    _increment(stats, path, value)
+            _increment(stats, "change_version", 1)
+            self._store_stats(connection, stats)
+
+    def _rebuild(self, connection: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+        stats = {
+            "user_id": user_id, "initialized": True, "total": 0, "completed": 0, "by_category": {}, "by_priority": {}
+        }
+        # Archived tasks still count
+        rows = connection.execute(
+            "SELECT category, priority, status = 'completed' AS done, count(*) AS tasks FROM ("
+            " SELECT category, priority, status FROM tasks WHERE user_id = ?"
+            " UNION ALL SELECT category, priority, status FROM tasks_archive WHERE user_id = ?"
+            ") GROUP BY category, priority, done",
+            (user_id, user_id),
+        )
+        for row in rows:
+            completed = row["tasks"] if row["done"] else 0
+            for prefix in ("", f"by_category.{task_stats.escape_key(row['category'])}.",
+                           f"by_priority.{task_stats.escape_key(row['priority'])}."):
+                _increment(stats, prefix + "total", row["tasks"])
+                _increment(stats, prefix + "completed", completed)
+        # change_version moves on, since the numbers clients saw may change
+        current = self._load_stats(connection, user_id)
+        stats["change_version"] = (current or {}).get("change_version", 0) + 1
+        self._store_stats(connection, stats)
+        return stats
+
+    async def rebuild_user_stats(self, user_id: str) -> Dict[str, Any]:
+        return await self._run(self._rebuild_user_stats, user_id)
+
+    def _rebuild_user_stats(self, connection: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+        with _transaction(connection):
+            return self._rebuild(connection, user_id)
+
+    async def read_user_stats(self, user_id: str) -> Dict[str, Any]:
+        return await self._run(self._read_user_stats, user_id)
+
+    def _read_user_stats(self, connection: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+        stats = self._load_stats(connection, user_id)
+        if stats is None or not stats.get("initialized"):
+            with _transaction(connection):
+                stats = self._rebuild(connection, user_id)
+        return stats
+
+    async def read_change_version(self, user_id: str) -> int:
+        return await self._run(self._read_change_version, user_id)
+
+    def _read_change_version(self, connection: sqlite3.Connection, user_id: str) -> int:
+        row = connection.execute("SELECT change_version FROM task_stats WHERE user_id = ?", (user_id,)).fetchone()
+        return row["change_version"] if row else 0
+
+    async def trend_buckets(self, user_id: str, start: datetime, granularity: str) -> List[Dict[str, Any]]:
+        return await self._run(self._trend_buckets, user_id, encode_datetime(start), granularity)
+
+    def _trend_buckets(self, connection, user_id: str, start: str, granularity: str) -> List[Dict[str, Any]]:
+        # Both tiers, each served by its (user_id, created_at, id) index;
+        # bucket labels match $dateToString
+        rows = connection.execute(
+            "SELECT trend_bucket(?, created_at) AS _id, count(*) AS created,"
+            " sum(status = 'completed') AS completed FROM ("
+            " SELECT created_at, status FROM tasks WHERE user_id = ? AND created_at >= ?"
+            " UNION ALL SELECT created_at, status FROM tasks_archive WHERE user_id = ? AND created_at >= ?"
+            ") GROUP BY _id ORDER BY _id",
+            (TREND_FORMATS[granularity], user_id, start, user_id, start),
+        )
+        return [dict(row) for row in rows]
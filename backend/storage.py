@@ -0,0 +1,268 @@
+"""Storage interface for users, tasks and their per-user counters.
+
+The routes in `server.py` talk to a `Storage` instead of to a database
+driver, so the same API runs on either backend:
+
+* `mongo` (default, mongo_storage.py): MongoDB through Motor. Needed for
+  more than one node, and for the `changestream` change feed.
+* `sqlite` (sqlite_storage.py): an embedded SQLite file in WAL mode, for
+  single-node deployments that don't want to run a database server. Calls
+  run on a small thread pool so the event loop never blocks on disk.
+
+`STORAGE_BACKEND` picks one. Both keep tasks in two tiers: the working set
+and an archive of old completed tasks (see archiving.py). Reads that take
+`archived=True` read the archive instead, `iter_tasks` and the analytics
+reads cover both, and other reads see only the working set. Updates only
+apply to the working set, so archived tasks are moved back with
+`restore_tasks` to be edited; deletes reach both tiers. Both store the
+same documents: tasks carry `id`, `user_id`, the public task fields,
+`search_terms` and `priority_rank` (see sorting.py); datetimes are aware
+UTC `datetime`s on the way in and out. Counter deltas use the
+`task_stats` format, and `read_user_stats` returns a `task_stats` document.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, AsyncIterator, Coroutine, Dict, Iterable, List, Optional, Set, Tuple
+
+from pagination import SORT_KEYS, sort_order
+from sorting import TaskSort
+
+Task = Dict[str, Any]
+
+# (task id, fields to $set, fields that must still hold these values, accepted versions or None)
+TaskUpdate = Tuple[str, Dict[str, Any], Dict[str, Any], Optional[List[int]]]
+
+# (due on or after, due before); either end may be open
+DueRange = Tuple[Optional[datetime], Optional[datetime]]
+
+
+async def merge_streams(hot: AsyncIterator[Task], cold: AsyncIterator[Task]) -> AsyncIterator[Task]:
+    """Merge working-set and archive streams, each in `SORT_KEYS` order. A
+    task caught mid-move between the tiers can be in both; it is yielded once."""
+    def key(task: Task) -> Tuple[Any, ...]:
+        return tuple(sort_order(task[field]) for field in SORT_KEYS)
+
+    async def advance(stream: AsyncIterator[Task]) -> Optional[Task]:
+        return await anext(stream, None)
+
+    last_id = None
+    try:
+        next_hot, next_cold = await advance(hot), await advance(cold)
+        while next_hot is not None or next_cold is not None:
+            if next_cold is None or (next_hot is not None and key(next_hot) <= key(next_cold)):
+                task, next_hot = next_hot, await advance(hot)
+            else:
+                task, next_cold = next_cold, await advance(cold)
+            # Both copies share their sort key, so they arrive together
+            if task["id"] != last_id:
+                yield task
+            last_id = task["id"]
+    finally:
+        await hot.aclose()
+        await cold.aclose()
+
+
+class Storage(ABC):
+    """Every task method is scoped to one user; other users' tasks are
+    invisible to it. Task reads return the public fields (`public_fields`)
+    unless documented otherwise."""
+
+    def __init__(self, public_fields: Iterable[str]):
+        self.public_fields = tuple(public_fields)
+
+    # Lifecycle
+
+    @abstractmethod
+    async def open(self) -> None:
+        """Connect and make sure the schema/indexes exist; called at startup."""
+
+    def background_jobs(self) -> List[Coroutine]:
+        """Maintenance coroutines to run for the life of the app."""
+        return []
+
+    @abstractmethod
+    async def ping(self) -> None:
+        """Raise if the backend can't serve requests right now."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    # Users
+
+    @abstractmethod
+    async def find_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_user(self, user: Dict[str, Any]) -> None:
+        """Also creates the user's (empty) counters."""
+
+    @abstractmethod
+    async def replace_password_hash(self, user_id: str, old_hash: str, new_hash: str) -> None:
+        """Store `new_hash` unless the hash was changed since `old_hash` was read."""
+
+    # Task writes
+
+    @abstractmethod
+    async def insert_tasks(self, tasks: List[Task]) -> Dict[int, Exception]:
+        """Insert unordered; returns the error for each position that failed."""
+
+    async def insert_task(self, task: Task) -> None:
+        errors = await self.insert_tasks([task])
+        if errors:
+            raise errors[0]
+
+    @abstractmethod
+    async def update_task(
+        self,
+        user_id: str,
+        task_id: str,
+        changes: Dict[str, Any],
+        expected: Dict[str, Any],
+        versions: Optional[List[int]] = None,
+    ) -> Optional[Task]:
+        """Set `changes` and bump `version`, only if every `expected` field
+        still holds its value (None matches a missing field) and the version
+        is one of `versions`; a changed title or description also updates
+        the search terms, in the same write. Returns the task's public and
+        counted fields as they were before, or None if nothing matched."""
+
+    @abstractmethod
+    async def update_tasks(self, user_id: str, updates: List[TaskUpdate], now: datetime) -> Set[str]:
+        """Conditional updates as in `update_task`, in one round trip; each
+        update's changes must set `updated_at` to `now`. Returns the ids
+        whose update was applied."""
+
+    @abstractmethod
+    async def delete_task(self, user_id: str, task_id: str) -> Optional[Task]:
+        """Delete from both tiers; returns the deleted task's counted fields
+        (`task_stats.COUNTED_FIELDS`), the hot copy's if it had one."""
+
+    @abstractmethod
+    async def delete_tasks(self, user_id: str, task_ids: List[str]) -> int:
+        """Delete from both tiers; returns how many documents were deleted,
+        so a task caught mid-move to the archive counts twice."""
+
+    @abstractmethod
+    async def archive_tasks(self, completed_before: datetime, limit: int) -> Dict[str, int]:
+        """Move up to `limit` tasks completed (last updated) before
+        `completed_before` to the archive and bump their users'
+        `change_version`. Returns how many were moved per user id."""
+
+    @abstractmethod
+    async def restore_tasks(self, user_id: str, task_ids: List[str]) -> List[str]:
+        """Move the given archived tasks back to the working set and bump
+        `change_version`; returns the ids that were moved."""
+
+    @abstractmethod
+    async def record_tombstones(self, user_id: str, task_ids: List[str], now: datetime) -> None:
+        """Remember deleted ids for delta sync, for `TOMBSTONE_TTL_SECONDS`."""
+
+    # Task reads
+
+    @abstractmethod
+    async def find_task(
+        self, user_id: str, task_id: str, versions: Optional[List[int]] = None, archived: bool = False
+    ) -> Optional[Task]:
+        ...
+
+    @abstractmethod
+    async def find_owned_tasks(self, user_id: str, task_ids: List[str], archived: bool = False) -> List[Task]:
+        """Whole documents (not just the public fields) of the given tasks."""
+
+    @abstractmethod
+    async def find_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        after: Optional[List[Any]],
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        sort: Optional[TaskSort] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> List[Task]:
+        """Tasks matching the equality `filters` (and due in `due`), in
+        `sort` order (by default `pagination.SORT_KEYS`), strictly after the
+        `after` position. With `fields`, only those public fields are read."""
+
+    @abstractmethod
+    async def search_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: str,
+        limit: int,
+        archived: bool = False,
+        due: Optional[DueRange] = None,
+        before: Optional[List[Any]] = None,
+    ) -> List[Task]:
+        """The newest `limit` tasks (older than the `before` position, in
+        `pagination.SORT_KEYS`) matching the equality `filters` (and due in
+        `due`) whose title or description has a word starting with every
+        word of `text`."""
+
+    @abstractmethod
+    async def find_due_tasks(
+        self, user_id: str, status: str, due: DueRange, after: Optional[List[Any]], limit: int
+    ) -> List[Task]:
+        """Tasks with `status` due in `due`, in (due_date, id) order strictly
+        after `after`; served by the (user_id, status, due_date, id) index."""
+
+    @abstractmethod
+    async def due_date_counts(self, user_id: str, due: DueRange) -> List[Dict[str, Any]]:
+        """`{"_id": "YYYY-MM-DD", "total", "completed"}` per UTC day of
+        `due_date` in `due` of tasks in either tier, in day order, read from
+        the due-date indexes."""
+
+    @abstractmethod
+    def iter_tasks(
+        self,
+        user_id: str,
+        filters: Dict[str, str],
+        text: Optional[str],
+        batch_size: int,
+    ) -> AsyncIterator[Task]:
+        """Every match in either tier in `pagination.SORT_KEYS` order,
+        fetched `batch_size` at a time; an async generator, `aclose()` it
+        when stopping early."""
+
+    @abstractmethod
+    async def changed_tasks(self, user_id: str, after: Optional[List[Any]], limit: int) -> List[Task]:
+        """Tasks in (updated_at, id) order strictly after `after`."""
+
+    @abstractmethod
+    async def tombstones(self, user_id: str, after: List[Any], limit: int) -> List[Dict[str, Any]]:
+        """`{"id", "deleted_at"}` in (deleted_at, id) order strictly after `after`."""
+
+    # Counters and analytics
+
+    @abstractmethod
+    async def apply_stats_delta(self, user_id: str, delta: Dict[str, int]) -> None:
+        """Apply a `task_stats` delta and bump `change_version`."""
+
+    @abstractmethod
+    async def rebuild_user_stats(self, user_id: str) -> Dict[str, Any]:
+        """Recount from both tiers (archived tasks still count) and store."""
+
+    @abstractmethod
+    async def read_user_stats(self, user_id: str) -> Dict[str, Any]:
+        """The user's counters, rebuilt first if they were never initialized."""
+
+    @abstractmethod
+    async def read_change_version(self, user_id: str) -> int:
+        ...
+
+    @abstractmethod
+    async def trend_buckets(self, user_id: str, start: datetime, granularity: str) -> List[Dict[str, Any]]:
+        """`{"_id": label, "created", "completed"}` per `analytics.TREND_FORMATS`
+        bucket of tasks (in either tier) created since `start`, in label order."""
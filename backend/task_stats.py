@@ -0,0 +1,215 @@
+"""Incrementally maintained per-user task counters.
+
+Each user has one `task_stats` document:
+
+    {"user_id": ..., "initialized": True, "change_version": 42,
+     "total": 12, "completed": 5,
+     "by_category": {"Work": {"total": 7, "completed": 3}, ...},
+     "by_priority": {"High": {"total": 2, "completed": 1}, ...}}
+
+Task write paths apply `$inc` deltas to it, so the analytics summary is a
+single point read. Every write also bumps `change_version`, which the read
+routes use as the basis of their ETags. Category/priority names are user supplied, so they are
+escaped before being used as field names (`.` and a leading `$` are not
+allowed in field paths).
+
+Users that existed before the counters were introduced have no document, or
+one without `initialized`; the first summary read rebuilds it from `tasks`
+(and `tasks_archive`: archived tasks keep counting).
+Because the task write and the counter `$inc` are not one transaction, a crash
+between them can leave the counters off by one. Detect and repair drift with:
+
+    python task_stats.py verify [--user USER_ID]    # report drift, exit 1 if any
+    python task_stats.py rebuild [--user USER_ID]   # recount and overwrite
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+from pymongo import ReturnDocument
+
+from analytics import merge_summaries, summary_from_facets, summary_pipeline
+
+COUNTED_FIELDS = ("status", "category", "priority")
+
+
+def escape_key(key: str) -> str:
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def unescape_key(key: str) -> str:
+    return unquote(key)
+
+
+def task_delta(task: Dict[str, Any], sign: int = 1) -> Dict[str, int]:
+    """The `$inc` document that adds (sign=1) or removes (sign=-1) one task."""
+    completed = sign if task.get("status") == "completed" else 0
+    category = escape_key(task["category"])
+    priority = escape_key(task["priority"])
+    return {
+        "total": sign,
+        "completed": completed,
+        f"by_category.{category}.total": sign,
+        f"by_category.{category}.completed": completed,
+        f"by_priority.{priority}.total": sign,
+        f"by_priority.{priority}.completed": completed,
+    }
+
+
+def transition_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, int]:
+    """Net `$inc` for a task whose counted fields changed from `before` to `after`."""
+    if all(before.get(f) == after.get(f) for f in COUNTED_FIELDS):
+        return {}
+    delta = task_delta(before, -1)
+    for key, value in task_delta(after, 1).items():
+        delta[key] = delta.get(key, 0) + value
+    return {key: value for key, value in delta.items() if value}
+
+
+def combine(deltas) -> Dict[str, int]:
+    """Sum several deltas so a batch of writes costs one counter update."""
+    total: Dict[str, int] = {}
+    for delta in deltas:
+        for key, value in delta.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+async def apply_delta(db, user_id: str, delta: Dict[str, int]) -> None:
+    """Record a task write: apply the counter delta and bump `change_version`."""
+    delta = {key: value for key, value in delta.items() if value}
+    delta["change_version"] = 1
+    await db.task_stats.update_one({"user_id": user_id}, {"$inc": delta}, upsert=True)
+
+
+async def init_user_stats(db, user_id: str) -> None:
+    """Create the (empty, authoritative) counters for a newly registered user."""
+    await db.task_stats.update_one(
+        {"user_id": user_id},
+        {"$setOnInsert": {
+            "initialized": True, "change_version": 0,
+            "total": 0, "completed": 0, "by_category": {}, "by_priority": {}
+        }},
+        upsert=True
+    )
+
+
+async def compute_user_stats(db, user_id: str) -> Dict[str, Any]:
+    """Recount a user's tasks from scratch (used for rebuilds and verification).
+
+    Archived tasks still count, so both tiers are read.
+    """
+    summaries = []
+    for collection in ("tasks", "tasks_archive"):
+        facets = await db[collection].aggregate(summary_pipeline({"user_id": user_id})).to_list(1)
+        summaries.append(summary_from_facets(facets[0]))
+    summary = merge_summaries(summaries)
+    return {
+        "user_id": user_id,
+        "initialized": True,
+        "total": summary["total"],
+        "completed": summary["completed"],
+        "by_category": {escape_key(k): v for k, v in summary["by_category"].items()},
+        "by_priority": {escape_key(k): v for k, v in summary["by_priority"].items()},
+    }
+
+
+async def _store_stats(db, stats: Dict[str, Any]) -> Dict[str, Any]:
+    # $set rather than a replace so change_version survives (and moves on,
+    # since the numbers clients saw may change)
+    counters = {key: value for key, value in stats.items() if key != "user_id"}
+    return await db.task_stats.find_one_and_update(
+        {"user_id": stats["user_id"]},
+        {"$set": counters, "$inc": {"change_version": 1}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def rebuild_user_stats(db, user_id: str) -> Dict[str, Any]:
+    return await _store_stats(db, await compute_user_stats(db, user_id))
+
+
+async def read_change_version(db, user_id: str) -> int:
+    stats = await db.task_stats.find_one({"user_id": user_id}, {"_id": 0, "change_version": 1})
+    return stats.get("change_version", 0) if stats else 0
+
+
+async def read_user_stats(db, user_id: str) -> Dict[str, Any]:
+    stats = await db.task_stats.find_one({"user_id": user_id}, {"_id": 0})
+    if stats is None or not stats.get("initialized"):
+        stats = await rebuild_user_stats(db, user_id)
+    return stats
+
+
+def _breakdown(counters: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    # Buckets whose last task was moved or deleted stay behind at zero
+    return {
+        unescape_key(key): {"total": value.get("total", 0), "completed": value.get("completed", 0)}
+        for key, value in sorted(counters.items())
+        if value.get("total", 0)
+    }
+
+
+def normalize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Counters in API form: unescaped keys, empty buckets dropped."""
+    return {
+        "total": stats.get("total", 0),
+        "completed": stats.get("completed", 0),
+        "by_category": _breakdown(stats.get("by_category", {})),
+        "by_priority": _breakdown(stats.get("by_priority", {})),
+    }
+
+
+async def verify(db, user_id: Optional[str] = None, repair: bool = False) -> List[str]:
+    """Compare stored counters against a recount; return the drifted user ids."""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = set(await db.task_stats.distinct("user_id"))
+        for collection in ("tasks", "tasks_archive"):
+            user_ids |= set(await db[collection].distinct("user_id"))
+
+    drifted = []
+    for uid in sorted(user_ids):
+        stored = await db.task_stats.find_one({"user_id": uid}, {"_id": 0})
+        actual = await compute_user_stats(db, uid)
+        if stored is None or normalize(stored) != normalize(actual):
+            drifted.append(uid)
+            if repair:
+                await _store_stats(db, actual)
+    return drifted
+
+
+async def _main(args) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"))
+    db = client[os.environ.get("DB_NAME", "TaskTrackerNewlyCreated")]
+    repair = args.command == "rebuild"
+    try:
+        drifted = await verify(db, args.user, repair=repair)
+    finally:
+        client.close()
+
+    for uid in drifted:
+        print(f"{'repaired' if repair else 'drift'}: {uid}")
+    print(f"{len(drifted)} user(s) with drifted counters")
+    return 1 if drifted and not repair else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild task_stats counters from tasks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (
+        ("verify", "recount tasks and report users whose counters drifted"),
+        ("rebuild", "recount tasks and overwrite any drifted counters"),
+    ):
+        sub.add_parser(command, help=help_text).add_argument("--user", help="only this user id")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -1,4 +1,5 @@
 import requests
+import os
 import sys
 import json
 from datetime import datetime, timedelta
@@ -141,6 +142,49 @@ class DailyTrackerAPITester:
         )
         return success, response if success else []
 
+    def test_paginate_tasks(self):
+        """Test cursor pagination of the task list"""
+        success, response = self.run_test(
+            "Paginate Tasks (first page)",
+            "GET",
+            "tasks",
+            200,
+            data={"limit": 1}
+        )
+        if not success or not response.get('next_cursor'):
+            return success
+        
+        success, response = self.run_test(
+            "Paginate Tasks (next page)",
+            "GET",
+            "tasks",
+            200,
+            data={"limit": 1, "cursor": response['next_cursor']}
+        )
+        return success
+
+    def test_export_tasks(self):
+        """Test streaming task export in both formats"""
+        for export_format in ("ndjson", "csv"):
+            url = f"{self.api_url}/tasks/export"
+            self.tests_run += 1
+            print(f"\n🔍 Testing Export Tasks ({export_format})...")
+            try:
+                response = requests.get(
+                    url,
+                    headers={'Authorization': f'Bearer {self.token}'},
+                    params={"format": export_format},
+                    stream=True
+                )
+                lines = [line for line in response.iter_lines() if line]
+                if response.status_code == 200 and lines:
+                    self.tests_passed += 1
+                    print(f"✅ Passed - {len(lines)} lines exported")
+                else:
+                    print(f"❌ Failed - Status: {response.status_code}, lines: {len(lines)}")
+            except Exception as e:
+                print(f"❌ Failed - Error: {str(e)}")
+
     def test_get_task_by_id(self, task_id):
         """Test get task by ID"""
         success, response = self.run_test(
@@ -177,6 +221,22 @@ class DailyTrackerAPITester:
         )
         return success
 
+    def test_sync_changes(self, since, deleted_ids):
+        """Test delta sync reports deleted tasks as tombstones"""
+        success, response = self.run_test(
+            "Sync Task Changes",
+            "GET",
+            "tasks/changes",
+            200,
+            data={"since": since}
+        )
+        if success:
+            reported = {tombstone['id'] for tombstone in response.get('deleted', [])}
+            if not set(deleted_ids) <= reported:
+                print(f"❌ Deleted tasks missing from sync: {set(deleted_ids) - reported}")
+                return False
+        return success
+
     def test_search_tasks(self):
         """Test task search functionality"""
         success, response = self.run_test(
@@ -221,6 +281,49 @@ class DailyTrackerAPITester:
         )
         return success
 
+    def test_filter_tasks_by_due_date(self):
+        """Test filter tasks by due date range"""
+        success, response = self.run_test(
+            "Filter Tasks by Due Date",
+            "GET",
+            "tasks",
+            200,
+            data={"due_after": "2024-01-01", "due_before": "2025-01-01"}
+        )
+        return success
+
+    def test_sort_tasks(self):
+        """Test server-side sorting with a field projection"""
+        success, response = self.run_test(
+            "Sort Tasks by Priority",
+            "GET",
+            "tasks",
+            200,
+            data={"sort": "priority", "order": "desc", "fields": "id,title,status,due_date"}
+        )
+        return success
+
+    def test_overdue_tasks(self):
+        """Test overdue tasks endpoint"""
+        success, response = self.run_test(
+            "Overdue Tasks",
+            "GET",
+            "tasks/overdue",
+            200
+        )
+        return success
+
+    def test_task_calendar(self):
+        """Test per-day due date counts"""
+        success, response = self.run_test(
+            "Task Calendar",
+            "GET",
+            "tasks/calendar",
+            200,
+            data={"from": "2024-12-01", "to": "2025-01-01"}
+        )
+        return success
+
     def test_analytics_summary(self):
         """Test analytics summary endpoint"""
         success, response = self.run_test(
@@ -267,7 +370,8 @@ def main():
     print("🚀 Starting Daily Tracker API Tests")
     print("=" * 50)
     
-    tester = DailyTrackerAPITester()
+    # Point BACKEND_URL at a local server to run the suite against each storage backend
+    tester = DailyTrackerAPITester(os.environ.get("BACKEND_URL", "https://taskhub-481.preview.emergentagent.com"))
     
     # Test user registration and authentication
     print("\n📝 AUTHENTICATION TESTS")
@@ -326,6 +430,8 @@ def main():
     
     # Test task retrieval
     tester.test_get_tasks()
+    tester.test_paginate_tasks()
+    tester.test_export_tasks()
     tester.test_get_task_by_id(task_id)
     
     # Test task update
@@ -339,6 +445,10 @@ def main():
     tester.test_filter_tasks_by_category()
     tester.test_filter_tasks_by_priority()
     tester.test_filter_tasks_by_status()
+    tester.test_filter_tasks_by_due_date()
+    tester.test_sort_tasks()
+    tester.test_overdue_tasks()
+    tester.test_task_calendar()
     
     # Test analytics
     print("\n📊 ANALYTICS TESTS")
@@ -351,8 +461,11 @@ def main():
     print("\n🗑️ CLEANUP TESTS")
     print("-" * 30)
     
+    _, sync_state = tester.run_test("Initial Task Sync", "GET", "tasks/changes", 200)
     for task_id in tester.created_task_ids:
         tester.test_delete_task(task_id)
+    if sync_state.get('next_since'):
+        tester.test_sync_changes(sync_state['next_since'], tester.created_task_ids)
     
     # Print final results
     print("\n" + "=" * 50)
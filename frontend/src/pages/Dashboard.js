@@ -46,8 +46,15 @@ const Dashboard = () => {
       if (filterStatus !== 'all') params.status = filterStatus;
       if (searchQuery) params.search = searchQuery;
 
-      const response = await axios.get(`${API}/tasks`, { params });
-      setTasks(response.data);
+      // The list endpoint is cursor-paginated; follow next_cursor until exhausted
+      const allTasks = [];
+      let cursor;
+      do {
+        const response = await axios.get(`${API}/tasks`, { params: { ...params, limit: 500, cursor } });
+        allTasks.push(...response.data.tasks);
+        cursor = response.data.next_cursor || undefined;
+      } while (cursor);
+      setTasks(allTasks);
     } catch (error) {
       toast.error('Failed to fetch tasks');
     } finally {
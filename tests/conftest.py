@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from mongo_storage import MongoStorage  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+from tests.helpers import PUBLIC_FIELDS  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=["mongo", "sqlite"])
+async def storage(request, tmp_path):
+    if request.param == "mongo":
+        client = AsyncMongoMockClient(tz_aware=True)
+        backend = MongoStorage(client, client, "test", PUBLIC_FIELDS)
+    else:
+        backend = SQLiteStorage(str(tmp_path / "tasks.db"), PUBLIC_FIELDS, workers=2)
+    await backend.open()
+    try:
+        yield backend
+    finally:
+        await backend.close()
+
+
+@pytest.fixture(params=["mongo", "sqlite"])
+def client(request, tmp_path, monkeypatch):
+    """The app on an empty store, signed in as a newly registered user."""
+    monkeypatch.setattr(server, "STORAGE_BACKEND", request.param)
+    monkeypatch.setattr(server, "SQLITE_PATH", str(tmp_path / "tasks.db"))
+    monkeypatch.setattr(server, "create_mongo_client", lambda **options: AsyncMongoMockClient(tz_aware=True))
+    monkeypatch.setattr(server.admission, "buckets", None)
+    monkeypatch.setattr(server, "task_archiver", None)
+    # Shut down with the app, so each app gets its own
+    monkeypatch.setattr(server, "password_hasher", PasswordHasher(rounds=4, workers=1, max_queue=8))
+    with TestClient(server.app) as test_client:
+        registered = test_client.post("/api/auth/register", json={"email": "user@example.com", "password": "secret"})
+        test_client.headers["Authorization"] = f"Bearer {registered.json()['access_token']}"
+        yield test_client
@@ -0,0 +1,36 @@
+"""Task documents for storage tests."""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from search import indexed_text
+from sorting import priority_rank
+
+PUBLIC_FIELDS = (
+    "id", "user_id", "title", "description", "due_date", "priority", "category", "status",
+    "created_at", "updated_at", "version",
+)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_task(user_id: str, n: int = 0, **fields) -> dict:
+    """A task document as `server.new_task_document` writes it, created `n`
+    minutes after `EPOCH`."""
+    created = EPOCH + timedelta(minutes=n)
+    task = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "title": f"Task {n}",
+        "description": "",
+        "due_date": created + timedelta(days=1),
+        "priority": "medium",
+        "category": "work",
+        "status": "pending",
+        "created_at": created,
+        "updated_at": created,
+        "version": 1,
+        **fields,
+    }
+    task["priority_rank"] = priority_rank(task["priority"])
+    task.update(indexed_text(task["title"], task["description"]))
+    return task
@@ -0,0 +1,206 @@
+"""Admission control and rate limiting."""
+import asyncio
+
+import pytest
+
+import server
+from admission import (
+    AdmissionController, AdmissionMiddleware, ConcurrencyLimiter, Shed, TokenBuckets, route_class,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    """Let every runnable task run until it blocks."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("POST", "/api/auth/login", "auth"),
+    ("GET", "/api/auth/me", "reads"),
+    ("GET", "/api/analytics/summary", "analytics"),
+    ("GET", "/api/tasks", "reads"),
+    ("HEAD", "/api/tasks", "reads"),
+    ("PUT", "/api/tasks/1", "writes"),
+    ("OPTIONS", "/api/tasks", None),
+    ("GET", "/api/tasks/events", None),
+    ("GET", "/metrics", None),
+])
+def test_route_classes(method, path, expected):
+    assert route_class(method, path) == expected
+
+
+async def test_limiter_hands_slots_to_waiters_in_order():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=60)
+    await limiter.acquire()
+    order = []
+
+    async def wait(n):
+        await limiter.acquire()
+        order.append(n)
+
+    waiters = [asyncio.ensure_future(wait(n)) for n in range(3)]
+    await settle()
+    # A newcomer can't overtake the queue while the slot is handed over
+    limiter.release()
+    late = asyncio.ensure_future(wait("late"))
+    for _ in range(4):
+        await settle()
+        limiter.release()
+    await asyncio.gather(*waiters, late)
+    assert order == [0, 1, 2, "late"]
+
+
+async def test_limiter_sheds_when_the_queue_is_full():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=1, queue_timeout=60)
+    await limiter.acquire()
+    queued = asyncio.ensure_future(limiter.acquire())
+    await settle()
+    with pytest.raises(Shed) as shed:
+        await limiter.acquire()
+    assert shed.value.reason == "queue_full"
+    limiter.release()
+    await queued
+    assert limiter.stats()["shed_queue_full"] == 1
+
+
+async def test_limiter_sheds_waiters_past_the_timeout():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=0.01)
+    await limiter.acquire()
+    with pytest.raises(Shed) as shed:
+        await limiter.acquire()
+    assert shed.value.reason == "queue_timeout"
+    assert limiter.stats()["queued"] == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+async def test_a_cancelled_waiter_leaves_the_queue():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=60)
+    await limiter.acquire()
+    gone = asyncio.ensure_future(limiter.acquire())
+    staying = asyncio.ensure_future(limiter.acquire())
+    await settle()
+    gone.cancel()
+    await settle()
+    assert limiter.stats()["queued"] == 1
+    limiter.release()
+    await staying
+    assert limiter.active == 1
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_token_buckets_refill_at_the_rate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("admission.time.monotonic", lambda: now[0])
+    buckets = TokenBuckets(rate=2, burst=3)
+    assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a") == pytest.approx(0.5)
+    # Other clients have their own bucket
+    assert buckets.take("b") == 0
+    now[0] += 0.5
+    assert buckets.take("a") == 0
+    assert buckets.stats()["limited"] == 1
+
+
+def test_token_buckets_forget_the_least_recent_client(monkeypatch):
+    monkeypatch.setattr("admission.time.monotonic", lambda: 1000.0)
+    buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.take("c")
+    assert buckets.stats()["clients"] == 2
+    # "a" was evicted, so it starts again with a full bucket
+    assert buckets.take("a") == 0
+
+
+async def call(middleware, method="GET", path="/api/tasks", headers=()):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers), "client": ("10.0.0.1", 1)}
+    await middleware(scope, receive, send)
+    start = sent[0]
+    return start["status"], dict(start["headers"])
+
+
+async def ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def test_middleware_rate_limits_per_client():
+    controller = AdmissionController({}, TokenBuckets(rate=1, burst=1), lambda scope: "client")
+    middleware = AdmissionMiddleware(ok, controller)
+    assert (await call(middleware))[0] == 200
+    status, headers = await call(middleware)
+    assert status == 429
+    assert headers[b"retry-after"] == b"1"
+    # Unlimited routes are never counted
+    assert (await call(middleware, path="/api/tasks/events"))[0] == 200
+
+
+async def test_middleware_skips_requests_without_a_client_key():
+    controller = AdmissionController({}, TokenBuckets(rate=1, burst=1), lambda scope: None)
+    middleware = AdmissionMiddleware(ok, controller)
+    assert [(await call(middleware))[0] for _ in range(3)] == [200, 200, 200]
+
+
+async def test_middleware_sheds_a_saturated_class_only():
+    gate = asyncio.Event()
+
+    async def slow(scope, receive, send):
+        await gate.wait()
+        await ok(scope, receive, send)
+
+    limiters = {"reads": ConcurrencyLimiter("reads", limit=1, max_queue=0, queue_timeout=60)}
+    middleware = AdmissionMiddleware(slow, AdmissionController(limiters, None, lambda scope: None, retry_after=3))
+    busy = asyncio.ensure_future(call(middleware))
+    await settle()
+    status, headers = await call(middleware)
+    assert (status, headers[b"retry-after"]) == (503, b"3")
+    # Writes have no limiter here, so they aren't held up by the reads
+    gate.set()
+    assert (await call(middleware, method="POST"))[0] == 200
+    assert (await busy)[0] == 200
+    assert limiters["reads"].active == 0
+
+
+def scope(forwarded=None, authorization=None):
+    headers = []
+    if forwarded is not None:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    if authorization is not None:
+        headers.append((b"authorization", authorization.encode()))
+    return {"headers": headers, "client": ("10.0.0.1", 1)}
+
+
+def test_authenticated_requests_are_keyed_by_user():
+    token = server.create_access_token({"sub": "user-1"})
+    assert server.rate_limit_key(scope(authorization=f"Bearer {token}")) == "user:user-1"
+
+
+def test_anonymous_requests_are_not_limited_by_default(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ANONYMOUS", False)
+    assert server.rate_limit_key(scope("1.2.3.4")) is None
+    assert server.rate_limit_key(scope(authorization="Bearer not-a-token")) is None
+
+
+def test_anonymous_requests_use_the_trusted_forwarded_address(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ANONYMOUS", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUSTED_PROXIES", 0)
+    # Without trusted proxies the header is the client's to forge
+    assert server.rate_limit_key(scope("1.2.3.4")) == "address:10.0.0.1"
+
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUSTED_PROXIES", 2)
+    assert server.rate_limit_key(scope("6.6.6.6, 1.2.3.4, 10.0.0.2")) == "address:1.2.3.4"
+    # Fewer hops than configured: the request didn't come through the proxies
+    assert server.rate_limit_key(scope("1.2.3.4")) == "address:10.0.0.1"
@@ -0,0 +1,39 @@
+"""Trend buckets."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from analytics import trends_response, trends_window_start
+from tests.helpers import EPOCH, make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+
+
+@pytest.mark.parametrize("granularity, expected", [
+    # 2024-01-01 is a Monday; %U weeks start on Sunday, the first one at week 01
+    ("week", [("2024-W00", 2, 1), ("2024-W01", 1, 0), ("2024-W04", 1, 1)]),
+    ("day", [("2024-01-01", 1, 0), ("2024-01-06", 1, 1), ("2024-01-07", 1, 0), ("2024-02-01", 1, 1)]),
+    ("month", [("2024-01", 3, 1), ("2024-02", 1, 1)]),
+])
+async def test_trend_bucket_labels(storage, granularity, expected):
+    days = [(0, "pending"), (5, "completed"), (6, "pending"), (31, "completed")]
+    tasks = [
+        make_task(USER, n, status=status, created_at=EPOCH + timedelta(days=day, hours=23))
+        for n, (day, status) in enumerate(days)
+    ]
+    await storage.insert_tasks(tasks)
+    await storage.insert_task(make_task(USER, 9, created_at=EPOCH - timedelta(days=1)))
+
+    buckets = await storage.trend_buckets(USER, EPOCH, granularity)
+    assert [(b["_id"], b["created"], b["completed"]) for b in buckets] == expected
+    assert trends_response(buckets, granularity)["trends"][0][granularity] == expected[0][0]
+
+
+def test_trend_windows_start_on_a_bucket_boundary():
+    # A Wednesday afternoon
+    now = datetime(2024, 1, 10, 15, 30, tzinfo=timezone.utc)
+    assert trends_window_start(now, 2, "week") == datetime(2024, 1, 7, tzinfo=timezone.utc) - timedelta(weeks=1)
+    assert trends_window_start(now, 1, "day") == datetime(2024, 1, 4, tzinfo=timezone.utc)
+    assert trends_window_start(now, 8, "month") == datetime(2023, 11, 1, tzinfo=timezone.utc)
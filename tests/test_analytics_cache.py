@@ -0,0 +1,155 @@
+"""Analytics caching and single-flight."""
+import asyncio
+
+import pytest
+
+from analytics_cache import AnalyticsCache
+from caching import SingleFlight, TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    """Let every runnable task run until it blocks."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class FakeStats:
+    """`read_user_stats` that counts its reads and, while `gate` is clear,
+    holds them in flight."""
+
+    def __init__(self):
+        self.reads = 0
+        self.change_version = 1
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def read(self, user_id):
+        self.reads += 1
+        version = self.change_version
+        await self.gate.wait()
+        return {"user_id": user_id, "change_version": version}
+
+
+async def test_concurrent_reads_share_one_stats_read():
+    stats = FakeStats()
+    stats.gate.clear()
+    cache = AnalyticsCache(100, 60, stats.read)
+    calls = [asyncio.ensure_future(cache.entry("user-1")) for _ in range(5)]
+    await settle()
+    stats.gate.set()
+    entries = await asyncio.gather(*calls)
+    assert stats.reads == 1
+    assert all(entry is entries[0] for entry in entries)
+    # Within the TTL the entry is reused
+    assert await cache.entry("user-1") is entries[0]
+    assert stats.reads == 1
+
+
+async def test_users_do_not_share_entries():
+    stats = FakeStats()
+    cache = AnalyticsCache(100, 60, stats.read)
+    assert (await cache.entry("user-1")).stats["user_id"] == "user-1"
+    assert (await cache.entry("user-2")).stats["user_id"] == "user-2"
+    assert stats.reads == 2
+
+
+async def test_a_write_during_a_read_keeps_its_result_out_of_the_cache():
+    stats = FakeStats()
+    stats.gate.clear()
+    cache = AnalyticsCache(100, 60, stats.read)
+    stale = asyncio.ensure_future(cache.entry("user-1"))
+    await settle()
+    stats.change_version = 2
+    cache.invalidate("user-1")
+    # A read after the write doesn't join the one in flight
+    fresh = asyncio.ensure_future(cache.entry("user-1"))
+    await settle()
+    stats.gate.set()
+    assert (await stale).change_version == 1
+    assert (await fresh).change_version == 2
+    assert (await cache.entry("user-1")).change_version == 2
+    assert stats.reads == 2
+
+
+async def test_results_are_computed_once_per_entry():
+    stats = FakeStats()
+    cache = AnalyticsCache(100, 60, stats.read)
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        await asyncio.sleep(0)
+        return "trends"
+
+    entry = await cache.entry("user-1")
+    results = await asyncio.gather(*(cache.result(entry, "user-1", "daily", compute) for _ in range(3)))
+    assert results == ["trends"] * 3
+    assert await cache.result(entry, "user-1", "daily", compute) == "trends"
+    assert len(computed) == 1
+
+    cache.invalidate("user-1")
+    await cache.result(await cache.entry("user-1"), "user-1", "daily", compute)
+    assert len(computed) == 2
+
+
+async def test_a_caller_going_away_does_not_cancel_the_shared_computation():
+    flights = SingleFlight()
+    gate = asyncio.Event()
+
+    async def compute():
+        await gate.wait()
+        return 42
+
+    leaving = asyncio.ensure_future(flights.run("key", compute))
+    staying = asyncio.ensure_future(flights.run("key", compute))
+    await settle()
+    leaving.cancel()
+    await settle()
+    gate.set()
+    assert await staying == 42
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 1}
+
+
+async def test_single_flight_shares_failures_then_retries():
+    flights = SingleFlight()
+    attempts = []
+
+    async def compute():
+        attempts.append(1)
+        await asyncio.sleep(0)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    results = await asyncio.gather(flights.run("key", compute), flights.run("key", compute), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await flights.run("key", compute) == "ok"
+    assert len(attempts) == 2
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("caching.time.monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=2, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache.set("short", 4, ttl=1)
+    now[0] += 2
+    assert cache.get("short") is None
+    now[0] += 4
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 2
+
+
+def test_ttl_cache_disabled_by_zero_ttl():
+    cache = TTLCache(max_entries=10, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
@@ -0,0 +1,122 @@
+import pytest
+
+from tests.helpers import EPOCH, make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+
+
+async def archive(storage, *tasks):
+    await storage.insert_tasks(list(tasks))
+    moved = await storage.archive_tasks(EPOCH.replace(year=2100), limit=100)
+    assert moved == {USER: len(tasks)}
+
+
+async def test_archived_task_is_restored_then_updated(storage):
+    task = make_task(USER, status="completed")
+    await archive(storage, task)
+    assert await storage.update_task(USER, task["id"], {"title": "Reopened"}, {}) is None
+
+    assert await storage.restore_tasks(USER, [task["id"]]) == [task["id"]]
+    assert await storage.find_task(USER, task["id"], archived=True) is None
+    before = await storage.update_task(USER, task["id"], {"title": "Reopened"}, {})
+    assert before["title"] == task["title"]
+    found = await storage.search_tasks(USER, {}, "reop", limit=10)
+    assert [found_task["id"] for found_task in found] == [task["id"]]
+
+
+async def test_restore_skips_other_users_and_hot_tasks(storage):
+    archived = make_task(USER, status="completed")
+    await archive(storage, archived)
+    hot = make_task(USER, 1)
+    await storage.insert_task(hot)
+    assert await storage.restore_tasks("someone-else", [archived["id"]]) == []
+    assert await storage.restore_tasks(USER, [hot["id"]]) == []
+    assert await storage.find_task(USER, archived["id"], archived=True) is not None
+
+
+async def test_restore_bumps_change_version(storage):
+    task = make_task(USER, status="completed")
+    await archive(storage, task)
+    version = await storage.read_change_version(USER)
+    await storage.restore_tasks(USER, [task["id"]])
+    assert await storage.read_change_version(USER) == version + 1
+
+
+async def test_delete_reaches_archive(storage):
+    first, second, third = (make_task(USER, n, status="completed") for n in range(3))
+    await archive(storage, first, second, third)
+
+    deleted = await storage.delete_task(USER, first["id"])
+    assert deleted["status"] == "completed"
+    assert await storage.find_task(USER, first["id"], archived=True) is None
+    assert await storage.delete_task(USER, first["id"]) is None
+
+    assert await storage.delete_tasks(USER, [second["id"], third["id"], "missing"]) == 2
+    assert await storage.find_owned_tasks(USER, [second["id"], third["id"]], archived=True) == []
+
+
+async def test_delete_reaches_both_tiers_mid_move(storage):
+    task = make_task(USER, status="completed")
+    await archive(storage, task)
+    # Caught between the archive copy and removing the original
+    await storage.insert_task({**task, "status": "pending"})
+
+    deleted = await storage.delete_task(USER, task["id"])
+    assert deleted["status"] == "pending"
+    assert await storage.find_task(USER, task["id"]) is None
+    assert await storage.find_task(USER, task["id"], archived=True) is None
+
+    other = make_task(USER, 1, status="completed")
+    await archive(storage, other)
+    await storage.insert_task(other)
+    assert await storage.delete_tasks(USER, [other["id"]]) == 2
+    assert await storage.find_owned_tasks(USER, [other["id"]], archived=True) == []
+
+
+@pytest.mark.parametrize("storage", ["mongo"], indirect=True)
+async def test_archive_drops_copies_of_tasks_deleted_mid_move(storage, monkeypatch):
+    doomed, kept = make_task(USER, 0, status="completed"), make_task(USER, 1, status="completed")
+    await storage.insert_tasks([doomed, kept])
+    collection = type(storage.db.tasks_archive)
+    bulk_write = collection.bulk_write
+
+    async def copy_then_delete(self, requests, **options):
+        result = await bulk_write(self, requests, **options)
+        if self.name == "tasks_archive":
+            await storage.db.tasks.delete_one({"id": doomed["id"]})
+        return result
+
+    monkeypatch.setattr(collection, "bulk_write", copy_then_delete)
+    assert await storage.archive_tasks(EPOCH.replace(year=2100), limit=100) == {USER: 1}
+    assert await storage.find_task(USER, doomed["id"], archived=True) is None
+    assert (await storage.find_task(USER, kept["id"], archived=True))["id"] == kept["id"]
+
+
+async def test_iter_tasks_covers_both_tiers(storage):
+    archived = [make_task(USER, n, status="completed") for n in (0, 2, 4)]
+    await archive(storage, *archived)
+    hot = [make_task(USER, n) for n in (1, 3)]
+    await storage.insert_tasks(hot)
+
+    exported = [task async for task in storage.iter_tasks(USER, {}, None, batch_size=2)]
+    assert [task["title"] for task in exported] == [f"Task {n}" for n in range(5)]
+    searched = [task async for task in storage.iter_tasks(USER, {"status": "completed"}, "task", batch_size=2)]
+    assert [task["id"] for task in searched] == [task["id"] for task in archived]
+
+
+async def test_due_date_counts_cover_both_tiers(storage):
+    day = EPOCH.replace(day=10)
+    await archive(storage, make_task(USER, 0, status="completed", due_date=day))
+    await storage.insert_tasks([
+        make_task(USER, 1, due_date=day),
+        make_task(USER, 2, status="completed", due_date=day.replace(day=11)),
+        make_task(USER, 3, due_date=day.replace(month=3)),
+    ])
+
+    counts = await storage.due_date_counts(USER, (EPOCH, EPOCH.replace(month=2)))
+    assert counts == [
+        {"_id": "2024-01-10", "total": 2, "completed": 1},
+        {"_id": "2024-01-11", "total": 1, "completed": 1},
+    ]
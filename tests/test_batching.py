@@ -0,0 +1,130 @@
+"""Insert micro-batching."""
+import asyncio
+
+import pytest
+
+from batching import InsertCoalescer
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeStore:
+    """`insert_many` that records its batches and, while `gate` is clear,
+    holds them in flight."""
+
+    def __init__(self, failing=()):
+        self.batches = []
+        self.failing = set(failing)
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def insert_many(self, documents):
+        self.batches.append([document["n"] for document in documents])
+        await self.gate.wait()
+        return {index: ValueError(document["n"]) for index, document in enumerate(documents)
+                if document["n"] in self.failing}
+
+
+async def settle():
+    """Let every runnable task run until it blocks."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_idle_insert_goes_out_alone():
+    store = FakeStore()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=60)
+    await coalescer.insert({"n": 1})
+    await coalescer.insert({"n": 2})
+    assert store.batches == [[1], [2]]
+
+
+async def test_inserts_gather_while_a_batch_is_in_flight():
+    store = FakeStore()
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=60)
+    first = asyncio.ensure_future(coalescer.insert({"n": 0}))
+    await settle()
+    rest = [asyncio.ensure_future(coalescer.insert({"n": n})) for n in range(1, 4)]
+    await settle()
+    assert store.batches == [[0]]
+
+    # The next batch goes out as soon as the one in flight is acknowledged
+    store.gate.set()
+    await asyncio.gather(first, *rest)
+    assert store.batches == [[0], [1, 2, 3]]
+    assert coalescer.stats()["batches"] == 2
+
+
+async def test_waiting_inserts_go_after_max_delay():
+    store = FakeStore()
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=0.01)
+    first = asyncio.ensure_future(coalescer.insert({"n": 0}))
+    await settle()
+    second = asyncio.ensure_future(coalescer.insert({"n": 1}))
+    await asyncio.sleep(0.05)
+    assert store.batches == [[0], [1]]
+    store.gate.set()
+    await asyncio.gather(first, second)
+
+
+async def test_full_batch_goes_out_straight_away():
+    store = FakeStore()
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=2, max_delay=60)
+    calls = [asyncio.ensure_future(coalescer.insert({"n": n})) for n in range(3)]
+    await settle()
+    assert store.batches == [[0], [1, 2]]
+    store.gate.set()
+    await asyncio.gather(*calls)
+
+
+async def test_each_caller_gets_its_own_outcome():
+    store = FakeStore(failing={2})
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=60)
+    calls = [asyncio.ensure_future(coalescer.insert({"n": n})) for n in range(4)]
+    await settle()
+    store.gate.set()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    assert [isinstance(result, ValueError) for result in results] == [False, False, True, False]
+    assert coalescer.stats()["failed"] == 1
+    assert coalescer.stats()["inserted"] == 3
+
+
+async def test_a_failed_batch_fails_every_caller_in_it():
+    async def unavailable(documents):
+        raise ConnectionError("down")
+
+    coalescer = InsertCoalescer(unavailable, max_batch=10, max_delay=60)
+    with pytest.raises(ConnectionError):
+        await coalescer.insert({"n": 0})
+
+
+async def test_a_caller_going_away_does_not_drop_the_write():
+    store = FakeStore()
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=60)
+    first = asyncio.ensure_future(coalescer.insert({"n": 0}))
+    await settle()
+    abandoned = asyncio.ensure_future(coalescer.insert({"n": 1}))
+    await settle()
+    abandoned.cancel()
+    store.gate.set()
+    await first
+    await coalescer.drain()
+    assert store.batches == [[0], [1]]
+
+
+async def test_drain_writes_what_is_waiting():
+    store = FakeStore()
+    store.gate.clear()
+    coalescer = InsertCoalescer(store.insert_many, max_batch=10, max_delay=60)
+    calls = [asyncio.ensure_future(coalescer.insert({"n": n})) for n in range(3)]
+    await settle()
+    store.gate.set()
+    await coalescer.drain()
+    assert all(call.done() for call in calls)
+    assert store.batches == [[0], [1, 2]]
+    assert coalescer.stats()["pending"] == 0
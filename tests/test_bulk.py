@@ -0,0 +1,99 @@
+"""The bulk task endpoints, through the app."""
+import server
+import task_stats
+
+DUE = "2024-03-01T00:00:00Z"
+FAR_FUTURE = server.utc_now().replace(year=2100)
+
+
+def create(client, *titles, **fields):
+    tasks = [{"title": title, "due_date": DUE, **fields} for title in titles]
+    response = client.post("/api/tasks/bulk", json={"tasks": tasks})
+    assert response.status_code == 200
+    return [result["id"] for result in response.json()["results"]]
+
+
+def statuses(response):
+    assert response.status_code == 200
+    return [(result["index"], result["status"]) for result in response.json()["results"]]
+
+
+def current_user_id(client):
+    return client.get("/api/auth/me").json()["id"]
+
+
+def stats(client):
+    stored = client.portal.call(server.storage.read_user_stats, current_user_id(client))
+    recounted = client.portal.call(server.storage.rebuild_user_stats, current_user_id(client))
+    return task_stats.normalize(stored), task_stats.normalize(recounted)
+
+
+def test_create_reports_each_item(client):
+    response = client.post("/api/tasks/bulk", json={"tasks": [
+        {"title": "First", "due_date": DUE},
+        {"due_date": DUE},
+        {"title": "Bad date", "due_date": "someday"},
+        {"title": "Second", "due_date": DUE, "status": "completed"},
+    ]})
+    assert statuses(response) == [(0, 201), (1, 422), (2, 422), (3, 201)]
+    assert response.json()["succeeded"] == 2
+    stored, recounted = stats(client)
+    assert stored == recounted and stored["total"] == 2 and stored["completed"] == 1
+
+
+def test_create_hides_driver_errors(client, monkeypatch):
+    async def insert_tasks(documents):
+        return {0: Exception("E11000 duplicate key error collection: test.tasks index: id_unique")}
+
+    monkeypatch.setattr(server.storage, "insert_tasks", insert_tasks)
+    response = client.post("/api/tasks/bulk", json={"tasks": [{"title": "A", "due_date": DUE}] * 2})
+    assert statuses(response) == [(0, 500), (1, 201)]
+    assert response.json()["results"][0]["error"] == "Task could not be saved"
+
+
+def test_update_checks_ownership_duplicates_and_versions(client):
+    first, second = create(client, "First", "Second")
+    theirs = client.post("/api/auth/register", json={"email": "other@example.com", "password": "secret"})
+    other = {"Authorization": f"Bearer {theirs.json()['access_token']}"}
+    foreign = client.post("/api/tasks", json={"title": "Theirs", "due_date": DUE}, headers=other).json()["id"]
+
+    response = client.patch("/api/tasks/bulk", json={"updates": [
+        {"id": first, "status": "completed"},
+        {"id": first, "title": "Again"},
+        {"id": foreign, "status": "completed"},
+        {"id": second, "status": "completed", "version": 7},
+        {"title": "No id"},
+    ]})
+    assert statuses(response) == [(0, 200), (1, 422), (2, 404), (3, 409), (4, 422)]
+    assert client.get(f"/api/tasks/{foreign}", headers=other).json()["status"] == "pending"
+    stored, recounted = stats(client)
+    assert stored == recounted and stored["completed"] == 1
+
+
+def test_update_restores_archived_tasks(client):
+    task_id, = create(client, "Done", status="completed")
+    assert client.portal.call(server.storage.archive_tasks, FAR_FUTURE, 100)
+
+    response = client.patch("/api/tasks/bulk", json={"updates": [{"id": task_id, "status": "pending"}]})
+    assert statuses(response) == [(0, 200)]
+    assert client.portal.call(server.storage.find_task, current_user_id(client), task_id)["status"] == "pending"
+    stored, recounted = stats(client)
+    assert stored == recounted and stored["completed"] == 0
+
+
+def test_delete_reports_duplicates_and_reaches_the_archive(client):
+    archived, = create(client, "Done", status="completed")
+    hot, = create(client, "Open")
+    client.portal.call(server.storage.archive_tasks, FAR_FUTURE, 100)
+
+    response = client.request("DELETE", "/api/tasks/bulk", json={"ids": [archived, hot, archived, "missing"]})
+    assert statuses(response) == [(0, 200), (1, 200), (2, 422), (3, 404)]
+    assert response.json()["results"][2]["error"] == "Duplicate id in batch"
+    assert client.get(f"/api/tasks/{archived}").status_code == 404
+    stored, recounted = stats(client)
+    assert stored == recounted and stored["total"] == 0
+
+
+def test_batches_are_capped(client):
+    response = client.request("DELETE", "/api/tasks/bulk", json={"ids": ["x"] * (server.BULK_MAX_OPERATIONS + 1)})
+    assert response.status_code == 422
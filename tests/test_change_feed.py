@@ -0,0 +1,116 @@
+"""The task change feed and its stream tickets."""
+import asyncio
+import re
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from change_feed import ChangeBroker
+
+pytestmark = pytest.mark.anyio
+
+EVENT_ID = re.compile(rb"^id: (.*)$", re.MULTILINE)
+EVENT_TYPE = re.compile(rb"^event: (.*)$", re.MULTILINE)
+
+
+def broker(buffer_size=10, heartbeat_seconds=60.0):
+    return ChangeBroker(buffer_size, max_channels=10, heartbeat_seconds=heartbeat_seconds, max_stream_seconds=60)
+
+
+def events(chunk):
+    """(event type, event id) of every frame in a chunk."""
+    return list(zip(
+        [match.decode() for match in EVENT_TYPE.findall(chunk)], [match.decode() for match in EVENT_ID.findall(chunk)]
+    ))
+
+
+async def connect(feed, user_id, last_event_id=None):
+    stream = feed.stream(user_id, last_event_id)
+    assert await anext(stream) == b"retry: 3000\n\n"
+    return stream
+
+
+def publish(feed, user_id, *task_ids):
+    """Publish a creation per task id; returns the ids of every buffered event."""
+    feed.publish_many(user_id, "created", [{"id": task_id} for task_id in task_ids])
+    return [event_id for _, event_id in events(b"".join(frame for _, _, frame in feed._channels[user_id].events))]
+
+
+async def test_resume_after_last_event_id():
+    feed = broker()
+    first, second, third = publish(feed, "user-1", "a", "b", "c")
+    stream = await connect(feed, "user-1", first)
+    assert events(await anext(stream)) == [("created", second), ("created", third)]
+    await stream.aclose()
+
+
+async def test_reset_when_the_last_event_id_is_gone():
+    feed = broker(buffer_size=2)
+    first, *_ = publish(feed, "user-1", "a")
+    *_, newest = publish(feed, "user-1", "b", "c")
+    stream = await connect(feed, "user-1", first)
+    # Resumes from the newest buffered event, which it points the client at
+    assert events(await anext(stream)) == [("reset", newest)]
+    assert feed.resets == 1
+    await stream.aclose()
+
+    stream = await connect(feed, "user-1", "another-process-1")
+    assert events(await anext(stream)) == [("reset", newest)]
+    await stream.aclose()
+
+
+async def test_reset_when_a_connection_falls_behind_the_buffer():
+    feed = broker(buffer_size=2)
+    stream = await connect(feed, "user-1")
+    waiting = asyncio.ensure_future(anext(stream))
+    await asyncio.sleep(0)
+    # More than the buffer holds before the connection gets to run
+    *_, newest = publish(feed, "user-1", "a", "b", "c")
+    assert events(await waiting) == [("reset", newest)]
+    publish(feed, "user-1", "d")
+    assert [event_type for event_type, _ in events(await anext(stream))] == ["created"]
+    await stream.aclose()
+
+
+async def test_each_users_connections_share_their_frames():
+    feed = broker(heartbeat_seconds=0.01)
+    tabs = [await connect(feed, "user-1") for _ in range(2)]
+    other = await connect(feed, "user-2")
+    waiting = [asyncio.ensure_future(anext(tab)) for tab in tabs]
+    await asyncio.sleep(0)
+    publish(feed, "user-1", "a")
+
+    first, second = await asyncio.gather(*waiting)
+    assert first is second
+    assert [event_type for event_type, _ in events(first)] == ["created"]
+    # Nothing for anyone else; just the heartbeat
+    assert await anext(other) == b": ping\n\n"
+    assert feed.stats()["subscribers"] == 3
+    for stream in tabs + [other]:
+        await stream.aclose()
+    assert feed.stats()["subscribers"] == 0
+
+
+def test_stream_tickets_are_single_use():
+    ticket = server.create_stream_ticket("user-1")
+    assert server.decode_stream_ticket(ticket) == "user-1"
+    with pytest.raises(HTTPException) as raised:
+        server.decode_stream_ticket(ticket)
+    assert raised.value.status_code == 401
+    # A new ticket for every connection
+    assert server.decode_stream_ticket(server.create_stream_ticket("user-1")) == "user-1"
+
+
+def test_stream_tickets_expire(monkeypatch):
+    monkeypatch.setattr(server, "STREAM_TICKET_TTL_SECONDS", -1)
+    with pytest.raises(HTTPException) as raised:
+        server.decode_stream_ticket(server.create_stream_ticket("user-1"))
+    assert raised.value.status_code == 401
+
+
+def test_tickets_and_access_tokens_are_not_interchangeable():
+    with pytest.raises(HTTPException):
+        server.decode_stream_ticket(server.create_access_token({"sub": "user-1"}))
+    with pytest.raises(HTTPException):
+        server.decode_token_subject(server.create_stream_ticket("user-1"))
@@ -0,0 +1,72 @@
+"""ETag and conditional request helpers."""
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from server import collection_etag, not_modified, parse_if_match, task_etag
+
+
+def request(path: str = "/api/tasks", query: str = "", if_none_match: str = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({
+        "type": "http", "method": "GET", "scheme": "http", "server": ("testserver", 80),
+        "path": path, "root_path": "", "query_string": query.encode(), "headers": headers,
+    })
+
+
+def test_task_etag_names_the_version():
+    assert task_etag({"version": 7}) == '"v7"'
+    # Tasks written before versioning
+    assert task_etag({}) == '"v0"'
+
+
+def test_if_match_lists_versions():
+    assert parse_if_match('"v3"') == [3]
+    assert parse_if_match(' "v3", "v4" ') == [3, 4]
+    assert parse_if_match("*") is None
+
+
+@pytest.mark.parametrize("header", ['"3"', '"v"', '"vx"', 'W/"v3"', '"4-abc"'])
+def test_if_match_other_tags_match_no_version(header):
+    assert parse_if_match(header) == []
+    assert parse_if_match(f'{header}, "v2"') == [2]
+
+
+@pytest.mark.parametrize("header", ["v3", '"v3", bad', '"v3', 'W/v3', '"v"3"', ""])
+def test_if_match_rejects_malformed_headers(header):
+    with pytest.raises(HTTPException) as raised:
+        parse_if_match(header)
+    assert raised.value.status_code == 400
+
+
+def test_weak_if_match_fails_the_precondition(client):
+    task = client.post("/api/tasks", json={"title": "Tagged", "due_date": "2024-03-01T00:00:00Z"}).json()
+    path = f"/api/tasks/{task['id']}"
+    assert client.put(path, json={"title": "Weak"}, headers={"If-Match": 'W/"v1"'}).status_code == 412
+    response = client.put(path, json={"title": "Strong"}, headers={"If-Match": '"v1"'})
+    assert response.status_code == 200 and response.headers["ETag"] == '"v2"'
+
+
+def test_collection_etag_varies_with_everything_that_changes_the_body():
+    etag = collection_etag(request(query="status=pending&limit=5"), "user-1", 4)
+    assert etag.startswith('"4-')
+    # Parameter order doesn't matter
+    assert collection_etag(request(query="limit=5&status=pending"), "user-1", 4) == etag
+    assert collection_etag(request(query="status=pending&limit=5"), "user-1", 5) != etag
+    assert collection_etag(request(query="status=pending&limit=5"), "user-2", 4) != etag
+    assert collection_etag(request(query="status=completed&limit=5"), "user-1", 4) != etag
+    assert collection_etag(request("/api/analytics/summary", "status=pending&limit=5"), "user-1", 4) != etag
+    assert collection_etag(request(query="status=pending&limit=5"), "user-1", 4, extra="csv") != etag
+
+
+@pytest.mark.parametrize("header", ['"4-abc"', 'W/"4-abc"', '"3-old", "4-abc"', "*"])
+def test_not_modified_when_the_client_has_it(header):
+    response = not_modified(request(if_none_match=header), '"4-abc"')
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"4-abc"'
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+
+@pytest.mark.parametrize("header", [None, '"3-abc"', '"4-abd"'])
+def test_modified_otherwise(header):
+    assert not_modified(request(if_none_match=header), '"4-abc"') is None
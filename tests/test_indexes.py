@@ -0,0 +1,59 @@
+"""Index definitions against the queries they are for."""
+import sqlite3
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from indexes import INDEXES, QUERY_SHAPES, _is_covered, ensure_indexes, report_uncovered_queries
+from sqlite_storage import SQLiteStorage
+from tests.helpers import PUBLIC_FIELDS
+
+pytestmark = pytest.mark.anyio
+
+
+def key_patterns(collection):
+    return {
+        model.document["name"]: (tuple(model.document["key"]), bool(model.document.get("unique")))
+        for model in INDEXES[collection]
+    }
+
+
+def assert_no_prefixes(patterns):
+    for name, keys in patterns.items():
+        for other, other_keys in patterns.items():
+            assert name == other or other_keys[:len(keys)] != keys, f"{name} is a prefix of {other}"
+
+
+@pytest.mark.parametrize("collection", list(INDEXES))
+def test_no_index_is_a_prefix_of_another(collection):
+    assert_no_prefixes({name: keys for name, (keys, _) in key_patterns(collection).items()})
+
+
+@pytest.mark.parametrize("collection", list(INDEXES))
+def test_every_index_is_the_only_one_for_some_query(collection):
+    shapes = [shape for shape in QUERY_SHAPES if shape.collection == collection]
+    for name, model in zip(key_patterns(collection), INDEXES[collection]):
+        if "expireAfterSeconds" in model.document:
+            continue
+        others = [spec for other, spec in key_patterns(collection).items() if other != name]
+        assert any(not _is_covered(shape, others) for shape in shapes), f"{collection}.{name} serves no query"
+
+
+async def test_every_query_is_covered():
+    db = AsyncMongoMockClient()["test"]
+    await ensure_indexes(db)
+    assert await report_uncovered_queries(db) == []
+
+
+async def test_sqlite_has_no_prefix_indexes(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "tasks.db"), PUBLIC_FIELDS, workers=1)
+    await storage.open()
+    await storage.close()
+    connection = sqlite3.connect(tmp_path / "tasks.db")
+    tables = {}
+    for name, table in connection.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'"):
+        columns = tuple(row[2] for row in connection.execute(f"PRAGMA index_info('{name}')"))
+        tables.setdefault(table, {})[name] = columns
+    connection.close()
+    for patterns in tables.values():
+        assert_no_prefixes(patterns)
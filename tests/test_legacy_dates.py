@@ -0,0 +1,52 @@
+"""Tasks written by old versions can hold a due date string the date
+migration couldn't parse. Only Mongo keeps such documents."""
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from mongo_storage import MongoStorage
+from sorting import TaskSort
+from tests.helpers import EPOCH, PUBLIC_FIELDS, make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+
+
+@pytest.fixture
+async def mongo():
+    client = AsyncMongoMockClient(tz_aware=True)
+    storage = MongoStorage(client, client, "test", PUBLIC_FIELDS)
+    await storage.open()
+    yield storage
+    await storage.close()
+
+
+@pytest.fixture
+async def tasks(mongo):
+    tasks = [make_task(USER, n, due_date=EPOCH.replace(day=n + 1)) for n in range(3)]
+    tasks.insert(1, make_task(USER, 3, due_date="next tuesday"))
+    await mongo.insert_tasks([dict(task) for task in tasks])
+    return tasks
+
+
+def test_sort_key_orders_strings_before_dates():
+    legacy, dated = make_task(USER, 0, due_date="someday"), make_task(USER, 1)
+    by_due = TaskSort("due_date")
+    assert sorted([dated, legacy], key=by_due.sort_key) == [legacy, dated]
+    assert sorted([legacy, dated], key=by_due.sort_key, reverse=True) == [dated, legacy]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+async def test_due_date_pages_reach_every_task(mongo, tasks, descending):
+    task_sort = TaskSort("due_date", descending)
+    seen, position = [], None
+    while True:
+        page = await mongo.find_tasks(USER, {}, position, 1, sort=task_sort)
+        if not page:
+            break
+        seen.append(page[0]["id"])
+        position = task_sort.decode_cursor(task_sort.encode_cursor(page[0]))
+
+    expected = sorted(tasks, key=task_sort.sort_key, reverse=descending)
+    assert seen == [task["id"] for task in expected]
+    assert (seen[0] == tasks[1]["id"]) is not descending
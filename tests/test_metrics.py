@@ -0,0 +1,16 @@
+"""Request metrics labels."""
+import metrics
+
+
+def test_requests_are_labelled_by_route_template(client):
+    task = client.post("/api/tasks", json={"title": "Measured", "due_date": "2024-03-01T00:00:00Z"}).json()
+    client.get(f"/api/tasks/{task['id']}")
+    client.get("/api/tasks/no-such-task")
+    client.get("/no-such-route")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/api/tasks/{task_id}",status="200"}' in body
+    assert 'http_requests_total{method="GET",route="/api/tasks/{task_id}",status="404"}' in body
+    assert f'route="{metrics.UNMATCHED_ROUTE}",status="404"' in body
+    # Ids and unknown paths never become label values
+    assert task["id"] not in body and "no-such" not in body
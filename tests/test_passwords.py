@@ -0,0 +1,50 @@
+"""Password hashing off the event loop."""
+import asyncio
+
+import pytest
+
+import server
+from passwords import HasherSaturated, PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=0)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_hash_and_verify(hasher):
+    password_hash = await hasher.hash("secret")
+    assert password_hash.startswith("$2b$04$")
+    assert await hasher.verify_and_update("secret", password_hash) == (True, None)
+    assert await hasher.verify_and_update("wrong", password_hash) == (False, None)
+    assert hasher.stats()["completed"] == 3
+
+
+async def test_older_cost_is_rehashed(hasher):
+    stronger = PasswordHasher(rounds=5, workers=1, max_queue=0)
+    try:
+        matches, new_hash = await stronger.verify_and_update("secret", await hasher.hash("secret"))
+    finally:
+        stronger.shutdown()
+    assert matches and new_hash.startswith("$2b$05$")
+
+
+async def test_callers_past_capacity_are_turned_away(hasher):
+    results = await asyncio.gather(hasher.hash("a"), hasher.hash("b"), return_exceptions=True)
+    assert isinstance(results[1], HasherSaturated)
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_login_upgrades_an_older_hash(client, monkeypatch):
+    # Registered with the fixture's 4 rounds; the app now wants 5
+    monkeypatch.setattr(server, "password_hasher", PasswordHasher(rounds=5, workers=1, max_queue=8))
+    credentials = {"email": "user@example.com", "password": "secret"}
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    user = client.portal.call(server.storage.find_user_by_email, "user@example.com")
+    assert user["password_hash"].startswith("$2b$05$")
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    assert client.post("/api/auth/login", json={**credentials, "password": "wrong"}).status_code == 401
@@ -0,0 +1,80 @@
+"""Prefix search terms, filters and ranking."""
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from search import (
+    MAX_INDEXED_WORDS, MAX_PREFIX_LENGTH, indexed_text, query_terms, rank_by_relevance, search_filter, text_terms,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_terms_are_folded_prefixes():
+    assert text_terms("Café OK") == ["c", "ca", "caf", "cafe", "o", "ok"]
+    assert text_terms(None) == []
+    assert max(map(len, text_terms("x" * 50))) == MAX_PREFIX_LENGTH
+
+
+def test_terms_are_capped_per_field():
+    text = " ".join(f"w{n}" for n in range(MAX_INDEXED_WORDS + 10))
+    terms = text_terms(text)
+    assert f"w{MAX_INDEXED_WORDS - 1}" in terms
+    assert f"w{MAX_INDEXED_WORDS}" not in terms
+    # Repeats don't use up the budget
+    assert "late" in text_terms("again " * 500 + "late")
+    assert len(query_terms(text)) == MAX_INDEXED_WORDS
+
+
+def test_query_terms():
+    assert query_terms("  Café, CAFE! a.b ") == ["cafe", "a", "b"]
+    assert query_terms("y" * 30) == ["y" * MAX_PREFIX_LENGTH]
+    assert query_terms(".*") == []
+
+
+def test_search_filter_matches_every_word():
+    assert search_filter("Buy café")["$or"][0] == {"search_terms": {"$all": ["buy", "cafe"]}}
+    # No words: nothing matches through the terms
+    assert search_filter("+++")["$or"][0] == {"search_terms": {"$in": []}}
+
+
+@pytest.fixture
+async def tasks():
+    client = AsyncMongoMockClient()
+    collection = client["test"]["tasks"]
+    await collection.insert_many([
+        {"id": "indexed", "title": "Café au lait", **indexed_text("Café au lait", "")},
+        # Not reached by the backfill yet
+        {"id": "unmigrated", "title": "Café a.b", "description": ""},
+        {"id": "lookalike", "title": "cafe axb", "description": ""},
+    ])
+    return collection
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("café", {"indexed", "unmigrated"}),
+    # The fallback matches the raw text, accents and all
+    ("cafe", {"indexed", "lookalike"}),
+    ("CAF", {"indexed", "unmigrated", "lookalike"}),
+    # Metacharacters are literal
+    ("a.b", {"unmigrated"}),
+    (".*", set()),
+])
+async def test_search_filter_falls_back_for_unmigrated_tasks(tasks, query, expected):
+    found = await tasks.find(search_filter(query), {"_id": 0, "id": 1}).to_list(None)
+    assert {task["id"] for task in found} == expected
+
+
+def test_rank_by_relevance():
+    tasks = [
+        {"id": "description-prefix", "title": "Other", "description": "Groceries"},
+        {"id": "title-prefix", "title": "Grocery run"},
+        {"id": "description-word", "title": "Other", "description": "grocer"},
+        {"id": "title-word", "title": "The Grocer"},
+        {"id": "none", "title": "Other"},
+    ]
+    ranked = rank_by_relevance(tasks, "grocer")
+    assert [task["id"] for task in ranked] == [
+        "title-word", "title-prefix", "description-word", "description-prefix", "none",
+    ]
+    # Ties keep the order they arrived in
+    assert rank_by_relevance(tasks[:1] + tasks[2:3], "zzz") == tasks[:1] + tasks[2:3]
@@ -0,0 +1,168 @@
+"""The `Storage` contract, checked against both backends."""
+from datetime import timedelta
+
+import pytest
+
+import task_stats
+from dates import utc_now
+from sorting import TaskSort
+from tests.helpers import EPOCH, make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+
+
+async def register(storage, user_id: str = USER) -> None:
+    await storage.insert_user({
+        "id": user_id, "email": f"{user_id}@example.com", "password_hash": "hash", "created_at": EPOCH.isoformat(),
+    })
+
+
+@pytest.fixture
+async def tasks(storage):
+    priorities = ["High", "Low", "Medium"]
+    tasks = [
+        make_task(
+            USER, n,
+            priority=priorities[n % 3],
+            status="completed" if n % 2 else "pending",
+            category="Work" if n < 4 else "Home",
+            due_date=EPOCH + timedelta(days=(n * 5) % 7, hours=n),
+        )
+        for n in range(8)
+    ]
+    await storage.insert_tasks(tasks)
+    await storage.insert_task(make_task("someone-else", 99))
+    return tasks
+
+
+@pytest.mark.parametrize("field", ["created_at", "due_date", "priority", "updated_at"])
+@pytest.mark.parametrize("descending", [False, True])
+async def test_keyset_pages_follow_the_sort(storage, tasks, field, descending):
+    task_sort = TaskSort(field, descending)
+    seen, position = [], None
+    while True:
+        page = await storage.find_tasks(USER, {}, position, 3, sort=task_sort)
+        seen += page
+        if len(page) < 3:
+            break
+        position = task_sort.decode_cursor(task_sort.encode_cursor(page[-1]))
+
+    expected = sorted(tasks, key=task_sort.sort_key, reverse=descending)
+    assert [task["id"] for task in seen] == [task["id"] for task in expected]
+
+
+async def test_filters_and_due_ranges(storage, tasks):
+    due = (EPOCH + timedelta(days=1), EPOCH + timedelta(days=5))
+    found = await storage.find_tasks(USER, {"category": "Work", "status": "pending"}, None, 100, due=due)
+    expected = [
+        task for task in tasks
+        if task["category"] == "Work" and task["status"] == "pending" and due[0] <= task["due_date"] < due[1]
+    ]
+    assert [task["id"] for task in found] == [task["id"] for task in expected]
+
+    due_soon = await storage.find_due_tasks(USER, "completed", (None, EPOCH + timedelta(days=4)), None, 100)
+    expected = sorted(
+        (task for task in tasks if task["status"] == "completed" and task["due_date"] < EPOCH + timedelta(days=4)),
+        key=lambda task: (task["due_date"], task["id"]),
+    )
+    assert [task["id"] for task in due_soon] == [task["id"] for task in expected]
+    resumed = await storage.find_due_tasks(
+        USER, "completed", (None, EPOCH + timedelta(days=4)), [due_soon[0]["due_date"], due_soon[0]["id"]], 100
+    )
+    assert resumed == due_soon[1:]
+
+
+async def test_reads_return_public_fields(storage, tasks):
+    task = await storage.find_task(USER, tasks[0]["id"])
+    assert set(task) == set(storage.public_fields)
+    assert task["due_date"] == tasks[0]["due_date"]
+    assert await storage.find_task("someone-else", tasks[0]["id"]) is None
+
+
+async def test_conditional_updates(storage, tasks):
+    task = tasks[0]
+    assert await storage.update_task(USER, task["id"], {"status": "completed"}, {"status": "completed"}) is None
+    assert await storage.update_task(USER, task["id"], {"status": "completed"}, {}, versions=[2]) is None
+
+    before = await storage.update_task(USER, task["id"], {"status": "completed"}, {"status": "pending"}, versions=[1])
+    assert before["status"] == "pending" and before["version"] == 1
+    assert set(before) == set(storage.public_fields) | set(task_stats.COUNTED_FIELDS)
+    assert (await storage.find_task(USER, task["id"]))["version"] == 2
+
+    now = EPOCH + timedelta(days=30)
+    landed = await storage.update_tasks(USER, [
+        (tasks[1]["id"], {"title": "Renamed", "updated_at": now}, {"status": "completed"}, None),
+        (tasks[2]["id"], {"title": "Renamed", "updated_at": now}, {"status": "completed"}, None),
+    ], now)
+    assert landed == {tasks[1]["id"]}
+    assert [task["id"] for task in await storage.search_tasks(USER, {}, "renam", 10)] == [tasks[1]["id"]]
+    changed = await storage.changed_tasks(USER, [EPOCH + timedelta(days=1), ""], 10)
+    assert [task["id"] for task in changed] == [tasks[1]["id"]]
+
+
+async def test_counter_deltas_match_a_rebuild(storage, tasks):
+    await register(storage)
+    # `.` and `$` can't appear in Mongo field paths; the keys are escaped
+    odd = make_task(USER, 50, category="a.b", priority="$high")
+    await storage.insert_task(odd)
+    await storage.apply_stats_delta(USER, task_stats.combine(task_stats.task_delta(task) for task in tasks + [odd]))
+    before = await storage.update_task(USER, tasks[0]["id"], {"status": "completed", "category": "Home"}, {})
+    after = {**before, "status": "completed", "category": "Home"}
+    await storage.apply_stats_delta(USER, task_stats.transition_delta(before, after))
+    deleted = await storage.delete_task(USER, tasks[1]["id"])
+    await storage.apply_stats_delta(USER, task_stats.task_delta(deleted, -1))
+
+    incremental = task_stats.normalize(await storage.read_user_stats(USER))
+    assert incremental == task_stats.normalize(await storage.rebuild_user_stats(USER))
+    assert incremental["by_category"]["a.b"] == {"total": 1, "completed": 0}
+    assert incremental["by_priority"]["$high"] == {"total": 1, "completed": 0}
+    assert incremental["total"] == len(tasks)
+
+
+async def test_every_write_bumps_change_version(storage):
+    await register(storage)
+    assert await storage.read_change_version(USER) == 0
+    await storage.apply_stats_delta(USER, {})
+    await storage.apply_stats_delta(USER, task_stats.task_delta(make_task(USER)))
+    assert await storage.read_change_version(USER) == 2
+    await storage.rebuild_user_stats(USER)
+    assert await storage.read_change_version(USER) == 3
+
+
+async def test_stats_are_rebuilt_when_never_initialized(storage, tasks):
+    stats = task_stats.normalize(await storage.read_user_stats(USER))
+    assert stats["total"] == len(tasks)
+    assert stats["completed"] == sum(task["status"] == "completed" for task in tasks)
+
+
+async def test_tombstones_page_in_deletion_order(storage):
+    # Recent, or Mongo's TTL index would already have expired them
+    now = utc_now().replace(microsecond=0)
+    await storage.record_tombstones(USER, ["b", "a"], now)
+    await storage.record_tombstones(USER, ["c"], now + timedelta(seconds=1))
+    await storage.record_tombstones("someone-else", ["d"], now)
+
+    first = await storage.tombstones(USER, [now - timedelta(days=1), ""], 2)
+    assert first == [{"id": "a", "deleted_at": now}, {"id": "b", "deleted_at": now}]
+    rest = await storage.tombstones(USER, [first[-1]["deleted_at"], first[-1]["id"]], 2)
+    assert rest == [{"id": "c", "deleted_at": now + timedelta(seconds=1)}]
+
+
+async def test_archive_moves_only_old_completed_tasks(storage, tasks):
+    await register(storage)
+    cutoff = EPOCH + timedelta(minutes=5)
+    moved = await storage.archive_tasks(cutoff, limit=100)
+    old_completed = [task for task in tasks if task["status"] == "completed" and task["updated_at"] < cutoff]
+    assert moved == {USER: len(old_completed)}
+    assert await storage.read_change_version(USER) == 1
+
+    archived = await storage.find_tasks(USER, {}, None, 100, archived=True)
+    assert [task["id"] for task in archived] == [task["id"] for task in old_completed]
+    assert await storage.find_owned_tasks(USER, [task["id"] for task in old_completed]) == []
+    found = await storage.search_tasks(USER, {}, "task", 100, archived=True)
+    assert {task["id"] for task in found} == {task["id"] for task in old_completed}
+    # Archived tasks still count
+    stats = task_stats.normalize(await storage.rebuild_user_stats(USER))
+    assert stats["total"] == len(tasks)
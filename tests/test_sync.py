@@ -0,0 +1,81 @@
+"""Delta sync through `GET /api/tasks/changes`."""
+from datetime import timedelta
+
+import pytest
+
+import server
+from indexes import TOMBSTONE_TTL_SECONDS
+from pagination import decode_cursor, encode_cursor
+
+DUE = "2024-03-01T00:00:00Z"
+
+
+def token(at):
+    return encode_cursor({"updated_at": at, "id": ""}, server.SYNC_KEYS)
+
+
+def create(client, title):
+    return client.post("/api/tasks", json={"title": title, "due_date": DUE}).json()
+
+
+def changes(client, **params):
+    response = client.get("/api/tasks/changes", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.fixture
+def history(client):
+    """A minute ago, then: three tasks created, one deleted, one edited."""
+    start = server.utc_now() - timedelta(minutes=1)
+    kept, deleted, edited = (create(client, title) for title in ("Kept", "Deleted", "Edited"))
+    client.delete(f"/api/tasks/{deleted['id']}")
+    client.put(f"/api/tasks/{edited['id']}", json={"title": "Edited again"})
+    return start, kept, deleted, edited
+
+
+def test_changes_merge_tasks_and_deletions(client, history):
+    start, kept, deleted, edited = history
+    page = changes(client, since=token(start))
+    assert {task["id"] for task in page["tasks"]} == {kept["id"], edited["id"]}
+    assert [tombstone["id"] for tombstone in page["deleted"]] == [deleted["id"]]
+    assert not page["has_more"]
+
+    # A client starting from scratch has nothing to delete
+    initial = changes(client)
+    assert len(initial["tasks"]) == 2 and initial["deleted"] == []
+
+
+def test_has_more_counts_both_streams(client, history):
+    start, kept, deleted, edited = history
+    # Two tasks fit the page; the deletion doesn't
+    first = changes(client, since=token(start), limit=2)
+    assert first["has_more"]
+    assert len(first["tasks"]) + len(first["deleted"]) == 2
+
+    seen_tasks, seen_deleted, since = set(), set(), token(start)
+    while True:
+        page = changes(client, since=since, limit=1)
+        seen_tasks |= {task["id"] for task in page["tasks"]}
+        seen_deleted |= {tombstone["id"] for tombstone in page["deleted"]}
+        since = page["next_since"]
+        if not page["has_more"]:
+            break
+    assert seen_tasks == {kept["id"], edited["id"]} and seen_deleted == {deleted["id"]}
+
+
+def test_last_page_token_stops_short_of_now(client, history):
+    page = changes(client, since=token(history[0]))
+    next_position = decode_cursor(page["next_since"], server.SYNC_KEYS)
+    assert next_position[1] == ""
+    assert next_position[0] <= server.utc_now() - timedelta(seconds=server.SYNC_SETTLE_SECONDS)
+    # So writes from the last few seconds come round again rather than being missed
+    again = changes(client, since=page["next_since"])
+    assert {task["id"] for task in again["tasks"]} == {task["id"] for task in page["tasks"]}
+    assert again["deleted"] == page["deleted"]
+
+
+def test_old_or_bad_tokens_are_refused(client):
+    expired = server.utc_now() - timedelta(seconds=TOMBSTONE_TTL_SECONDS, hours=1)
+    assert client.get("/api/tasks/changes", params={"since": token(expired)}).status_code == 410
+    assert client.get("/api/tasks/changes", params={"since": "garbage"}).status_code == 400
@@ -0,0 +1,64 @@
+"""Incremental task counters against a recount."""
+import pytest
+
+import server
+import task_stats
+from tests.helpers import make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+DUE = "2024-03-01T00:00:00Z"
+FAR_FUTURE = server.utc_now().replace(year=2100)
+
+
+def test_route_writes_keep_counters_exact(client):
+    def create(**fields):
+        return client.post("/api/tasks", json={"title": "Task", "due_date": DUE, **fields}).json()["id"]
+
+    first = create(category="Work", priority="High")
+    second = create(status="completed")
+    third = create(category="Health")
+    bulk = client.post("/api/tasks/bulk", json={"tasks": [
+        {"title": "Bulk", "due_date": DUE, "category": "Study", "priority": "Low"},
+        {"title": "Bulk", "due_date": DUE, "status": "completed"},
+    ]}).json()
+    bulk_ids = [result["id"] for result in bulk["results"]]
+
+    client.put(f"/api/tasks/{first}", json={"status": "completed", "category": "Home"})
+    client.put(f"/api/tasks/{third}", json={"title": "Renamed only"})
+    client.patch("/api/tasks/bulk", json={"updates": [
+        {"id": bulk_ids[0], "priority": "High"},
+        {"id": bulk_ids[1], "status": "pending", "category": "Work"},
+    ]})
+    # Archived, then edited (which restores it), then archived again and deleted
+    client.portal.call(server.storage.archive_tasks, FAR_FUTURE, 100)
+    client.put(f"/api/tasks/{second}", json={"status": "pending"})
+    client.put(f"/api/tasks/{second}", json={"status": "completed"})
+    client.portal.call(server.storage.archive_tasks, FAR_FUTURE, 100)
+    client.delete(f"/api/tasks/{first}")
+    client.request("DELETE", "/api/tasks/bulk", json={"ids": [second, bulk_ids[0]]})
+
+    user_id = client.get("/api/auth/me").json()["id"]
+    stored = task_stats.normalize(client.portal.call(server.storage.read_user_stats, user_id))
+    assert stored == task_stats.normalize(client.portal.call(server.storage.rebuild_user_stats, user_id))
+    assert stored["total"] == 2 and stored["completed"] == 0
+    summary = client.get("/api/analytics/summary").json()
+    assert summary["total_tasks"] == 2
+
+
+@pytest.mark.parametrize("storage", ["mongo"], indirect=True)
+async def test_verify_reports_and_repairs_drift(storage):
+    tasks = [make_task(USER, n, status="completed" if n % 2 else "pending") for n in range(4)]
+    await storage.insert_tasks(tasks)
+    await storage.apply_stats_delta(USER, task_stats.combine(task_stats.task_delta(task) for task in tasks))
+    assert await task_stats.verify(storage.db) == []
+
+    await storage.db.task_stats.update_one({"user_id": USER}, {"$inc": {"completed": 1}})
+    assert await task_stats.verify(storage.db) == [USER]
+    assert await task_stats.verify(storage.db, USER, repair=True) == [USER]
+    assert await task_stats.verify(storage.db) == []
+
+    # Tasks without any counters at all are drift too
+    await storage.insert_task(make_task("user-2"))
+    assert await task_stats.verify(storage.db) == ["user-2"]
@@ -0,0 +1,59 @@
+"""Conditional single-round-trip updates under concurrency."""
+import asyncio
+
+import pytest
+
+from tests.helpers import make_task
+
+pytestmark = pytest.mark.anyio
+
+USER = "user-1"
+
+
+async def test_update_returns_the_pre_image(storage):
+    task = make_task(USER, status="pending")
+    await storage.insert_task(task)
+    before = await storage.update_task(USER, task["id"], {"status": "completed"}, {})
+    assert (before["status"], before["version"]) == ("pending", 1)
+    after = await storage.find_task(USER, task["id"])
+    assert (after["status"], after["version"]) == ("completed", 2)
+
+
+async def test_one_of_many_racing_versioned_updates_wins(storage):
+    task = make_task(USER)
+    await storage.insert_task(task)
+    results = await asyncio.gather(*(
+        storage.update_task(USER, task["id"], {"title": f"Edit {n}"}, {}, versions=[1]) for n in range(8)
+    ))
+    winners = [n for n, before in enumerate(results) if before is not None]
+    assert len(winners) == 1
+    current = await storage.find_task(USER, task["id"])
+    assert (current["title"], current["version"]) == (f"Edit {winners[0]}", 2)
+
+
+async def test_racing_unversioned_updates_all_apply(storage):
+    task = make_task(USER)
+    await storage.insert_task(task)
+    results = await asyncio.gather(*(
+        storage.update_task(USER, task["id"], {"title": f"Edit {n}"}, {}) for n in range(8)
+    ))
+    # Each saw a distinct version, so every pre-image is exact
+    assert sorted(before["version"] for before in results) == list(range(1, 9))
+    assert (await storage.find_task(USER, task["id"]))["version"] == 9
+
+
+async def test_counted_field_guard_keeps_deltas_exact(storage):
+    task = make_task(USER, status="pending")
+    await storage.insert_task(task)
+    results = await asyncio.gather(*(
+        storage.update_task(USER, task["id"], {"status": "completed"}, {"status": "pending"}) for _ in range(4)
+    ))
+    assert sum(before is not None for before in results) == 1
+
+
+async def test_missing_or_foreign_task_is_not_updated(storage):
+    task = make_task(USER)
+    await storage.insert_task(task)
+    assert await storage.update_task(USER, "missing", {"title": "x"}, {}) is None
+    assert await storage.update_task("someone-else", task["id"], {"title": "x"}, {}) is None
+    assert (await storage.find_task(USER, task["id"]))["version"] == 1